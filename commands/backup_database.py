@@ -0,0 +1,64 @@
+#######################
+# Dennis MUD          #
+# backup_database.py  #
+# Copyright 2021      #
+# Michael D. Reiley   #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+NAME = "backup database"
+CATEGORIES = ["wizard"]
+USAGE = "backup database"
+DESCRIPTION = """(WIZARDS ONLY) Take a backup of the world database right away.
+
+The backup is compressed and written in the background, and old backups are rotated out as configured.
+
+Ex. `backup database`"""
+
+
+def COMMAND(console, args):
+    # Perform initial checks.
+    if not COMMON.check(NAME, console, args, argc=0, wizard=True):
+        return False
+
+    # Make sure backups are enabled.
+    backups = console.router.backups
+    if not backups or not backups.enabled:
+        console.msg("{0}: Backups are disabled on this server.".format(NAME))
+        return False
+
+    # Only one backup can be written at a time.
+    if backups.running:
+        console.msg("{0}: A backup is already being written.".format(NAME))
+        return False
+
+    # Take the backup, writing it on a worker thread if the reactor is running.
+    reactor = getattr(console.router, "_reactor", None)
+    if reactor:
+        filename = backups.backup(reactor.callInThread, reactor.callFromThread)
+    else:
+        filename = backups.backup()
+    if not filename:
+        console.msg("{0}: ERROR: Could not take a backup of the database.".format(NAME))
+        return False
+    console.msg("{0}: Writing backup: {1}".format(NAME, filename))
+    return True
@@ -52,47 +52,43 @@ def COMMAND(console, args):
     if not thisitem:
         return False
 
-    # Delete the item from the database.
-    console.database.delete_item(thisitem)
-
-    # The item is duplified, so start by deleting it from every user's inventory.
-    if thisitem["duplified"]:
-        for user in console.router.users.values():
-            try:  # Trap to catch a rare crash
-                if itemid in user["console"].user["inventory"]:
-                    user["console"].user["inventory"].remove(itemid)
-                    user["console"].msg("{0} vanished from your inventory.".format(thisitem["name"]))
-                    console.database.upsert_user(user["console"].user)
-                if itemid in user["console"].user["equipment"]:
-                    user["console"].user["equipment"].remove(itemid)
-                    user["console"].msg("{0} vanished from your hands.".format(thisitem["name"]))
-                    console.database.upsert_user(user["console"].user)
-            except:
-                with open('break_item_trap.txt', 'w') as file:
-                    file.write("itemid: {0}, u: {1}".format(str(itemid), user))
-                    file.write("console: {0}".format(user["console"]))
-                    file.write("user: {0}".format(user["console"].user))
-
-    # If the item is duplified or we are a wizard, check all rooms for the presence of the item, and delete.
-    if thisitem["duplified"] or console.user["wizard"]:
-        for room in console.database.rooms.all():
-            print(room["name"])
-            if itemid in room["items"]:
+    # Find everything holding the item before it is gone.
+    holders = console.database.item_holders(itemid)
+
+    # Break the item and clean up after it in a single write.
+    with console.database.transaction():
+        # Delete the item from the database.
+        console.database.delete_item(thisitem)
+
+        # The item is duplified, so start by deleting it from every user's inventory and equipment, so that offline
+        # users aren't left holding it. Logged in users have to be changed through their console record.
+        if thisitem["duplified"]:
+            for kind, where in (("inventory", "inventory"), ("equipment", "hands")):
+                for user in holders[kind]:
+                    user = console.shell.user_by_name(user["name"])
+                    if itemid in user[kind]:
+                        user[kind].remove(itemid)
+                        console.shell.msg_user(user["name"], "{0} vanished from your {1}.".format(
+                            thisitem["name"], where))
+                        console.database.upsert_user(user)
+
+        # If the item is duplified or we are a wizard, check all rooms for the presence of the item, and delete.
+        if thisitem["duplified"] or console.user["wizard"]:
+            for room in holders["rooms"]:
                 room["items"].remove(itemid)
                 console.database.upsert_room(room)
-    
-    # Check if containers have it.
-    if thisitem["duplified"] or console.user["wizard"]:
-        for item in console.database.items.all():
-            if itemid in item["container"]["inventory"]:
+
+        # Check if containers have it.
+        if thisitem["duplified"] or console.user["wizard"]:
+            for item in holders["containers"]:
                 item["container"]["inventory"].remove(itemid)
                 console.database.upsert_item(item)
 
-    # It's still in our inventory, so it must not have been duplified. Delete it from our inventory now.
-    if itemid in console.user["inventory"] and not thisitem["duplified"]:
-        console.user["inventory"].remove(itemid)
-        console.msg("{0} vanished from your inventory.".format(thisitem["name"]))
-        console.database.upsert_user(console.user)
+        # It's still in our inventory, so it must not have been duplified. Delete it from our inventory now.
+        if itemid in console.user["inventory"] and not thisitem["duplified"]:
+            console.user["inventory"].remove(itemid)
+            console.msg("{0} vanished from your inventory.".format(thisitem["name"]))
+            console.database.upsert_user(console.user)
 
     # Finished.
     console.msg("{0}: Done.".format(NAME))
@@ -35,6 +35,9 @@ Or rather deletes a user. All ownership will be deleted, unowned items will be o
 
 Ex. `break user alice` to remove the user called alice."""
 
+# This command goes through whole tables, so it runs against a database snapshot on a worker thread.
+HEAVY = True
+
 
 def COMMAND(console, args):
     # Perform initial checks.
@@ -56,34 +59,27 @@ def COMMAND(console, args):
     #    console.msg("{0}: You cannot break an occupied room.".format(NAME))
     #    return False
 
-    for thisroom in console.database.rooms.all():
-        # Lookup the target item and perform item checks.
-        #thisroom = COMMON.check_room(NAME, console, roomid)
-        if targetuser["name"] in thisroom["owners"]:
-            if len(thisroom["owners"])<2: thisroom["owners"]=["<world>"]
-            else: thisroom["owners"].remove(targetuser["name"])
-            
-            for exitid in thisroom["exits"]:
-                if targetuser["name"] in exitid["owners"]:
-                    if len(exitid["owners"])<2: exitid["owners"]=["<world>"]
-                    else: exitid["owners"].remove(targetuser["name"])
-            console.database.upsert_room(thisroom)
+    # Take the user off the owners of their rooms and the exits in them, leaving them to the world if nobody is left.
+    for thisroom in console.database.find_by("rooms", "owners", targetuser["name"]):
+        if len(thisroom["owners"])<2: thisroom["owners"]=["<world>"]
+        else: thisroom["owners"].remove(targetuser["name"])
+        
+        for exitid in thisroom["exits"]:
+            if targetuser["name"] in exitid["owners"]:
+                if len(exitid["owners"])<2: exitid["owners"]=["<world>"]
+                else: exitid["owners"].remove(targetuser["name"])
+        console.database.upsert_room(thisroom)
 
-    # If the room contains items, return them to their primary owners.
-    for thisitem in console.database.items.all():
-        # Lookup the target item and perform item checks.
-        #thisitem = COMMON.check_item(NAME, console, itemid)
-        if targetuser["name"] in thisitem["owners"]:
-            if len(thisitem["owners"])<2: thisitem["owners"]=["<world>"]
-            else: thisitem["owners"].remove(targetuser["name"])
-            console.database.upsert_item(thisitem)
+    # Do the same for the items they own.
+    for thisitem in console.database.find_by("items", "owners", targetuser["name"]):
+        if len(thisitem["owners"])<2: thisitem["owners"]=["<world>"]
+        else: thisitem["owners"].remove(targetuser["name"])
+        console.database.upsert_item(thisitem)
 
-    for user in console.database.users.all():
-        if user["name"] == targetuser["name"]:
-            console.database.delete_user(user)
-            # Finished.
-            console.msg("{0}: Done.".format(NAME))
-            return True
+    if console.database.delete_user(targetuser):
+        # Finished.
+        console.msg("{0}: Done.".format(NAME))
+        return True
     console.msg("{0}: Couldn't find that user. This shouldn't happen. Ownerships have been altered.".format(NAME))
     return False
 
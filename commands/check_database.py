@@ -0,0 +1,116 @@
+#######################
+# Dennis MUD          #
+# check_database.py   #
+# Copyright 2021      #
+# Michael D. Reiley   #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+import traceback
+
+from lib import fsck
+
+NAME = "check database"
+CATEGORIES = ["wizard"]
+USAGE = "check database [repair]"
+DESCRIPTION = """(WIZARDS ONLY) Check the world database for broken references.
+
+This looks for exits and entrances that don't match, items and rooms that are referenced but don't exist,
+items with no location, telekeys paired to missing rooms, containers that hold themselves, and users listed in rooms
+they aren't in. The check runs in the background, and its results are reported when it finishes.
+If `repair` is given, every problem found that is still there is fixed in a single write.
+Paged worlds can only be checked offline, with dbfsck.py.
+
+Ex. `check database`
+Ex2. `check database repair`"""
+
+
+def COMMAND(console, args):
+    # Perform initial checks.
+    if not COMMON.check(NAME, console, args, argmax=1, wizard=True):
+        return False
+    if args and args[0] != "repair":
+        console.msg("Usage: " + USAGE)
+        return False
+
+    # Check a snapshot of the world, so the check can't see changes made while it runs. Nothing is copied up front.
+    # Paged worlds can't be snapshotted, since most of them aren't in memory.
+    snapshot = console.database.snapshot()
+    if not snapshot:
+        console.msg("{0}: The database is paged, so it can only be checked offline, with dbfsck.py.".format(NAME))
+        return False
+
+    # Gather the world from the snapshot in the layout the checker reads. This goes through every document, so it
+    # runs along with the check.
+    def check():
+        try:
+            tables = {tablename: {str(key): doc for key, doc in zip(snapshot.keys(tablename),
+                                                                     snapshot.documents(tablename))}
+                      for tablename in ("rooms", "items", "users")}
+            return fsck.check(tables, set(snapshot.online_users()))
+        except:
+            console.log.error("Error while checking the database.")
+            console.log.error(traceback.format_exc(1))
+            return None
+
+    # Report the results, and repair if asked. This runs on the reactor thread, like any other command.
+    def finish(issues):
+        console.database.release(snapshot)
+        if issues is None:
+            console.msg("{0}: ERROR: Internal command error.".format(NAME))
+            return
+        for kind, table, key, detail, repairs in issues:
+            console.msg("{0}: {1}: {2} {3}: {4}".format(NAME, fsck.CHECKS[kind], table[:-1], key, detail))
+        console.msg("{0}: Found {1} problems.".format(NAME, len(issues)))
+        if not issues or not args:
+            return
+
+        # The world may have changed since the check, so only repair the problems that are still there.
+        lookups = {"rooms": console.database.room_by_id, "items": console.database.item_by_id,
+                   "users": console.database.user_by_name}
+        upserts = {"rooms": console.database.upsert_room, "items": console.database.upsert_item,
+                   "users": console.database.upsert_user}
+        current = [issue for issue in issues if fsck.verify(
+            issue, lambda table, key: lookups[table](key),
+            lambda itemid: any(console.database.item_holders(itemid).values()),
+            set(console.database.online_users()))]
+        if len(current) < len(issues):
+            console.msg("{0}: Skipped {1} problems that were fixed while checking.".format(
+                NAME, len(issues) - len(current)))
+        issues = current
+
+        # Look up the current copy of each document, and save all of the repairs in one write.
+        with console.database.transaction():
+            changed = fsck.repair(issues, lambda table, key: lookups[table](key))
+            for table, key, document in changed:
+                upserts[table](document)
+        console.log.info("Repaired {count} documents in the database.", count=len(changed))
+        console.msg("{0}: Repaired {1} documents.".format(NAME, len(changed)))
+
+    # Check the world on a worker thread if the reactor is running, so the server keeps responding.
+    reactor = getattr(console.router, "_reactor", None)
+    if reactor:
+        console.msg("{0}: Checking the database in the background...".format(NAME))
+        reactor.callInThread(lambda: reactor.callFromThread(finish, check()))
+    else:
+        finish(check())
+    return True
@@ -0,0 +1,46 @@
+#######################
+# Dennis MUD          #
+# flush_database.py   #
+# Copyright 2018-2021 #
+# Michael D. Reiley   #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+NAME = "flush database"
+CATEGORIES = ["wizard"]
+USAGE = "flush database"
+DESCRIPTION = """(WIZARDS ONLY) Write any database changes being held in memory to disk right away.
+
+This is only useful when the server is running in write-behind mode, where changes are normally written on an interval.
+
+Ex. `flush database`"""
+
+
+def COMMAND(console, args):
+    # Perform initial checks.
+    if not COMMON.check(NAME, console, args, argc=0, wizard=True):
+        return False
+
+    # Write out the held changes and report how many documents were written.
+    count = console.database.flush()
+    console.msg("{0}: Done. ({1} changed documents written)".format(NAME, count))
+    return True
@@ -112,11 +112,10 @@ def COMMAND(console, args):
                                    "{0} gave you {1}.".format(console.user["nick"],
                                                               COMMON.format_item(NAME, thisitem["name"])))
 
-            # Update our user document.
-            console.database.upsert_user(console.user)
-
-            # Update the target user's document.
-            console.database.upsert_user(targetuser)
+            # Update our user document and the target user's document.
+            with console.database.transaction():
+                console.database.upsert_user(console.user)
+                console.database.upsert_user(targetuser)
 
             # Finished.
             return True
@@ -212,9 +212,10 @@ def COMMAND(console, args):
                                              exclude=console.user["name"])
 
             # Save this room, the destination room, and the current user.
-            console.database.upsert_room(thisroom)
-            console.database.upsert_room(destroom)
-            console.database.upsert_user(console.user)
+            with console.database.transaction():
+                console.database.upsert_room(thisroom)
+                console.database.upsert_room(destroom)
+                console.database.upsert_user(console.user)
 
             # If autolook is enabled, look.
             if console.user["autolook"]["enabled"]:
@@ -32,23 +32,26 @@ DESCRIPTION = """List all items in the world that you own.
 
 If you are a wizard, you will see a list of all items that exist."""
 
+# This command goes through whole tables, so it runs against a database snapshot on a worker thread.
+HEAVY = True
+
 
 def COMMAND(console, args):
     # Perform initial checks.
     if not COMMON.check(NAME, console, args, argc=0):
         return False
 
-    # Sort all items in the database by ID.
-    allitems = sorted(console.database.items.all(), key=lambda k: k["id"])
+    # Wizards see all items in the database, sorted by ID. Everyone else sees the items they own.
+    if console.user["wizard"]:
+        allitems = console.database.documents("items")
+    else:
+        allitems = console.database.find_by("items", "owners", console.user["name"])
 
-    # Iterate through the items, checking whether we own each one (or are a wizard),
-    # and keeping track of how many items we found.
+    # List out the items, keeping track of how many items we found.
     itemcount = 0
     for thisitem in allitems:
-        # We either own this item, or we are a wizard. List it out.
-        if console.user["name"] in thisitem["owners"] or console.user["wizard"]:
-            console.msg("{0} ({1})".format(thisitem["name"], thisitem["id"]))
-            itemcount += 1
+        console.msg("{0} ({1})".format(thisitem["name"], thisitem["id"]))
+        itemcount += 1
 
     # We found nothing. If we are a wizard, that means no items exist. Otherwise, it means we don't own any.
     if not itemcount:
@@ -32,23 +32,26 @@ DESCRIPTION = """List all rooms in the world that you own.
 
 If you are a wizard, you will see a list of all rooms that exist."""
 
+# This command goes through whole tables, so it runs against a database snapshot on a worker thread.
+HEAVY = True
+
 
 def COMMAND(console, args):
     # Perform initial checks.
     if not COMMON.check(NAME, console, args, argc=0):
         return False
 
-    # Sort all rooms in the database by ID.
-    allrooms = sorted(console.database.rooms.all(), key=lambda k: k["id"])
+    # Wizards see all rooms in the database, sorted by ID. Everyone else sees the rooms they own.
+    if console.user["wizard"]:
+        allrooms = console.database.documents("rooms")
+    else:
+        allrooms = console.database.find_by("rooms", "owners", console.user["name"])
 
-    # Iterate through the rooms, checking whether we own each one (or are a wizard),
-    # and keeping track of whether we found anything at all.
+    # List out the rooms, keeping track of whether we found anything at all.
     roomcount = 0
     for thisroom in allrooms:
-        # We either own this room, or we are a wizard. List it out.
-        if console.user["name"] in thisroom["owners"] or console.user["wizard"]:
-            console.msg("{0} ({1})".format(thisroom["name"], thisroom["id"]))
-            roomcount += 1
+        console.msg("{0} ({1})".format(thisroom["name"], thisroom["id"]))
+        roomcount += 1
 
     # We found nothing. At least the first room must exist, so that means we just don't own any rooms.
     if not roomcount:
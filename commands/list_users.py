@@ -33,27 +33,32 @@ DESCRIPTION = """List all online users in the world.
 
 If you are a wizard, you will see a list of all registered users, including offline users."""
 
+# This command goes through whole tables, so it runs against a database snapshot on a worker thread.
+HEAVY = True
+
 
 def COMMAND(console, args):
     # Perform initial checks.
     if not COMMON.check(NAME, console, args, argc=0):
         return False
 
-    # Sort all users in the database by username.
-    allusers = sorted(console.database.users.all(), key=lambda k: k["name"])
+    # Sort the online users by username. Wizards get all users in the database.
+    onlineusers = [console.database.user_by_name(username) for username in sorted(console.database.online_users())]
+    if console.user["wizard"]:
+        allusers = sorted(console.database.documents("users"), key=lambda k: k["name"])
+    else:
+        allusers = onlineusers
 
-    # Iterate through the users, checking whether each one is online or offline,
-    # and keeping track of how many were online vs offline.
+    # Keep track of how many users were online vs offline.
     online_count = 0
     offline_count = 0
     if len(allusers):
-        for thisuser in allusers:
-            # Everyone can see which users are online. List them out and keep count.
-            if console.database.online(thisuser["name"]):
-                console.msg("{0} ({1})".format(thisuser["nick"], thisuser["name"]))
-                online_count += 1
+        # Everyone can see which users are online. List them out and keep count.
+        for thisuser in onlineusers:
+            console.msg("{0} ({1})".format(thisuser["nick"], thisuser["name"]))
+            online_count += 1
 
-        # If we are a wizard, iterate through again and list out the offline users this time, and keep count.
+        # If we are a wizard, list out the offline users this time, and keep count.
         if console.user["wizard"]:
             for thisuser in allusers:
                 if not console.database.online(thisuser["name"]):
@@ -116,11 +116,10 @@ def COMMAND(console, args):
                             console.shell.broadcast_room(console, "{0} has put {1} into {2}.".format(
                                 console.user["nick"], COMMON.format_item(NAME, thisitem["name"]),COMMON.format_item(NAME, thiscontainer["name"])))
 
-                    # Update the room document.
-                    console.database.upsert_item(thiscontainer)
-
-                    # Update the user document.
-                    console.database.upsert_user(console.user)
+                    # Update the container document and the user document.
+                    with console.database.transaction():
+                        console.database.upsert_item(thiscontainer)
+                        console.database.upsert_user(console.user)
                     return True
                 
     # We didn't find the requested item. Check for a partial match.
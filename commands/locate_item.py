@@ -63,38 +63,47 @@ def COMMAND(console, args):
             return True
         found_something = True
 
+    # Find everything else holding the item.
+    holders = console.database.item_holders(itemid)
+
     # Check if a container is holding the item.
-    for targetitem in console.database.items.all():
+    for targetitem in holders["containers"]:
         if targetitem["container"]["enabled"]:
-            if itemid in targetitem["container"]["inventory"]:
-                console.msg("{0}: {1} (ID: {2}) is in the inventory of this container: {3} (ID: {4}).".format(NAME, thisitem["name"], thisitem["id"],
-                                                                               targetitem["name"],targetitem["id"]))
-                # If the item is duplified we need to keep looking for other copies.
-                if not thisitem["duplified"]:
-                    return True
-                found_something = True
-
-    # Check if someone else is holding the item.
-    for targetuser in console.database.users.all():
-        if targetuser["name"] == console.user["name"]:
-            continue
-        if itemid in targetuser["inventory"]:
-            console.msg("{0}: {1} (ID: {2}) is in the inventory of: {3}.".format(NAME, thisitem["name"], thisitem["id"],
-                                                                           targetuser["name"]))
+            console.msg("{0}: {1} (ID: {2}) is in the inventory of this container: {3} (ID: {4}).".format(NAME, thisitem["name"], thisitem["id"],
+                                                                           targetitem["name"],targetitem["id"]))
             # If the item is duplified we need to keep looking for other copies.
             if not thisitem["duplified"]:
                 return True
             found_something = True
 
+    # Check if someone else is holding the item.
+    for targetuser in holders["inventory"]:
+        if targetuser["name"] == console.user["name"]:
+            continue
+        console.msg("{0}: {1} (ID: {2}) is in the inventory of: {3}.".format(NAME, thisitem["name"], thisitem["id"],
+                                                                       targetuser["name"]))
+        # If the item is duplified we need to keep looking for other copies.
+        if not thisitem["duplified"]:
+            return True
+        found_something = True
+
+    # Check if anyone is holding the item in their hands.
+    for targetuser in holders["equipment"]:
+        console.msg("{0}: {1} (ID: {2}) is in the hands of: {3}.".format(NAME, thisitem["name"], thisitem["id"],
+                                                                   targetuser["name"]))
+        # If the item is duplified we need to keep looking for other copies.
+        if not thisitem["duplified"]:
+            return True
+        found_something = True
+
     # Check if the item is in a room.
-    for targetroom in console.database.rooms.all():
-        if itemid in targetroom["items"]:
-            console.msg("{0}: {1} (ID: {2}) is in room: {3} (ID: {4})".format(NAME, thisitem["name"], thisitem["id"],
-                                                                     targetroom["name"], targetroom["id"]))
-            # If the item is duplified we need to keep looking for other copies.
-            if not thisitem["duplified"]:
-                return True
-            found_something = True
+    for targetroom in holders["rooms"]:
+        console.msg("{0}: {1} (ID: {2}) is in room: {3} (ID: {4})".format(NAME, thisitem["name"], thisitem["id"],
+                                                                 targetroom["name"], targetroom["id"]))
+        # If the item is duplified we need to keep looking for other copies.
+        if not thisitem["duplified"]:
+            return True
+        found_something = True
 
     # Couldn't find the item.
     if not found_something:
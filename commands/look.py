@@ -68,8 +68,9 @@ def COMMAND(console, args):
 
         # Build and show the user list.
         userlist = []
-        for user in thisroom["users"]:
-            if console.database.user_by_name(user)["ghost"]!=True: userlist.append(console.database.user_by_name(user)["nick"])
+        for user in console.database.users_in_room(thisroom["id"]):
+            user = console.database.user_by_name(user)
+            if user["ghost"]!=True: userlist.append(user["nick"])
         if len(userlist)>2:
             for aex in range(len(userlist)):
                 if aex==len(userlist)-1: userlist[aex]="and "+userlist[aex]
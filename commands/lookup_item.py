@@ -38,11 +38,10 @@ def COMMAND(console, args):
     if not COMMON.check(NAME, console, args, argmin=1):
         return False
 
-    # Search through all of the items.
-    for item in console.database.items.all():
-        if item["name"].lower() == ' '.join(args).lower():
-            console.msg("{0}: {1}".format(item["name"], item["id"]))
-            return True
+    # Look up the item by name.
+    for item in console.database.find_by("items", "name", ' '.join(args)):
+        console.msg("{0}: {1}".format(item["name"], item["id"]))
+        return True
 
     # Couldn't find the item.
     console.msg("{0}: Found no such item.".format(NAME))
@@ -38,11 +38,10 @@ def COMMAND(console, args):
     if not COMMON.check(NAME, console, args, argmin=1):
         return False
 
-    # Search through all of the rooms.
-    for room in console.database.rooms.all():
-        if room["name"].lower() == ' '.join(args).lower():
-            console.msg("{0}: {1}".format(room["name"], room["id"]))
-            return True
+    # Look up the room by name.
+    for room in console.database.find_by("rooms", "name", ' '.join(args)):
+        console.msg("{0}: {1}".format(room["name"], room["id"]))
+        return True
 
     # Couldn't find the room.
     console.msg("{0}: Found no such room.".format(NAME))
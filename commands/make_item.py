@@ -67,24 +67,14 @@ def COMMAND(console, args):
         console.msg("{0}: Very funny.".format(NAME))
         return False
 
-    # Get a list of all items, sorted in reverse order.
-    allitems = sorted(console.database.items.all(), reverse=True, key=lambda k: k["id"])
-
     # Make sure an item by this name does not already exist.
-    for item in allitems:
-        if item["name"].lower() == itemname.lower():
-            console.msg("{0}: An item by this name already exists.".format(NAME))
-            return False
-
-    # Find the highest numbered currently existing item ID.
-    if allitems:
-        lastitem = allitems[0]["id"]
-    else:
-        lastitem = -1
+    if console.database.find_by("items", "name", itemname):
+        console.msg("{0}: An item by this name already exists.".format(NAME))
+        return False
 
-    # Create our new item with an ID one higher than the last item.
+    # Create our new item with the next free item ID.
     newitem = {
-        "id": lastitem + 1,
+        "id": console.database.next_id("items"),
         "name": itemname,
         "desc": "",
         "action": "",
@@ -114,8 +104,9 @@ def COMMAND(console, args):
 
     # Add the new item to the our inventory, and save the item.
     console.user["inventory"].append(newitem["id"])
-    console.database.upsert_user(console.user)
-    console.database.upsert_item(newitem)
+    with console.database.transaction():
+        console.database.upsert_user(console.user)
+        console.database.upsert_item(newitem)
 
     # Show the item ID.
     console.msg("{0}: Done. (itemid: {1})".format(NAME, newitem["id"]))
@@ -77,7 +77,7 @@ def COMMAND(console, args):
             return False
         elif userconsole["posture"]=="sleeping":
             console.shell.broadcast_room(console,"{0} whispers some words in the ears of {1}.".format(console.user["nick"],targetuser["nick"]))
-            destroom=random.choice(console.database.rooms.all())
+            destroom=console.database.room_by_id(random.choice(console.database.keys("rooms")))
             thisroom = COMMON.check_room(NAME, console, console.user["room"])
             # Somehow we got a nonexistent room. Log and report it.
             if not destroom:
@@ -65,8 +65,8 @@ def COMMAND(console, args):
 
     # Make sure a room by this name does not already exist.
     # Make an exception if that is the room we are renaming. (changing case)
-    for room in console.database.rooms.all():
-        if room["name"].lower() == roomname.lower() and room["name"].lower() != thisroom["name"].lower():
+    for room in console.database.find_by("rooms", "name", roomname):
+        if room["name"].lower() != thisroom["name"].lower():
             console.msg("{0}: A room by that name already exists.".format(NAME))
             return False
 
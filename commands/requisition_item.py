@@ -61,33 +61,37 @@ def COMMAND(console, args):
     # Announce the requisitioning.
     console.msg("Requisitioned item: {0} ({1})".format(thisitem["name"], thisitem["id"]))
 
-    # Don't remove duplified items.
-    if not thisitem["duplified"]:
-        # If the item is in a room's item list, remove it and announce its disappearance.
-        for room in console.database.rooms.all():
-            if itemid in room["items"]:
+    # Take the item from wherever it is and give it to us in a single write.
+    with console.database.transaction():
+        # Don't remove duplified items.
+        if not thisitem["duplified"]:
+            holders = console.database.item_holders(itemid)
+
+            # If the item is in a room's item list, remove it and announce its disappearance.
+            for room in holders["rooms"]:
                 room["items"].remove(itemid)
                 console.router.broadcast_room(room["id"], "{0} vanished from the room.".format(
                     COMMON.format_item(NAME, thisitem["name"], upper=True)))
                 console.database.upsert_room(room)
 
-        # If the item is in a container's inventory, remove it.
-        for cont in console.database.items.all():
-            if cont["container"]["enabled"]:
-                if itemid in cont["container"]["inventory"]:
+            # If the item is in a container's inventory, remove it.
+            for cont in holders["containers"]:
+                if cont["container"]["enabled"]:
                     cont["container"]["inventory"].remove(itemid)
                     console.database.upsert_item(cont)
-        
-        # If the item is in someone's inventory, remove it and announce its disappearance.
-        for user in console.router.users.values():
-            if itemid in user["console"].user["inventory"]:
-                user["console"].user["inventory"].remove(itemid)
-                user["console"].msg("{0} vanished from your inventory.".format(
-                    COMMON.format_item(NAME, thisitem["name"], upper=True)))
-                console.database.upsert_user(user["console"].user)
 
-    # Place the item in our inventory and announce its appearance.
-    console.user["inventory"].append(itemid)
-    console.database.upsert_user(console.user)
+            # If the item is in a user's inventory, online or not, remove it and announce its disappearance.
+            # Logged in users have to be changed through their console record.
+            for user in holders["inventory"]:
+                user = console.shell.user_by_name(user["name"])
+                if itemid in user["inventory"]:
+                    user["inventory"].remove(itemid)
+                    console.shell.msg_user(user["name"], "{0} vanished from your inventory.".format(
+                        COMMON.format_item(NAME, thisitem["name"], upper=True)))
+                    console.database.upsert_user(user)
+
+        # Place the item in our inventory and announce its appearance.
+        console.user["inventory"].append(itemid)
+        console.database.upsert_user(console.user)
     console.msg("{0} appeared in your inventory.".format(COMMON.format_item(NAME, thisitem["name"], upper=True)))
     return True
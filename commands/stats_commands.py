@@ -0,0 +1,86 @@
+#######################
+# Dennis MUD          #
+# stats_commands.py   #
+# Copyright 2021      #
+# Michael D. Reiley   #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+import time
+
+NAME = "stats commands"
+CATEGORIES = ["wizard"]
+USAGE = "stats commands [calls|errors|latency|output|reset]"
+DESCRIPTION = """(WIZARDS ONLY) Show call counters and latencies for each command since the server started.
+
+For each command this shows how many times it was called, how many calls raised an error or failed,
+the 50th, 90th, and 99th percentile and maximum time taken in milliseconds,
+and the average number of lines and bytes of output sent per call.
+The list is sorted by the number of calls, or by errors, 99th percentile latency, or bytes of output if given.
+If `reset` is given, the stats are cleared instead.
+
+Ex. `stats commands`
+Ex2. `stats commands latency`"""
+
+# The stat each sort order sorts by, from highest to lowest.
+SORTS = {
+    "calls": lambda stats: stats["calls"],
+    "errors": lambda stats: stats["errors"] + stats["failures"],
+    "latency": lambda stats: stats["latency_ms"]["p99"],
+    "output": lambda stats: stats["bytes"]
+}
+
+
+def COMMAND(console, args):
+    # Perform initial checks.
+    if not COMMON.check(NAME, console, args, argmax=1, wizard=True):
+        return False
+    if args and args[0] not in SORTS and args[0] != "reset":
+        console.msg("Usage: " + USAGE)
+        return False
+
+    # Clear the stats if asked.
+    if args and args[0] == "reset":
+        console.shell.stats.reset()
+        console.msg("{0}: Cleared the command stats.".format(NAME))
+        return True
+
+    # Get the report now, so this call isn't counted in it.
+    report = console.shell.stats.report()
+    since = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(console.shell.stats.since))
+    console.msg("{0}: {1} calls of {2} commands since {3}.".format(NAME, sum(stats["calls"] for stats in report.values()),
+                                                                  len(report), since))
+    if not report:
+        return True
+
+    # Show one row per command, latencies in milliseconds and output as the average per call.
+    width = max(len(name) for name in report) + 2
+    console.msg("{0}{1:>7}{2:>7}{3:>7}{4:>9}{5:>9}{6:>9}{7:>9}{8:>7}{9:>8}".format(
+        "command".ljust(width), "calls", "errors", "fails", "p50", "p90", "p99", "max", "lines", "bytes"), True)
+    sort = SORTS[args[0] if args else "calls"]
+    for name in sorted(report, key=lambda name: (-sort(report[name]), name)):
+        stats = report[name]
+        latency = stats["latency_ms"]
+        console.msg("{0}{1:>7}{2:>7}{3:>7}{4:>9.2f}{5:>9.2f}{6:>9.2f}{7:>9.2f}{8:>7.1f}{9:>8.0f}".format(
+            name.ljust(width), stats["calls"], stats["errors"], stats["failures"], latency["p50"], latency["p90"],
+            latency["p99"], latency["max"], stats["lines"] / stats["calls"], stats["bytes"] / stats["calls"]), True)
+    return True
@@ -0,0 +1,103 @@
+#######################
+# Dennis MUD          #
+# stats_database.py   #
+# Copyright 2021      #
+# Michael D. Reiley   #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+import time
+
+NAME = "stats database"
+CATEGORIES = ["wizard"]
+USAGE = "stats database [commands|reset]"
+DESCRIPTION = """(WIZARDS ONLY) Show counts and timings of database operations since the server started.
+
+For each table this shows how many times each kind of operation was made,
+and the average, 99th percentile, and maximum time taken in milliseconds.
+It also shows how many flushes wrote changes to the storage, how many bytes they wrote, and how long they took.
+If `commands` is given, it shows how many operations and flushes each command caused instead, busiest first.
+If `reset` is given, the stats are cleared instead.
+This only works if database instrumentation is enabled in the server configuration.
+
+Ex. `stats database`
+Ex2. `stats database commands`"""
+
+
+def COMMAND(console, args):
+    # Perform initial checks.
+    if not COMMON.check(NAME, console, args, argmax=1, wizard=True):
+        return False
+    if args and args[0] not in ("commands", "reset"):
+        console.msg("Usage: " + USAGE)
+        return False
+
+    # Make sure instrumentation is enabled.
+    stats = console.database.stats
+    if not stats:
+        console.msg("{0}: Database instrumentation is disabled on this server.".format(NAME))
+        return False
+
+    # Clear the stats if asked.
+    if args and args[0] == "reset":
+        stats.reset()
+        console.msg("{0}: Cleared the database stats.".format(NAME))
+        return True
+
+    # Get the report now, so this command's own operations so far aren't counted in it.
+    report = stats.report()
+    flushes = report["flushes"]
+    since = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(stats.since))
+    console.msg("{0}: {1} operations and {2} flushes since {3}.".format(
+        NAME, sum(counts["count"] for operations in report["operations"].values() for counts in operations.values()),
+        flushes["count"], since))
+
+    # Show how many operations and flushes each command caused, busiest first.
+    if args:
+        totals = {name: sum(sum(operations.values()) for operations in entry["operations"].values())
+                  for name, entry in report["commands"].items()}
+        width = max([len(name) for name in totals] + [len("command")]) + 2
+        console.msg("{0}{1:>12}{2:>9}{3:>12}  {4}".format("command".ljust(width), "operations", "flushes", "bytes",
+                                                          "busiest"), True)
+        for name in sorted(totals, key=lambda name: (-totals[name], name)):
+            entry = report["commands"][name]
+            busiest = sorted(((count, table, operation) for table, operations in entry["operations"].items()
+                              for operation, count in operations.items()), reverse=True)[:3]
+            console.msg("{0}{1:>12}{2:>9}{3:>12}  {4}".format(
+                name.ljust(width), totals[name], entry["flushes"], entry["bytes_written"],
+                ', '.join("{0} {1} x{2}".format(table, operation, count) for count, table, operation in busiest)), True)
+        return True
+
+    # Show one row per table and operation, with latencies in milliseconds.
+    console.msg("{0:<8}{1:<8}{2:>10}{3:>9}{4:>9}{5:>9}".format("table", "op", "count", "mean", "p99", "max"), True)
+    for table in sorted(report["operations"]):
+        for operation, counts in sorted(report["operations"][table].items()):
+            latency = counts["latency_ms"]
+            console.msg("{0:<8}{1:<8}{2:>10}{3:>9.3f}{4:>9.3f}{5:>9.3f}".format(
+                table, operation, counts["count"], latency["mean"], latency["p99"], latency["max"]), True)
+
+    # Show the flushes.
+    if flushes["count"]:
+        console.msg("{0}: Flushed {1} documents in {2} bytes, {3} bytes at most, {4:.3f}ms on average, "
+                    "{5:.3f}ms at most.".format(NAME, flushes["documents"], flushes["bytes"], flushes["max_bytes"],
+                                                flushes["latency_ms"]["mean"], flushes["latency_ms"]["max"]))
+    return True
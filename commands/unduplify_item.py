@@ -69,32 +69,35 @@ def COMMAND(console, args):
         console.database.upsert_user(console.user)
         console.msg("{0} appeared in your inventory.".format(COMMON.format_item(NAME, thisitem["name"], upper=True)))
 
-    # Delete the item from all user inventories except ours, and announce its disappearance.
-    for user in console.router.users.values():
-        if user["console"].user["name"] == console.user["name"]:
-            # Not this user, this is us.
-            continue
-        if itemid in user["console"].user["inventory"]:
-            user["console"].user["inventory"].remove(itemid)
-            user["console"].msg("{0} vanished from your inventory.".format(
-                COMMON.format_item(NAME, thisitem["name"], upper=True)))
-            console.database.upsert_user(user["console"].user)
+    # Remove every other copy of the item and unduplify it in a single write.
+    holders = console.database.item_holders(itemid)
+    with console.database.transaction():
+        # Delete the item from all user inventories except ours, and announce its disappearance.
+        # Logged in users have to be changed through their console record.
+        for user in holders["inventory"]:
+            if user["name"] == console.user["name"]:
+                # Not this user, this is us.
+                continue
+            user = console.shell.user_by_name(user["name"])
+            if itemid in user["inventory"]:
+                user["inventory"].remove(itemid)
+                console.shell.msg_user(user["name"], "{0} vanished from your inventory.".format(
+                    COMMON.format_item(NAME, thisitem["name"], upper=True)))
+                console.database.upsert_user(user)
 
-    # Delete the item from all rooms.
-    for room in console.database.rooms.all():
-        if itemid in room["items"]:
+        # Delete the item from all rooms.
+        for room in holders["rooms"]:
             room["items"].remove(itemid)
             console.database.upsert_room(room)
 
-    # Delete the item from all containers.
-    for item in console.database.items.all():
-        if itemid in item["container"]["inventory"]:
+        # Delete the item from all containers.
+        for item in holders["containers"]:
             item["container"]["inventory"].remove(itemid)
             console.database.upsert_item(item)
 
-    # Unduplify the item.
-    thisitem["duplified"] = False
-    console.database.upsert_item(thisitem)
+        # Unduplify the item.
+        thisitem["duplified"] = False
+        console.database.upsert_item(thisitem)
 
     # Finished.
     console.msg("{0}: Done.".format(NAME))
@@ -140,9 +140,10 @@ def COMMAND(console, args):
                                              exclude=console.user["name"])
 
                 # Save the origin room, the destination room, and our user document.
-                console.database.upsert_room(thisroom)
-                console.database.upsert_room(destroom)
-                console.database.upsert_user(console.user)
+                with console.database.transaction():
+                    console.database.upsert_room(thisroom)
+                    console.database.upsert_room(destroom)
+                    console.database.upsert_user(console.user)
 
                 # Update console's exit list.
                 console.exits = []
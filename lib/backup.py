@@ -0,0 +1,211 @@
+#######################
+# Dennis MUD          #
+# backup.py           #
+# Copyright 2021      #
+# Michael D. Reiley   #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+import gzip
+import json
+import lzma
+import os
+import re
+import time
+import traceback
+
+from lib.logger import Logger
+
+# File extension and opener for each supported compression method.
+COMPRESSION = {"lzma": (".xz", lzma.open), "zlib": (".gz", gzip.open)}
+
+# Backups taken at startup by older versions, named like "world.json.bk1", with the newest numbered 1. They are only
+# removed when rotating if asked to.
+LEGACY_BACKUP = re.compile(r"\.bk[0-9]+$")
+
+
+class BackupManager:
+    """Backup Manager
+
+    Takes compressed snapshots of the world database while the server is running.
+    A DatabaseSnapshot is taken on the calling thread so that the backup reflects one consistent state of the world,
+    and gathering the tables from it, serializing, compression, writing, and rotation are handed off so the reactor is
+    not blocked by them. Paged worlds can't be snapshotted, so their database file is copied and read instead.
+    Backups are plain JSON once decompressed, and can be restored as a TinyDB world file with any backend.
+
+    :ivar running: Whether a backup is currently being written.
+    :ivar last: Filename of the last backup that finished writing, if any.
+    """
+    def __init__(self, database, filename, count, max_age=0, compression="lzma", prune_legacy=False, log=None):
+        """Backup Manager Initializer
+
+        :param database: The DatabaseManager instance to back up.
+        :param filename: The filename of the world database, which backup filenames are based on.
+        :param count: The number of backups to keep. Zero disables backups.
+        :param max_age: Backups older than this many seconds are removed when rotating. Zero disables.
+        :param compression: The compression method, either "lzma" or "zlib".
+        :param prune_legacy: Whether to count and remove the numbered backups of older versions when rotating.
+        :param log: Alternative logging facility, if set.
+        """
+        self.running = False
+        self.last = None
+        self._database = database
+        self._filename = filename
+        self._count = count
+        self._max_age = max_age
+        self._extension, self._open = COMPRESSION[compression]
+        self._prune_legacy = prune_legacy
+        self._log = log or Logger("backup")
+
+    @property
+    def enabled(self):
+        """Whether backups are enabled.
+        """
+        return self._count > 0
+
+    def backup(self, run=None, finish=None):
+        """Take a backup of the world database.
+
+        The current state of the database is captured before this method returns. In paged mode, it is captured when
+        the database file is copied, on the worker thread.
+        If run is given it is called with a function that writes and rotates the backup, so that work can
+        happen on a worker thread. Otherwise the backup is written before returning.
+
+        :param run: Optional callable such as reactor.callInThread, taking a function and its arguments.
+        :param finish: Optional callable such as reactor.callFromThread, used by the worker thread to report back that
+            the backup is finished. Needed along with run.
+        :return: The filename of the new backup, or None if backups are disabled or one is already running.
+        """
+        if not self.enabled or self.running:
+            return None
+        self.running = True
+
+        try:
+            # Write any held changes so the database file and the backup agree, then capture the world. The _info table
+            # isn't part of the snapshot, but outside paged mode dump() just hands over the cached tables, so copying
+            # it is cheap.
+            self._database.flush()
+            snapshot = self._database.snapshot()
+            info = {doc_id: dict(doc) for doc_id, doc in self._database.dump().get("_info", {}).items()} \
+                if snapshot else None
+        except:
+            self.running = False
+            self._log.error("Could not take a snapshot of the database for backup.")
+            self._log.error(traceback.format_exc(1))
+            return None
+
+        filename = self._name()
+        if run:
+            run(self._write, filename, snapshot, info, finish)
+        else:
+            self._write(filename, snapshot, info)
+        return filename
+
+    def backups(self):
+        """List the backup files currently on disk.
+
+        This includes backups written with any compression method, and the numbered backups of older versions if they
+        are being pruned.
+
+        :return: List of backup filenames, oldest first.
+        """
+        directory = os.path.dirname(self._filename)
+        prefix = os.path.basename(self._filename) + "."
+        suffixes = tuple(".bk" + extension for extension, opener in COMPRESSION.values())
+        found = [os.path.join(directory, f) for f in os.listdir(directory or ".")
+                 if f.startswith(prefix) and (f.endswith(suffixes) or (self._prune_legacy and LEGACY_BACKUP.search(f)))]
+        return sorted(found, key=lambda f: (os.path.getmtime(f), f))
+
+    def _name(self):
+        """Choose a filename for a new backup that sorts in the order the backups were taken.
+
+        Backups taken within the same second are told apart by a counter.
+
+        :return: The filename.
+        """
+        base = "{0}.{1}".format(self._filename, time.strftime("%Y%m%d-%H%M%S"))
+        filename = "{0}.bk{1}".format(base, self._extension)
+        count = 1
+        while os.path.exists(filename):
+            filename = "{0}-{1}.bk{2}".format(base, count, self._extension)
+            count += 1
+        return filename
+
+    def _write(self, filename, snapshot, info, finish=None):
+        """Gather, serialize, compress, and write a backup, then rotate old backups.
+
+        :param filename: The filename of the new backup.
+        :param snapshot: The DatabaseSnapshot to back up, or None to read a copy of the database file in paged mode.
+        :param info: The copied _info table, along with the snapshot.
+        :param finish: Optional callable to report back to the calling thread with, as passed to backup().
+        """
+        written = None
+        try:
+            if snapshot:
+                tables = snapshot.dump()
+                tables["_info"] = info
+            else:
+                tables = self._database.read_copy(filename + ".db.tmp")
+
+            # Write to a temporary file first so an interrupted backup never looks like a complete one.
+            data = json.dumps(tables).encode("utf-8")
+            with self._open(filename + ".tmp", "wb") as backupfile:
+                backupfile.write(data)
+            os.replace(filename + ".tmp", filename)
+            written = filename
+            self._log.info("Wrote database backup: {file}", file=filename)
+            self._rotate(filename)
+        except:
+            self._log.error("Could not write database backup: {file}", file=filename)
+            self._log.error(traceback.format_exc(1))
+        if finish:
+            finish(self._finished, written, snapshot)
+        else:
+            self._finished(written, snapshot)
+
+    def _finished(self, filename, snapshot):
+        """Note that a backup is finished, on the thread that started it, and release its snapshot.
+
+        :param filename: The filename of the backup, or None if writing it failed.
+        :param snapshot: The DatabaseSnapshot the backup was taken from, or None.
+        """
+        if snapshot:
+            self._database.release(snapshot)
+        if filename:
+            self.last = filename
+        self.running = False
+
+    def _rotate(self, newest):
+        """Remove backups beyond the configured count and older than the configured age.
+
+        :param newest: The filename of the backup just written, which is never removed.
+        """
+        backups = self.backups()
+        expired = backups[:-self._count]
+        if self._max_age:
+            cutoff = time.time() - self._max_age
+            expired += [f for f in backups[-self._count:] if os.path.getmtime(f) < cutoff and f != newest]
+        for f in expired:
+            try:
+                os.remove(f)
+            except OSError:
+                self._log.warn("Could not remove old database backup: {file}", file=f)
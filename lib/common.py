@@ -854,6 +854,17 @@ def broadcast_action(NAME, console, action):
     return True
 
 
+def partial_match(target, name):
+    """Check if a partial string target matches a name, the way match_partial() does.
+
+    :param target: The lowercase partial string to search for. A leading "the " is also tried without.
+    :param name: The lowercase name to search in.
+
+    :return: True if matched, False if not.
+    """
+    return target in name or target.replace("the ", "", 1) in name
+
+
 def match_partial(NAME, console, target, objtype, room=True, inventory=True, message=True, equipment=True, container=None):
     """Find exits, items, or users matching a partial string target in the current room or user's inventory.
 
@@ -894,7 +905,7 @@ def match_partial(NAME, console, target, objtype, room=True, inventory=True, mes
         exits = thisroom["exits"]
         for ex in range(len(exits)):
             # Check for partial matches.
-            if target in exits[ex]["name"].lower() or target.replace("the ", "", 1) in exits[ex]["name"].lower():
+            if partial_match(target, exits[ex]["name"].lower()):
                 partials.append(exits[ex]["name"].lower())
 
     # Search for a target item.
@@ -917,7 +928,7 @@ def match_partial(NAME, console, target, objtype, room=True, inventory=True, mes
                     continue
 
                 # Check for partial matches.
-                if target in thisitem["name"].lower() or target.replace("the ", "", 1) in thisitem["name"].lower():
+                if partial_match(target, thisitem["name"].lower()):
                     partials.append(thisitem["name"].lower())
 
         if inventory:
@@ -932,7 +943,7 @@ def match_partial(NAME, console, target, objtype, room=True, inventory=True, mes
                     continue
 
                 # Check for partial matches.
-                if target in thisitem["name"].lower() or target.replace("the ", "", 1) in thisitem["name"].lower():
+                if partial_match(target, thisitem["name"].lower()):
                     partials.append(thisitem["name"].lower())
         
         if container:
@@ -947,7 +958,7 @@ def match_partial(NAME, console, target, objtype, room=True, inventory=True, mes
                     continue
 
                 # Check for partial matches.
-                if target in thisitem["name"].lower() or target.replace("the ", "", 1) in thisitem["name"].lower():
+                if partial_match(target, thisitem["name"].lower()):
                     partials.append(thisitem["name"].lower())
         
         if equipment:
@@ -962,7 +973,7 @@ def match_partial(NAME, console, target, objtype, room=True, inventory=True, mes
                     continue
 
                 # Check for partial matches.
-                if target in thisitem["name"].lower() or target.replace("the ", "", 1) in thisitem["name"].lower():
+                if partial_match(target, thisitem["name"].lower()):
                     partials.append(thisitem["name"].lower())
 
 
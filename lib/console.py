@@ -43,7 +43,12 @@ class Console:
     :ivar database: The DatabaseManager instance.
     :ivar log: The Logger for this console.
     :ivar exits: The list of exit names in the current room, if any.
+    :cvar lines_sent: The number of lines sent through msg() by all consoles, for the shell's command stats.
+    :cvar bytes_sent: The number of bytes in those lines.
     """
+    lines_sent = 0
+    bytes_sent = 0
+
     def __init__(self, router, shell, rname, database, log=None):
         """Console Initializer
 
@@ -118,6 +123,8 @@ class Console:
 
         :return: True
         """
+        Console.lines_sent += 1
+        Console.bytes_sent += len(str(message).encode("utf-8", "replace"))
         if self.router.single_user:
             self.log.write(message)
         else:
@@ -143,3 +150,128 @@ class Console:
         """Set self._login_delay to False.
         """
         self._login_delay = False
+
+
+class SnapshotConsole(Console):
+    """Snapshot Console
+
+    Stands in for a user's console while one of their commands runs on a worker thread against a DatabaseSnapshot.
+    It holds the snapshot's copy of the user, and its shell and router are stand-ins too, which answer lookups from the
+    snapshot. Everything that would reach a real console, including messages to other users, is kept to be done by
+    the real console, shell, and router afterward, back on the reactor thread.
+
+    :ivar calls: The calls kept for afterward, as (target, method name, args, kwargs), where the target is one of
+        "console", "shell", or "router".
+    """
+    def __init__(self, console, database):
+        """Snapshot Console Initializer
+
+        :param console: The real console of the user calling the command.
+        :param database: The DatabaseSnapshot the command runs against.
+        """
+        self.calls = []
+        super().__init__(SnapshotRouter(console.router, self.calls), SnapshotShell(console.shell, database, self.calls),
+                         console.rname, database, console.log)
+        self.user = database.user_by_name(console.user["name"]) if console.user else None
+        self.vars = dict(console.vars)
+        self.exits = list(console.exits)
+
+    def msg(self, message, _nbsp=False):
+        """Send Message
+
+        Keep a message to be sent once the command has finished.
+
+        :param message: The message to send.
+        :param _nbsp: Will insert non-breakable spaces for formatting on the websocket frontend.
+
+        :return: True
+        """
+        self.calls.append(("console", "msg", (message, _nbsp), {}))
+        return True
+
+
+class SnapshotShell:
+    """Snapshot Shell
+
+    Stands in for the shell in a SnapshotConsole. Users are looked up in the DatabaseSnapshot, and consoles of other
+    users can't be reached at all. Messages and commands are kept to be passed on to the real shell afterward.
+    """
+    # The shell methods that are kept for afterward. They all return True here.
+    KEPT = ("msg_user", "radiocast", "broadcast", "broadcast_room", "moveplayer", "updatespirit", "command", "call",
+            "help", "usage")
+
+    def __init__(self, shell, database, calls):
+        """Snapshot Shell Initializer
+
+        :param shell: The real Shell.
+        :param database: The DatabaseSnapshot the command runs against.
+        :param calls: The SnapshotConsole's list of calls kept for afterward.
+        """
+        self._commands = shell._commands
+        self._database = database
+        self._calls = calls
+
+    def __getattr__(self, name):
+        """Keep a call to one of the KEPT shell methods for afterward.
+
+        :param name: The name of the method.
+
+        :return: Function standing in for the method.
+        """
+        if name not in SnapshotShell.KEPT:
+            raise AttributeError("Not available to a command running against a snapshot: shell.{0}".format(name))
+        return lambda *args, **kwargs: self._calls.append(("shell", name, args, kwargs)) or True
+
+    def user_by_name(self, username):
+        """Get a user by their name, from the snapshot.
+
+        :return: User Document, or None
+        """
+        return self._database.user_by_name(username.lower())
+
+    def user_by_nick(self, nickname):
+        """Get a user by their nickname, from the snapshot.
+
+        :return: User Document, or None
+        """
+        return self._database.user_by_nick(nickname.lower())
+
+    def console_by_username(self, username):
+        """Consoles live on the reactor thread, so none are handed out to a command running against a snapshot.
+
+        :return: None
+        """
+        return None
+
+
+class SnapshotRouter:
+    """Snapshot Router
+
+    Stands in for the router in a SnapshotConsole. It has no live connections and no reactor, and the messages sent
+    through it are kept to be passed on to the real router afterward.
+    """
+    # The router methods that are kept for afterward. They all return True here.
+    KEPT = ("message", "broadcast_all", "broadcast_room")
+
+    def __init__(self, router, calls):
+        """Snapshot Router Initializer
+
+        :param router: The real Router.
+        :param calls: The SnapshotConsole's list of calls kept for afterward.
+        """
+        self.single_user = router.single_user
+        self.shutting_down = router.shutting_down
+        self.users = {}
+        self._reactor = None
+        self._calls = calls
+
+    def __getattr__(self, name):
+        """Keep a call to one of the KEPT router methods for afterward.
+
+        :param name: The name of the method.
+
+        :return: Function standing in for the method.
+        """
+        if name not in SnapshotRouter.KEPT:
+            raise AttributeError("Not available to a command running against a snapshot: router.{0}".format(name))
+        return lambda *args, **kwargs: self._calls.append(("router", name, args, kwargs)) or True
@@ -25,35 +25,138 @@
 # IN THE SOFTWARE.
 # **********
 
+import collections
+import contextlib
+import copy
+import functools
+import gc
+import hashlib
 import json
 import os
+import pickle
+import time
 import traceback
 
 from lib.logger import Logger
+from lib.stats import DatabaseStats
+from lib.storage import JournalStorage, SQLiteStorage, WriteBehindMiddleware, rehydrate, rehydrate_tables
 
-from tinydb import TinyDB, Query
+from tinydb import TinyDB
+from tinydb.storages import JSONStorage
+from tinydb.table import Document
 
 DB_VERSION = 5
 
+# Bump this when the layout of the binary snapshot changes, so old snapshots are ignored.
+SNAPSHOT_FORMAT = 2
+
+# The TinyDB storage classes that can be chosen with the database backend option.
+BACKENDS = {
+    "tinydb": JSONStorage,
+    "sqlite": SQLiteStorage,
+    "journal": JournalStorage
+}
+
+# The tables that are loaded one zone at a time in paged mode. Their documents are grouped into zones by ID range.
+PAGED_TABLES = ("rooms", "items")
+
+# Secondary indexes kept by the DatabaseManager and searched with find_by(), per table and field.
+# A "multi" field holds a list, and each of its values is indexed. A "normalize" function is applied to the values
+# being indexed and searched for, such as lowercasing names for case-insensitive lookups. A "path" reads the field
+# from inside nested dicts instead of from the top level of the document.
+INDEXES = {
+    "rooms": {
+        "name": {"normalize": str.lower},
+        "owners": {"multi": True},
+        "items": {"multi": True}
+    },
+    "items": {
+        "name": {"normalize": str.lower},
+        "owners": {"multi": True},
+        "telekey": {},
+        "contents": {"path": ["container", "inventory"], "multi": True}
+    },
+    "users": {
+        "room": {},
+        "inventory": {"multi": True},
+        "equipment": {"multi": True}
+    }
+}
+
+# The methods that are counted and timed when instrumentation is enabled, with the kind of operation each one is and the
+# table it works on. A table of None means the table is named by the method's first argument.
+INSTRUMENTED = {
+    "room_by_id": ("get", "rooms"),
+    "item_by_id": ("get", "items"),
+    "user_by_name": ("get", "users"),
+    "user_by_nick": ("get", "users"),
+    "find_by": ("find", None),
+    "keys": ("scan", None),
+    "count": ("count", None),
+    "upsert_room": ("upsert", "rooms"),
+    "upsert_item": ("upsert", "items"),
+    "upsert_user": ("upsert", "users"),
+    "delete_room": ("delete", "rooms"),
+    "delete_item": ("delete", "items"),
+    "delete_user": ("delete", "users")
+}
+
+# Stands in for a key that wasn't in an index when a DatabaseSnapshot was taken.
+_ABSENT = object()
+
+# The indexed table fields that hold item IDs, by the kind of holder they are.
+HOLDERS = {
+    "rooms": ("rooms", "items"),
+    "containers": ("items", "contents"),
+    "inventory": ("users", "inventory"),
+    "equipment": ("users", "equipment")
+}
+
 
 class DatabaseManager:
     """The Database Manager
 
     This manager handles interactions with a TinyDB database corresponding to the current game world.
+    The database is stored either as a single JSON file, as one row per document in an SQLite file, or as a JSON
+    snapshot file plus a journal of the changes made since it was written.
     After documents are pulled from a table and modified, they need to be upserted for the changes to save.
+    In write-behind mode, upserted changes are held in memory and only written to the file when flush() is called.
+    A binary snapshot of the world and its indexes can be written at clean shutdown, so the next startup doesn't have
+    to parse the database file. The database file stays the source of truth, and the snapshot is only used as long as
+    the contents of the database file haven't changed since it was written. The snapshot is a pickle, which can run
+    code when loaded, so it must only be writable by the user the server runs as. Snapshots that aren't are ignored.
+    In paged mode, which needs the SQLite backend, rooms and items are loaded a zone of consecutive IDs at a time when
+    first looked up, and the least recently used zones nobody is in are dropped from memory again to stay within a
+    budget. The secondary indexes and the users are always kept in memory.
+    With instrumentation enabled, the operations in INSTRUMENTED and the storage flushes are counted and timed.
 
     :ivar database: The TinyDB database instance for the world.
     :ivar rooms: The table of all rooms in the database.
     :ivar users: The table of all users in the database.
     :ivar items: The table of all items in the database.
     :ivar defaults: The JSON database defaults configuration.
+    :ivar stats: The DatabaseStats instance if instrumentation is enabled, otherwise None.
     """
-    def __init__(self, filename, defaults, log=None):
+    def __init__(self, filename, defaults, log=None, write_behind=False, max_staleness=0, backend="tinydb",
+                 snapshot=False, sparse=False, paged=False, zone_size=1000, zone_budget=64, instrument=False):
         """Database Manager Initializer
 
         :param filename: The relative or absolute filename of the TinyDB database file.
         :param defaults: The defaults config dict or pseudo-dict.
         :param log: Alternative logging facility, if set. Otherwise use our standard Logger.
+        :param write_behind: Whether to hold changes in memory until flush() is called, instead of writing them
+            to the database file right away.
+        :param max_staleness: In write-behind mode, the maximum number of seconds a change may wait to be written.
+            It is checked when the next change is made, and whenever flush_stale() is called. Zero means no limit.
+        :param backend: The storage backend to use, one of the keys of BACKENDS.
+        :param snapshot: Whether to load the world from a binary snapshot at startup when it is up to date, and to
+            allow writing one with write_snapshot(). The snapshot file must only be writable by the server's user.
+        :param sparse: Whether to leave out fields holding their usual values when writing documents. Once a world
+            has been written sparse, it stays sparse.
+        :param paged: Whether to load rooms and items one zone at a time, as they are needed.
+        :param zone_size: In paged mode, the number of consecutive room or item IDs in a zone.
+        :param zone_budget: In paged mode, the number of zones of each table to keep in memory. Zero means no limit.
+        :param instrument: Whether to count and time database operations and storage flushes.
         """
         self.database = None
         self.rooms = None
@@ -62,11 +165,64 @@ class DatabaseManager:
         self.defaults = defaults
 
         self._info = None
-        self._users_online = []
         self._filename = filename
         self._log = log or Logger("database")
-        self._rooms_cleaned = []
         self._locked = False
+        self._write_behind = write_behind
+        self._max_staleness = max_staleness
+        self._backend = backend
+        self._snapshot = snapshot
+        self._snapshot_path = filename + ".snapshot"
+        self._sparse = sparse
+        self._paged = paged
+        self._zone_size = zone_size
+        self._zone_budget = zone_budget
+
+        # In-memory indexes of room and item documents keyed by their id, so lookups don't scan the tables.
+        self._room_index = {}
+        self._item_index = {}
+
+        # The identity map, holding the one in-memory copy of each document that is handed out to callers.
+        # The indexes hold what was last upserted, which is never changed in place.
+        self._identity = {"rooms": {}, "items": {}, "users": {}}
+
+        # In-memory indexes of user documents keyed by their lowercase name and lowercase nickname.
+        self._user_index = {}
+        self._nick_index = {}
+
+        # Secondary indexes from INDEXES, mapping each table and field to a dict of keys to sets of IDs or usernames.
+        self._secondary = {table: {field: {} for field in INDEXES[table]} for table in INDEXES}
+
+        # The undo log of the current transaction, or None if there isn't one.
+        self._undo = None
+
+        # The next room and item IDs to hand out, which are also saved in the info record.
+        self._next_ids = {}
+
+        # The presence registry: the console of each online user by lowercase username, the room each of them is in,
+        # and the online users in each room. Rooms keep their users in a dict, to remember the order they arrived in.
+        self._users_online = {}
+        self._whereabouts = {}
+        self._occupants = {}
+
+        # In paged mode, the zones of each paged table in memory, least recently used first. Each zone has the keys and
+        # TinyDB document IDs of its documents. Also the rooms that still had users in them at startup.
+        self._zones = {table: collections.OrderedDict() for table in PAGED_TABLES} if paged else {}
+        self._stale_rooms = []
+
+        # The change notification callbacks of each table, and the version counter of each document that changed.
+        self._subscribers = {"rooms": [], "items": [], "users": []}
+        self._versions = {"rooms": {}, "items": {}, "users": {}}
+
+        # The DatabaseSnapshots that are still in use. While there are any, the old value of every index entry is
+        # handed to them before it changes, and the sets in the secondary indexes are replaced instead of changed.
+        self._snapshots = []
+
+        # Count and time the instrumented operations, by replacing each method with a wrapper on this instance.
+        self.stats = DatabaseStats() if instrument else None
+        if instrument:
+            for method, (operation, tablename) in INSTRUMENTED.items():
+                setattr(self, method, self._instrument(getattr(self, method), operation, tablename))
 
         # This will be changed when running an update tool.
         self._UPDATE_FROM_VERSION = DB_VERSION
@@ -79,6 +235,14 @@ class DatabaseManager:
 
         :return: True if succeeded, False if failed, None if failed due to existing lockfile.
         """
+        # Make sure we know how to store this database.
+        if self._backend not in BACKENDS:
+            self._log.critical("Unknown database backend: {backend}", backend=self._backend)
+            return False
+        if self._paged and not hasattr(BACKENDS[self._backend], "read_range"):
+            self._log.critical("Paged mode is not supported by the database backend: {backend}", backend=self._backend)
+            return False
+
         # Check if a lockfile exists for this database. If so, then fail.
         if os.path.exists(self._filename + ".lock"):
             self._log.critical("Lockfile exists for database: {filename}", filename=self._filename)
@@ -108,11 +272,20 @@ class DatabaseManager:
 
         # Try to load the database file. If an error occurs, fail.
         try:
-            self.database = TinyDB(self._filename)
+            self.database = TinyDB(self._filename, storage=WriteBehindMiddleware(
+                BACKENDS[self._backend], write_through=not self._write_behind, max_staleness=self._max_staleness,
+                sparse=self._sparse, paged=PAGED_TABLES if self._paged else ()))
         except:
             self._log.critical("Error from TinyDB while loading database: {filename}", filename=self._filename)
             self._log.critical(traceback.format_exc(1))
             return False
+        if self.stats:
+            self.database.storage.flushed = self.stats.record_flush
+
+        # Use the binary snapshot from the last clean shutdown instead of reading the database, if it's up to date.
+        snapshot = self._load_snapshot()
+        if snapshot:
+            self.database.storage.preload(snapshot["tables"])
 
         # Load the rooms, users, items, and _info tables.
         self.rooms = self.database.table("rooms")
@@ -121,7 +294,7 @@ class DatabaseManager:
         self._info = self.database.table("_info")
 
         # If the info table is empty, assume a new database and add an info record containing the current version.
-        if len(self._info.all()) == 0:
+        if len(self._info) == 0:
             self._info.insert({"version": DB_VERSION})
 
         # Otherwise read out the existing info record and check if it's ok.
@@ -148,22 +321,55 @@ class DatabaseManager:
                 else:
                     self._log.critical("Database version mismatch, v{filever} detected, v{currver} required.",
                                        filever=info_record["version"], currver=self._UPDATE_FROM_VERSION)
-                    self._log.critical("Check the util folder for a dbupdate script to migrate between these versions.")
+                    self._log.critical("Run util/dbmigrate.py to migrate the database to the current version.")
 
                 # Remove the lockfile before exiting.
                 self._unlock()
                 return False
 
+        # A world that was ever written sparse has to be filled in when read, even if sparse storage is now turned off.
+        # Mark worlds written sparse in the info record, so that this can be told later.
+        info = self._info.all()[0]
+        if info.get("sparse") and not self._sparse:
+            self._log.warn("Database was written sparse, keeping sparse storage on: {filename}", filename=self._filename)
+            self._sparse = True
+            self.database.storage.use_sparse()
+        elif self._sparse and not info.get("sparse"):
+            stored = dict(info)
+            stored["sparse"] = True
+            self._stage(self._info, info.doc_id, Document(stored, info.doc_id), defer=True)
+
         # If there are no rooms, make the initial room.
-        if len(self.rooms.all()) == 0:
+        if self.count("rooms") == 0:
             self._log.info("Initializing rooms table.")
             self._init_room()
 
         # If there are no users, make the root user.
-        if len(self.users.all()) == 0:
+        if self.count("users") == 0:
             self._log.info("Initializing users table.")
             self._init_user()
 
+        # Build the in-memory lookup indexes, or take them from the snapshot.
+        if snapshot:
+            self._room_index, self._item_index, self._user_index, self._nick_index, self._secondary = \
+                snapshot["indexes"]
+        else:
+            self._build_indexes()
+
+        # Pick up the ID counters where they left off, skipping past any IDs that are in use anyway.
+        stored = self._info.all()[0].get("next_id", {})
+        for table in ("rooms", "items"):
+            self._next_ids[table] = max(stored.get(table, 0), max(self.keys(table), default=-1) + 1)
+
+        # Nobody is online yet, so take any users left behind by an unclean shutdown out of the rooms.
+        self._clean_rooms()
+
+        # Report any items that nothing is holding, so they can be requisitioned.
+        orphans = self.orphaned_items()
+        if orphans:
+            self._log.warn("Found {count} items with no location in database: {items}", count=len(orphans),
+                           items=orphans)
+
         # Finished starting up.
         self._log.info("Finished loading database.")
         return True
@@ -178,8 +384,7 @@ class DatabaseManager:
 
         :return: True
         """
-        q = Query()
-        self.rooms.upsert(document, q.id == document["id"])
+        self._upsert_indexed(self.rooms, self._room_index, document["id"], document)
         return True
 
     def upsert_item(self, document):
@@ -192,8 +397,7 @@ class DatabaseManager:
 
         :return: True
         """
-        q = Query()
-        self.items.upsert(document, q.id == document["id"])
+        self._upsert_indexed(self.items, self._item_index, document["id"], document)
         return True
 
     def upsert_user(self, document):
@@ -206,8 +410,11 @@ class DatabaseManager:
 
         :return: True
         """
-        q = Query()
-        self.users.upsert(document, q.name == document["name"])
+        self._upsert_indexed(self.users, self._user_index, document["name"].lower(), document)
+
+        # Keep track of online users moving between rooms.
+        if document["name"].lower() in self._users_online:
+            self._place(document["name"].lower(), self._user_index[document["name"].lower()]["room"])
         return True
 
     def delete_room(self, document):
@@ -217,11 +424,7 @@ class DatabaseManager:
 
         :return: True if succeeded, False if the document didn't exist.
         """
-        q = Query()
-        removed = self.rooms.remove(q.id == document["id"])
-        if not removed:
-            return False
-        return True
+        return self._delete_indexed(self.rooms, self._room_index, document["id"])
 
     def delete_item(self, document):
         """Delete an item.
@@ -230,11 +433,7 @@ class DatabaseManager:
 
         :return: True if succeeded, False if the document didn't exist.
         """
-        q = Query()
-        removed = self.items.remove(q.id == document["id"])
-        if not removed:
-            return False
-        return True
+        return self._delete_indexed(self.items, self._item_index, document["id"])
 
     def delete_user(self, document):
         """Delete a user.
@@ -245,54 +444,151 @@ class DatabaseManager:
 
         :return: True if succeeded, False if the document didn't exist.
         """
-        q = Query()
-        removed = self.users.remove(q.name == document["name"])
-        if not removed:
+        return self._delete_indexed(self.users, self._user_index, document["name"].lower())
+
+    def flush(self):
+        """Write all changes that are being held in memory to the database file.
+
+        This does nothing unless there are unwritten changes, which only happens in write-behind mode.
+
+        :return: The number of changed documents that were written.
+        """
+        if self.database is None:
+            return 0
+        count = self.database.storage.flush()
+        if count:
+            self._log.debug("Flushed {count} changed documents to database: {filename}", count=count,
+                            filename=self._filename)
+        return count
+
+    def flush_stale(self):
+        """Write the changes held in memory if the oldest of them has waited longer than max_staleness.
+
+        :return: The number of changed documents that were written.
+        """
+        if self.database is None:
+            return 0
+        count = self.database.storage.flush_stale()
+        if count:
+            self._log.debug("Flushed {count} stale changed documents to database: {filename}", count=count,
+                            filename=self._filename)
+        return count
+
+    def close(self):
+        """Write any changes held in memory and close the database file.
+
+        :return: None
+        """
+        if self.database is None:
+            return
+        self.flush()
+        self.database.close()
+        self.database = None
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Group several upserts and deletes into a single storage write.
+
+        Use as `with database.transaction():`. Changes made inside the block are visible to lookups right away, but
+        are only written when the block ends, all together. If the block raises an exception, the changes are rolled
+        back in the database before the exception is passed on. Documents held by the caller are not rolled back.
+        A transaction started inside another one just becomes part of it.
+
+        :return: Context manager yielding this DatabaseManager.
+        """
+        # Join the outer transaction.
+        if self._undo is not None:
+            yield self
+            return
+
+        self._undo = []
+        self.database.storage.hold()
+        try:
+            yield self
+        except:
+            self._rollback()
+            raise
+        finally:
+            self._undo = None
+            self.database.storage.release()
+            self._evict()
+
+    def compact(self, threshold=0, run=None):
+        """Fold the change journal into a new snapshot of the database file, when using the journal backend.
+
+        Any held changes are flushed first, and the world is serialized right away. Writing the new snapshot is the
+        slow part, so it can be handed off to run on another thread.
+
+        :param threshold: Only compact if the journal has grown to at least this many bytes.
+        :param run: Function to call with the snapshot writing function, such as reactor.callInThread. If not set,
+            the snapshot is written before returning.
+
+        :return: True if a compaction was started, False otherwise.
+        """
+        # Only the journal backend has anything to compact.
+        if self.database is None or not hasattr(self.database.storage, "begin_compaction"):
+            return False
+
+        self.flush()
+        size = self.database.storage.journal_size
+        if not size or size < threshold:
+            return False
+
+        # A compaction is already running.
+        finish = self.database.storage.begin_compaction(self.database.storage.stored())
+        if not finish:
+            return False
+
+        self._log.info("Compacting {size} byte journal for database: {filename}", size=size,
+                       filename=self._filename)
+        if run:
+            run(finish)
+        else:
+            finish()
+        return True
+
+    def write_snapshot(self):
+        """Write a binary snapshot of the world and its indexes, for a faster startup next time.
+
+        Any held changes are flushed first. This is meant to be called at clean shutdown, after which the database
+        file doesn't change until the next startup. If the database file is changed after the snapshot is written,
+        the snapshot is ignored.
+
+        :return: True if succeeded, False if snapshots are disabled or writing failed.
+        """
+        if not self._snapshot or self._paged or self.database is None:
+            return False
+        self.flush()
+
+        snapshot = {
+            "format": SNAPSHOT_FORMAT,
+            "stamp": self._stamp(),
+            "tables": self.database.storage.read(),
+            "indexes": (self._room_index, self._item_index, self._user_index, self._nick_index, self._secondary)
+        }
+        try:
+            with open(os.open(self._snapshot_path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+                os.chmod(self._snapshot_path + ".tmp", 0o600)
+                pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(self._snapshot_path + ".tmp", self._snapshot_path)
+        except:
+            self._log.error("Could not write snapshot for database: {filename}", filename=self._filename)
+            self._log.error(traceback.format_exc(1))
             return False
+        self._log.info("Wrote snapshot for database: {filename}", filename=self._filename)
         return True
 
-    def room_by_id(self, roomid, clean=True):
+    def room_by_id(self, roomid):
         """Get a room by its id.
 
+        Offline users were already taken out of every room at startup, so the room's user list is up to date.
+
         :param roomid: The id of the room to retrieve from the database.
-        :param clean: Whether to automatically remove offline user records. Should usually be True.
 
         :return: Room document or None.
         """
-        # Search for a room in the database whose ID is the given ID. Assume only one exists.
-        q = Query()
-        thisroom = self.rooms.search(q.id == roomid)
-
-        # Couldn't find a room with that ID, so return nothing.
-        if not thisroom:
-            return None
-
-        # TinyDB always returns a list, so take the first item.
-        thisroom = thisroom[0]
-
-        # If we are not automatically removing offline users from this room, then return the room document right away.
-        # Cleaning offline users is usually only disabled for debugging purposes, for example to grab a corrupted
-        # room document that won't make it through cleaning so that we can pass it to delete_room().
-        if not clean:
-            return thisroom
-
-        # For each user in the room, check if they are online. If not, remove them. This used to be done for every room
-        # at startup, and took a long time. It is much faster to do it as needed, though not doing it at startup leaves
-        # quasi-online ghost users in the record of each room until it is loaded. This doesn't actually matter though.
-        # After we do this once, we take note so we don't have to do it again during this server session.
-        if roomid not in self._rooms_cleaned:
-            for username in thisroom["users"]:
-                user = self.user_by_name(username)
-                if user and username not in self._users_online:
-                    thisroom["users"].remove(username)
-
-            # Save the room after cleaning out the offline users, and then grab it again.
-            self.upsert_room(thisroom)
-            self._rooms_cleaned.append(roomid)
-            thisroom = self.rooms.search(q.id == roomid)[0]
-
-        # Return the cleaned room document.
-        return thisroom
+        # Hand out a private copy, so that changes don't leak into the index before they are upserted.
+        return self._canonical("rooms", roomid)
 
     def item_by_id(self, itemid):
         """Get an item by its id.
@@ -301,43 +597,281 @@ class DatabaseManager:
 
         :return: Item document or None.
         """
-        q = Query()
-        thisitem = self.items.search(q.id == itemid)
-        if not thisitem:
-            return None
-        return thisitem[0]
+        return self._canonical("items", itemid)
 
     def user_by_name(self, username):
         """Get a user by their name.
 
-        If there is any chance the user could be logged in, and their record needs to be altered,
-        you should use the equivalent Console method instead. This method is faster but won't update logged in users.
+        If the user is logged in, this is the same document as their console's user record.
 
         :param username: The name of the user to retrieve from the database.
 
         :return: User document or None.
         """
-        allusers = self.users.all()
-        for user in allusers:
-            if user["name"].lower() == username.lower():
-                return user
-        return None
+        return self._canonical("users", username.lower())
 
     def user_by_nick(self, nickname):
         """Get a user by their nickname.
 
-        If there is any chance the user could be logged in, and their record needs to be altered,
-        you should use the equivalent Console method instead. This method is faster but won't update logged in users.
+        If the user is logged in, this is the same document as their console's user record.
 
         :param nickname: The nickname of the user to retrieve from the database.
 
         :return: User document or None.
         """
-        allusers = self.users.all()
-        for user in allusers:
-            if user["nick"].lower() == nickname.lower():
-                return user
-        return None
+        thisuser = self._nick_index.get(nickname.lower())
+        if not thisuser:
+            return None
+        return self._canonical("users", thisuser["name"].lower())
+
+    def next_id(self, table):
+        """Allocate the ID for a new room or item.
+
+        IDs are counted up per table and never handed out twice, even if the document that had one was deleted.
+        The counter is saved in the info record, and written along with the document that uses the ID.
+
+        :param table: The name of the table, "rooms" or "items".
+
+        :return: The new ID.
+        """
+        newid = self._next_ids[table]
+        self._next_ids[table] = newid + 1
+
+        # Stage the updated info record, to be written along with the new document.
+        info = self._info.all()[0]
+        stored = dict(info)
+        stored["next_id"] = dict(self._next_ids)
+        self._stage(self._info, info.doc_id, Document(stored, info.doc_id), defer=True)
+        return newid
+
+    def reserve_id(self, table, docid):
+        """Make sure an ID that was put in use from outside, such as by an import, is never allocated by next_id().
+
+        :param table: The name of the table, "rooms" or "items".
+        :param docid: The ID in use.
+
+        :return: True if the counter was moved past the ID, False if it already was.
+        """
+        if docid < self._next_ids[table]:
+            return False
+        self._next_ids[table] = docid + 1
+
+        # Stage the updated info record, to be written along with the document that uses the ID.
+        info = self._info.all()[0]
+        stored = dict(info)
+        stored["next_id"] = dict(self._next_ids)
+        self._stage(self._info, info.doc_id, Document(stored, info.doc_id), defer=True)
+        return True
+
+    def find_by(self, table, field, value):
+        """Find all documents in a table with the given value in an indexed field.
+
+        :param table: The name of the table to search, "rooms", "items", or "users".
+        :param field: The field to search, which must be listed in INDEXES for the table.
+        :param value: The value to search for. For list fields, documents whose list contains the value match.
+
+        :return: List of matching Documents, sorted by ID or username.
+        """
+        spec = INDEXES[table][field]
+        if "normalize" in spec:
+            value = spec["normalize"](value)
+        matches = sorted(self._secondary[table][field].get(value, ()))
+
+        return [self._canonical(table, key) for key in matches]
+
+    def subscribe(self, tablename, callback):
+        """Be told whenever a document in a table changes.
+
+        After every upsert or delete that changes a document, including changes undone by a rolled back transaction,
+        the callback is called as callback(key, changed). The key is the room or item ID, or the lowercase username.
+        Changed is the set of top-level fields that differ from before, or None if the document was deleted.
+        Callbacks run right away, so they should only drop cached entries, not look up other documents.
+
+        :param tablename: The name of the table, "rooms", "items", or "users".
+        :param callback: The function to call.
+
+        :return: True
+        """
+        self._subscribers[tablename].append(callback)
+        return True
+
+    def unsubscribe(self, tablename, callback):
+        """Stop being told about changes to a table.
+
+        :param tablename: The name of the table.
+        :param callback: The function that was subscribed.
+
+        :return: True if succeeded, False if the callback wasn't subscribed.
+        """
+        if callback not in self._subscribers[tablename]:
+            return False
+        self._subscribers[tablename].remove(callback)
+        return True
+
+    def version(self, tablename, key):
+        """Get the version counter of a document, which goes up every time the document changes.
+
+        A cache can remember the version it saw, and compare it to tell whether its entry is still good, without
+        looking up the document. Counters start at zero when the server starts, and aren't reset by deletion.
+
+        :param tablename: The name of the table.
+        :param key: The room or item ID, or the lowercase username.
+
+        :return: The version number.
+        """
+        return self._versions[tablename].get(key, 0)
+
+    def keys(self, tablename):
+        """List the keys of every document in a table, which are room or item IDs, or lowercase usernames.
+
+        In paged mode, held changes are flushed first, so that the storage can be asked about the documents that
+        aren't in memory.
+
+        :param tablename: The name of the table.
+
+        :return: Sorted list of keys.
+        """
+        if tablename in self._zones:
+            self.flush()
+            return sorted(self.database.storage.storage.ids(tablename))
+        return sorted(self._primary(tablename))
+
+    def count(self, tablename):
+        """Count the documents in a table.
+
+        :param tablename: The name of the table.
+
+        :return: The number of documents.
+        """
+        if tablename in self._zones:
+            return len(self.keys(tablename))
+        return len(self.database.table(tablename))
+
+    def documents(self, tablename):
+        """Go through every document in a table, sorted by key.
+
+        In paged mode, zones are loaded one after another as they are reached, and older ones may be dropped again,
+        so going through a whole table never needs more memory than the zone budget.
+
+        :param tablename: The name of the table.
+
+        :return: Iterator of documents.
+        """
+        for key in self.keys(tablename):
+            thisdoc = self._canonical(tablename, key)
+            if thisdoc is not None:
+                yield thisdoc
+
+    def dump(self):
+        """Get the whole world as it is stored, as a dictionary of tables of documents by TinyDB document ID.
+
+        The result must not be changed. In paged mode, held changes are flushed and the whole world is read from the
+        storage, which takes as long as a normal startup.
+
+        :return: Dictionary of tables.
+        """
+        if not self._paged:
+            return self.database.storage.read()
+        self.flush()
+        tables = self.database.storage.storage.read()
+        return rehydrate_tables(tables) if self._sparse else tables
+
+    def read_copy(self, target):
+        """Read the whole world from a copy of the database file, without going through the open storage.
+
+        Paged worlds can't be snapshotted, so this is how one is read from a worker thread. Changes held in memory
+        must be flushed first. This only works with the SQLite backend, which paged mode needs.
+
+        :param target: The filename to make the copy at. It is removed afterward.
+
+        :return: Dictionary of tables, like dump().
+        """
+        try:
+            SQLiteStorage.copy(self._filename, target)
+            storage = SQLiteStorage(target)
+            try:
+                tables = storage.read()
+            finally:
+                storage.close()
+        finally:
+            if os.path.exists(target):
+                os.remove(target)
+        return rehydrate_tables(tables) if self._sparse else tables
+
+    def snapshot(self):
+        """Take a read-only snapshot of the world, for a command to run against on a worker thread.
+
+        Nothing is copied up front except the presence registry. The snapshot reads the live indexes, and before an
+        index entry changes, its old value is handed to the snapshot, so the snapshot keeps seeing the world as it was.
+        This lasts until the snapshot is passed to commit() or release(). Paged mode can't take snapshots, because
+        most of the world isn't in memory.
+
+        :return: DatabaseSnapshot, or None in paged mode.
+        """
+        if self._paged:
+            return None
+        snapshot = DatabaseSnapshot(
+            {"rooms": self._room_index, "items": self._item_index, "users": self._user_index}, self._secondary,
+            self._nick_index, list(self._users_online),
+            {roomid: list(users) for roomid, users in self._occupants.items()})
+        self._snapshots.append(snapshot)
+        return snapshot
+
+    def release(self, snapshot):
+        """Stop keeping a snapshot up to date, when it is no longer used.
+
+        :param snapshot: The DatabaseSnapshot.
+
+        :return: True if succeeded, False if it was already released.
+        """
+        if snapshot not in self._snapshots:
+            return False
+        self._snapshots.remove(snapshot)
+        return True
+
+    def commit(self, snapshot):
+        """Save the changes recorded by a DatabaseSnapshot, all in one transaction, and release it.
+
+        If anything the snapshot was asked about changed since it was taken, whether a document, an index lookup, or
+        who is online, nothing is saved, since the changes were decided on an old view of the world.
+
+        :param snapshot: The DatabaseSnapshot.
+
+        :return: True if the changes were saved, False if there was a conflict.
+        """
+        self.release(snapshot)
+        if not snapshot.writes:
+            return True
+        if snapshot.changed():
+            return False
+        for method, args, answer in snapshot.presence:
+            if getattr(self, method)(*args) != answer:
+                return False
+        with self.transaction():
+            for method, document in snapshot.writes:
+                getattr(self, method)(document)
+        return True
+
+    def item_holders(self, itemid):
+        """Find everything that is holding an item.
+
+        :param itemid: The ID of the item.
+
+        :return: Dict of the kinds of holders in HOLDERS, each a list of the rooms, container items, or users holding
+            the item in that way.
+        """
+        return {kind: self.find_by(table, field, itemid) for kind, (table, field) in HOLDERS.items()}
+
+    def orphaned_items(self):
+        """Find the items that nothing is holding. This only consults the indexes, without reading any documents.
+        In paged mode, the IDs of the items not in memory are read from the storage.
+
+        :return: Sorted list of item IDs.
+        """
+        held = set()
+        for table, field in HOLDERS.values():
+            held.update(self._secondary[table][field])
+        return sorted(set(self.keys("items")) - held)
 
     def login_user(self, username, passhash, console):
         """Check if a username and password match an existing user, and log them in.
@@ -364,17 +898,15 @@ class DatabaseManager:
         if username in self._users_online:
             self._log.warn("User logged in twice: {username}", username=username)
             console.msg("Throwing out old connection.")
-            console=console.shell.console_by_username(username)
-            console.shell.command(console, "logout")
-            console.user=None
+            oldconsole = self._users_online[username]
+            oldconsole.shell.command(oldconsole, "logout")
+            oldconsole.user = None
             #self.logout_user(username)
-            self._users_online.append(username)
-            return thisuser
 
-        # Clean and successful login.
-        else:
-            self._users_online.append(username)
-            return thisuser
+        # Register the user as online in their room.
+        self._users_online[username] = console
+        self._place(username, thisuser["room"])
+        return thisuser
 
     def logout_user(self, username):
         """Log out a user.
@@ -394,7 +926,7 @@ class DatabaseManager:
         # Still return True since we logged them out.
         elif not thisuser and username in self._users_online:
             self._log.warn("Nonexistent user was online: {username}", username=username)
-            self._users_online.remove(username)
+            self._unplace(username)
             return True
 
         # Attempt to log out user who was not logged in.
@@ -404,7 +936,7 @@ class DatabaseManager:
 
         # Clean and successful logout.
         else:
-            self._users_online.remove(username)
+            self._unplace(username)
             return True
 
     def online(self, username):
@@ -418,6 +950,529 @@ class DatabaseManager:
             return True
         return False
 
+    def online_users(self):
+        """List the users who are online.
+
+        :return: List of lowercase usernames, in the order they logged in.
+        """
+        return list(self._users_online)
+
+    def users_in_room(self, roomid):
+        """List the online users in a room, without looking up the room.
+
+        :param roomid: The ID of the room.
+
+        :return: List of lowercase usernames, in the order they arrived.
+        """
+        return list(self._occupants.get(roomid, ()))
+
+    def console_by_username(self, username):
+        """Get the console of an online user.
+
+        :param username: The name of the user.
+
+        :return: Console, or None if the user is offline.
+        """
+        return self._users_online.get(username.lower())
+
+    def _instrument(self, method, operation, tablename):
+        """Wrap a method so that each call is recorded in the stats.
+
+        :param method: The bound method to wrap.
+        :param operation: The kind of operation the method is.
+        :param tablename: The name of the table the method works on, or None if it is the first argument.
+
+        :return: The wrapped method.
+        """
+        @functools.wraps(method)
+        def instrumented(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.stats.record(tablename or args[0], operation, time.perf_counter() - start)
+        return instrumented
+
+    def _load_snapshot(self):
+        """Load the binary snapshot, if it was written since the database file last changed.
+
+        :return: The snapshot dict, or None if there is no usable snapshot.
+        """
+        if not self._snapshot or self._paged or not os.path.exists(self._snapshot_path):
+            return None
+
+        # Unpickling can run any code, so only trust a snapshot that nobody but the server's user could have written.
+        stat = os.stat(self._snapshot_path)
+        if stat.st_mode & 0o022 or (hasattr(os, "getuid") and stat.st_uid != os.getuid()):
+            self._log.warn("Ignoring snapshot that other users could have written: {filename}",
+                           filename=self._snapshot_path)
+            return None
+
+        # Loading creates a great many objects at once, which would set off the garbage collector over and over.
+        # None of them can be garbage yet, so pause it while loading.
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            with open(self._snapshot_path, "rb") as f:
+                snapshot = pickle.load(f)
+        except:
+            self._log.warn("Could not read snapshot for database: {filename}", filename=self._filename)
+            self._log.warn(traceback.format_exc(1))
+            return None
+        finally:
+            if collecting:
+                gc.enable()
+
+        # The database file is the source of truth, so ignore the snapshot if it might be out of date.
+        if snapshot.get("format") != SNAPSHOT_FORMAT or snapshot.get("stamp") != self._stamp():
+            self._log.info("Snapshot is out of date, loading the database file instead: {filename}",
+                           filename=self._filename)
+            return None
+        self._log.info("Loading database from snapshot: {filename}", filename=self._snapshot_path)
+        return snapshot
+
+    def _stamp(self):
+        """Identify the current contents of the database files by their sizes and SHA-256 hashes.
+
+        Hashing reads the files, but that is still much faster than parsing them, and unlike modification times it
+        can't miss a file that was edited in place.
+
+        :return: List of (filename, size, hash) for each file the storage backend uses.
+        """
+        stamp = []
+        for path in getattr(self.database.storage.storage, "paths", [self._filename]):
+            try:
+                digest = hashlib.sha256()
+                with open(path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        digest.update(chunk)
+                stamp.append((path, os.path.getsize(path), digest.hexdigest()))
+            except OSError:
+                stamp.append((path, None, None))
+        return stamp
+
+    def _build_indexes(self):
+        """Build the in-memory lookup indexes from the contents of the tables.
+
+        This reads each table once at startup. Afterward, the upsert and delete methods keep the indexes in sync.
+        In paged mode, the primary indexes of the paged tables are filled in as their zones are loaded.
+
+        :return: True
+        """
+        self._room_index = {} if self._paged else {room["id"]: room for room in self.rooms.all()}
+        self._item_index = {} if self._paged else {item["id"]: item for item in self.items.all()}
+        self._user_index = {user["name"].lower(): user for user in self.users.all()}
+        self._nick_index = {user["nick"].lower(): user for user in self._user_index.values()}
+
+        # Build the secondary indexes.
+        self._secondary = {table: {field: {} for field in INDEXES[table]} for table in INDEXES}
+        for table in INDEXES:
+            for key, document in self._primary(table).items():
+                self._reindex_secondary(table, key, None, document)
+
+        # In paged mode, the paged tables aren't in memory yet. Go through their documents in the storage one at a time
+        # to build their secondary indexes, and note which rooms still have users in them.
+        # TinyDB would only count the documents in memory when numbering new ones, so tell it where to continue.
+        if self._paged:
+            self.flush()
+        for table in self._zones:
+            getattr(self, table)._next_id = self.database.storage.storage.last_doc_id(table) + 1
+            for doc_id, document in self.database.storage.storage.scan(table):
+                if self._sparse:
+                    rehydrate(table, document)
+                self._reindex_secondary(table, document["id"], None, document)
+                if table == "rooms" and document["users"]:
+                    self._stale_rooms.append(document["id"])
+        return True
+
+    def _zone(self, tablename, key):
+        """Get the zone a room or item belongs to in paged mode, if it is in memory.
+
+        :param tablename: The name of the table.
+        :param key: The room or item ID.
+
+        :return: The zone dict, or None if the table isn't paged or the zone isn't in memory.
+        """
+        zones = self._zones.get(tablename)
+        if zones is None or type(key) is not int:
+            return None
+        return zones.get(key // self._zone_size)
+
+    def _fault(self, tablename, key):
+        """Make sure the zone a room or item belongs to is in memory, loading it from the storage if needed.
+
+        Does nothing unless the table is paged.
+
+        :param tablename: The name of the table.
+        :param key: The room or item ID.
+
+        :return: None
+        """
+        zones = self._zones.get(tablename)
+        if zones is None or type(key) is not int:
+            return
+        number = key // self._zone_size
+        if number in zones:
+            zones.move_to_end(number)
+            return
+
+        # Load the zone and add its documents to the primary index.
+        index = self._primary(tablename)
+        zone = {"keys": set(), "doc_ids": set()}
+        low = number * self._zone_size
+        for doc_id, document in self.database.storage.fetch(tablename, low, low + self._zone_size).items():
+            index[document["id"]] = Document(document, int(doc_id))
+            zone["keys"].add(document["id"])
+            zone["doc_ids"].add(int(doc_id))
+        zones[number] = zone
+        self._evict()
+
+    def _evict(self):
+        """Drop the least recently used zones from memory until each paged table is within the zone budget.
+
+        The most recently used zone, zones with users in their rooms, and zones with unwritten changes are kept.
+        Nothing is dropped during a transaction.
+
+        :return: None
+        """
+        if not self._zone_budget or self._undo is not None:
+            return
+        for tablename, zones in self._zones.items():
+            index = self._primary(tablename)
+            for number in list(zones)[:-1]:
+                if len(zones) <= self._zone_budget:
+                    break
+                zone = zones[number]
+                if tablename == "rooms" and any(self._occupants.get(key) for key in zone["keys"]):
+                    continue
+                if any(self.database.storage.is_dirty(tablename, doc_id) for doc_id in zone["doc_ids"]):
+                    continue
+                for key in zone["keys"]:
+                    index.pop(key, None)
+                    self._identity[tablename].pop(key, None)
+                self.database.storage.evict(tablename, zone["doc_ids"])
+                del zones[number]
+
+    def _primary(self, tablename):
+        """Get the index of a table by ID or lowercase username.
+
+        :param tablename: The name of the table.
+
+        :return: The index dict for the table.
+        """
+        return {"rooms": self._room_index, "items": self._item_index, "users": self._user_index}[tablename]
+
+    def _preserve(self, live, key):
+        """Hand the value of an index entry to the snapshots in use, before it changes.
+
+        :param live: The index dict.
+        :param key: The key of the entry that is about to change.
+
+        :return: True
+        """
+        for snapshot in self._snapshots:
+            snapshot.preserve(live, key)
+        return True
+
+    def _reindex_secondary(self, tablename, key, old, new):
+        """Update the secondary indexes of a table after one of its documents was replaced, inserted, or deleted.
+
+        :param tablename: The name of the table the document belongs to.
+        :param key: The index key of the document, its ID or lowercase username.
+        :param old: The previously indexed document, or None if it was inserted.
+        :param new: The newly indexed document, or None if it was deleted.
+
+        :return: True
+        """
+        for field, spec in INDEXES.get(tablename, {}).items():
+            index = self._secondary[tablename][field]
+            oldkeys = self._index_keys(spec, field, old) if old else set()
+            newkeys = self._index_keys(spec, field, new) if new else set()
+
+            # Only touch the entries for keys that actually changed. Snapshots may be reading the sets of the index from
+            # another thread, so while there are any, the sets are replaced instead of changed in place.
+            for value in oldkeys ^ newkeys:
+                keys = index.get(value, set())
+                if self._snapshots:
+                    self._preserve(index, value)
+                    keys = set(keys)
+                if value in newkeys:
+                    keys.add(key)
+                else:
+                    keys.discard(key)
+                if keys:
+                    index[value] = keys
+                else:
+                    index.pop(value, None)
+        return True
+
+    @staticmethod
+    def _index_keys(spec, field, document):
+        """Get the secondary index keys for a field of a document.
+
+        :param spec: The index specification of the field from INDEXES.
+        :param field: The name of the field.
+        :param document: The document to read the field from.
+
+        :return: Set of index keys.
+        """
+        value = document
+        for name in spec.get("path", [field]):
+            value = value.get(name) if isinstance(value, dict) else None
+        if value is None:
+            return set()
+        values = value if spec.get("multi") else [value]
+        if "normalize" in spec:
+            return {spec["normalize"](v) for v in values if v is not None}
+        return {v for v in values if v is not None}
+
+    def _upsert_indexed(self, table, index, key, document):
+        """Update or insert a document, keeping its index in sync.
+
+        Like TinyDB's upsert, the fields of the new document are merged into any existing document with the same key.
+
+        :param table: The TinyDB table to write to.
+        :param index: The index dict for the table.
+        :param key: The index key of the document, its ID or lowercase username.
+        :param document: The document to update or insert.
+
+        :return: True
+        """
+        self._fault(table.name, key)
+        existing = index.get(key)
+        if self._undo is not None:
+            self._undo.append((table, index, key, existing))
+
+        # Update the existing document by its TinyDB document ID, or give a new document the next free one.
+        if existing:
+            doc_id = existing.doc_id
+            stored = dict(existing)
+            stored.update(copy.deepcopy(dict(document)))
+        else:
+            doc_id = table._get_next_id()
+            stored = copy.deepcopy(dict(document))
+
+        self._preserve(index, key)
+        index[key] = Document(stored, doc_id)
+        self._reindex_secondary(table.name, key, existing, index[key])
+        if table is self.users:
+            self._reindex_nick(existing, index[key])
+        self._stage(table, doc_id, index[key])
+        self._refresh(table.name, key, document)
+        self._notify(table.name, key, existing, index[key])
+
+        # Remember which zone a new document belongs to.
+        zone = self._zone(table.name, key)
+        if zone:
+            zone["keys"].add(key)
+            zone["doc_ids"].add(doc_id)
+            self._evict()
+        return True
+
+    def _delete_indexed(self, table, index, key):
+        """Delete a document, keeping its index in sync.
+
+        :param table: The TinyDB table to delete from.
+        :param index: The index dict for the table.
+        :param key: The index key of the document, its ID or lowercase username.
+
+        :return: True if succeeded, False if the document didn't exist.
+        """
+        self._fault(table.name, key)
+        self._preserve(index, key)
+        existing = index.pop(key, None)
+        if not existing:
+            return False
+        if self._undo is not None:
+            self._undo.append((table, index, key, existing))
+        self._reindex_secondary(table.name, key, existing, None)
+        if table is self.users:
+            self._reindex_nick(existing, None)
+        self._stage(table, existing.doc_id, None)
+        self._refresh(table.name, key)
+        self._notify(table.name, key, existing, None)
+        return True
+
+    def _stage(self, table, doc_id, document, defer=False):
+        """Hand a changed document to the storage middleware, which writes it now or at the next flush.
+
+        :param table: The TinyDB table the document belongs to.
+        :param doc_id: The TinyDB document ID of the document.
+        :param document: The new contents of the document, or None if it was deleted.
+        :param defer: If True, don't write it until something else is written.
+
+        :return: True
+        """
+        self.database.storage.stage(table.name, doc_id, document, defer)
+        table.clear_cache()
+        return True
+
+    def _notify(self, tablename, key, old, new):
+        """Count a new version of a changed document and call the subscribers of its table.
+
+        :param tablename: The name of the table the document belongs to.
+        :param key: The index key of the document, its ID or lowercase username.
+        :param old: The previously indexed document, or None if it was inserted.
+        :param new: The newly indexed document, or None if it was deleted.
+
+        :return: True if the document changed, False if nothing was different.
+        """
+        if new is None:
+            changed = None
+        elif old is None:
+            changed = set(new)
+        else:
+            changed = {field for field in set(old) | set(new) if field not in old or field not in new
+                       or old[field] != new[field]}
+            if not changed:
+                return False
+        self._versions[tablename][key] = self._versions[tablename].get(key, 0) + 1
+
+        # A broken subscriber must not stop the change from going through.
+        for callback in list(self._subscribers[tablename]):
+            try:
+                callback(key, changed)
+            except:
+                self._log.error("Error from change subscriber for table {table}: {key}", table=tablename, key=key)
+                self._log.error(traceback.format_exc(1))
+        return True
+
+    def _place(self, username, roomid):
+        """Record an online user as being in a room, taking them out of the room they were in before.
+
+        :param username: The lowercase name of the online user.
+        :param roomid: The ID of the room they are in now.
+
+        :return: True
+        """
+        oldroomid = self._whereabouts.get(username)
+        if oldroomid == roomid and username in self._occupants.get(roomid, ()):
+            return True
+        if oldroomid is not None:
+            self._occupants[oldroomid].pop(username, None)
+            if not self._occupants[oldroomid]:
+                del self._occupants[oldroomid]
+        self._whereabouts[username] = roomid
+        self._occupants.setdefault(roomid, {})[username] = None
+        return True
+
+    def _unplace(self, username):
+        """Take a user out of the presence registry when they go offline.
+
+        :param username: The lowercase name of the user.
+
+        :return: True
+        """
+        self._users_online.pop(username, None)
+        roomid = self._whereabouts.pop(username, None)
+        if roomid is not None:
+            self._occupants[roomid].pop(username, None)
+            if not self._occupants[roomid]:
+                del self._occupants[roomid]
+        return True
+
+    def _clean_rooms(self):
+        """Take all users out of the user lists of the rooms, in a single write. Only call this while nobody is online.
+
+        :return: The number of rooms that were cleaned.
+        """
+        if self._paged:
+            stale = self._stale_rooms
+        else:
+            stale = [roomid for roomid, room in self._room_index.items() if room.get("users")]
+        if not stale:
+            return 0
+        with self.transaction():
+            for roomid in stale:
+                self._upsert_indexed(self.rooms, self._room_index, roomid, {"users": []})
+        self._log.info("Cleaned offline users out of {count} rooms.", count=len(stale))
+        return len(stale)
+
+    def _rollback(self):
+        """Undo the changes made during the current transaction, restoring the previous documents and indexes.
+
+        :return: True
+        """
+        for table, index, key, previous in reversed(self._undo):
+            current = index.get(key)
+            self._preserve(index, key)
+            if previous:
+                index[key] = previous
+                self._stage(table, previous.doc_id, previous)
+            else:
+                del index[key]
+                self._stage(table, current.doc_id, None)
+            self._reindex_secondary(table.name, key, current, previous)
+            self._refresh(table.name, key)
+            if table is self.users:
+                self._reindex_nick(current, previous)
+            self._notify(table.name, key, current, previous)
+        self._log.warn("Rolled back transaction of {count} changes for database: {filename}", count=len(self._undo),
+                       filename=self._filename)
+        return True
+
+    def _reindex_nick(self, old, new):
+        """Move a user's entry in the nickname index after their document was replaced or deleted.
+
+        :param old: The previously indexed user document, or None.
+        :param new: The newly indexed user document, or None if the user was deleted.
+
+        :return: True
+        """
+        # Only drop the old nickname if it still points at this user, since nicknames can be reassigned.
+        if old and self._nick_index.get(old["nick"].lower()) is old:
+            self._preserve(self._nick_index, old["nick"].lower())
+            del self._nick_index[old["nick"].lower()]
+        if new:
+            self._preserve(self._nick_index, new["nick"].lower())
+            self._nick_index[new["nick"].lower()] = new
+        return True
+
+    def _canonical(self, tablename, key):
+        """Get the canonical in-memory copy of a document from the identity map.
+
+        Every lookup of the same document returns the same object, shared by consoles, commands, and the database,
+        so a change made through one reference is never overwritten by a stale copy held elsewhere. The copy is only
+        made the first time the document is looked up. Changes to it are saved by upserting it.
+
+        :param tablename: The name of the table the document belongs to.
+        :param key: The index key of the document, its ID or lowercase username.
+
+        :return: Document or None.
+        """
+        thisdoc = self._identity[tablename].get(key)
+        if thisdoc is None:
+            self._fault(tablename, key)
+            indexed = self._primary(tablename).get(key)
+            if not indexed:
+                return None
+            thisdoc = Document(copy.deepcopy(dict(indexed)), indexed.doc_id)
+            self._identity[tablename][key] = thisdoc
+        return thisdoc
+
+    def _refresh(self, tablename, key, document=None):
+        """Bring the canonical copy of a document up to date with its index, after something else changed it.
+
+        This is needed when a different dict was upserted, or after a deletion or rollback. The canonical copy is
+        updated in place, so everyone holding it sees the change.
+
+        :param tablename: The name of the table the document belongs to.
+        :param key: The index key of the document, its ID or lowercase username.
+        :param document: The document that was just upserted, if any. If it is the canonical copy, nothing is done.
+
+        :return: True
+        """
+        thisdoc = self._identity[tablename].get(key)
+        if thisdoc is None or thisdoc is document:
+            return True
+        indexed = self._primary(tablename).get(key)
+        if not indexed:
+            del self._identity[tablename][key]
+            return True
+        thisdoc.clear()
+        thisdoc.update(copy.deepcopy(dict(indexed)))
+        return True
+
     def _init_room(self):
         """Initialize the world with the first room, taking defaults from the defaults config file.
 
@@ -500,3 +1555,332 @@ class DatabaseManager:
             # Couldn't remove the lockfile. Probably a permissions issue.
             except:
                 self._log.warn("Could not delete lockfile for database: {filename}", filename=self._filename)
+
+
+class DatabaseSnapshot:
+    """Database Snapshot
+
+    A frozen view of the world as it was when DatabaseManager.snapshot() was called, which is safe to read from a
+    worker thread while the DatabaseManager goes on changing on the reactor thread. It answers the same lookups as the
+    DatabaseManager, but its secondary indexes don't follow changes made through it.
+
+    The snapshot shares the live indexes with the DatabaseManager. Before an index entry changes, the DatabaseManager
+    hands its old value to preserve(), and lookups look there before trusting the live index. Every lookup is
+    remembered, so that DatabaseManager.commit() can tell whether anything the command saw has changed since.
+
+    Upserts and deletes are not applied to the world. Only the fields that differ from the snapshot are recorded, to be
+    saved afterward on the reactor thread with DatabaseManager.commit(). If any of those documents changed in the
+    meantime, commit() saves nothing, since the changes were based on an old copy.
+
+    :ivar writes: The recorded changes, as (method name, document) pairs.
+    :ivar presence: The questions asked about who is online, as (method name, arguments, answer) triples.
+    """
+    def __init__(self, indexes, secondary, nicks, online, occupants):
+        """Database Snapshot Initializer
+
+        :param indexes: Dictionary of the primary index of each table.
+        :param secondary: The secondary indexes.
+        :param nicks: The nickname index.
+        :param online: List of the lowercase usernames of the online users, in the order they logged in.
+        :param occupants: Dictionary of the lowercase usernames of the online users in each room.
+        """
+        self.writes = []
+        self.presence = []
+
+        self._indexes = indexes
+        self._secondary = secondary
+        self._nicks = nicks
+        self._occupants = occupants
+        self._online = online
+        self._identity = {"rooms": {}, "items": {}, "users": {}}
+        self._deleted = {"rooms": set(), "items": set(), "users": set()}
+
+        # The old values of the live index entries that changed since the snapshot was taken, by id() of the index.
+        self._saved = {}
+
+        # The index entries that were looked up, as (index, key) pairs, and the indexes whose keys were listed.
+        self._reads = []
+        self._scans = []
+
+    def preserve(self, live, key):
+        """Keep the value a live index entry had when the snapshot was taken, before it changes.
+
+        Only the first change of each entry is kept, since later ones don't matter to the snapshot.
+
+        :param live: The index dict.
+        :param key: The key of the entry that is about to change.
+
+        :return: True
+        """
+        saved = self._saved.setdefault(id(live), {})
+        if key not in saved:
+            saved[key] = live.get(key, _ABSENT)
+        return True
+
+    def changed(self):
+        """Check whether any index entry that was looked up, or any index whose keys were listed, has changed since.
+
+        Documents and the sets in the secondary indexes are always replaced instead of changed in place while there
+        are snapshots, so an entry has changed if its live value isn't the one it had when the snapshot was taken.
+
+        :return: True if something changed, False if not.
+        """
+        for live, key in self._reads:
+            saved = self._saved.get(id(live), {})
+            if key in saved and saved[key] is not live.get(key, _ABSENT):
+                return True
+        for live in self._scans:
+            for key, value in self._saved.get(id(live), {}).items():
+                if (value is _ABSENT) != (key not in live):
+                    return True
+        return False
+
+    def dump(self):
+        """Get the world as it was, in the layout of DatabaseManager.dump(), but without the _info table.
+
+        The documents are the indexed ones, which are never changed in place, so they must not be changed either.
+
+        :return: Dictionary of the rooms, items, and users tables, of documents by TinyDB document ID.
+        """
+        tables = {}
+        for tablename in ("rooms", "items", "users"):
+            index = self._indexes[tablename]
+            documents = (self._get(index, key) for key in self.keys(tablename))
+            tables[tablename] = {str(doc.doc_id): doc for doc in documents}
+        return tables
+
+    def room_by_id(self, roomid):
+        """Get a room by its id.
+
+        :return: Room document or None.
+        """
+        return self._canonical("rooms", roomid)
+
+    def item_by_id(self, itemid):
+        """Get an item by its id.
+
+        :return: Item document or None.
+        """
+        return self._canonical("items", itemid)
+
+    def user_by_name(self, username):
+        """Get a user by their name.
+
+        :return: User document or None.
+        """
+        return self._canonical("users", username.lower())
+
+    def user_by_nick(self, nickname):
+        """Get a user by their nickname.
+
+        :return: User document or None.
+        """
+        thisuser = self._get(self._nicks, nickname.lower())
+        if not thisuser:
+            return None
+        return self._canonical("users", thisuser["name"].lower())
+
+    def find_by(self, table, field, value):
+        """Find all documents in a table with the given value in an indexed field, as of when the snapshot was taken.
+
+        :return: List of matching Documents, sorted by ID or username.
+        """
+        spec = INDEXES[table][field]
+        if "normalize" in spec:
+            value = spec["normalize"](value)
+        matches = sorted(set(self._get(self._secondary[table][field], value, ())) - self._deleted[table])
+        return [self._canonical(table, key) for key in matches]
+
+    def keys(self, tablename):
+        """List the keys of every document in a table.
+
+        :return: Sorted list of keys.
+        """
+        return sorted(self._keys(self._indexes[tablename]) - self._deleted[tablename])
+
+    def count(self, tablename):
+        """Count the documents in a table.
+
+        :return: The number of documents.
+        """
+        return len(self.keys(tablename))
+
+    def documents(self, tablename):
+        """Go through every document in a table, sorted by key.
+
+        :return: Iterator of documents.
+        """
+        for key in self.keys(tablename):
+            yield self._canonical(tablename, key)
+
+    def item_holders(self, itemid):
+        """Find everything that is holding an item.
+
+        :return: Dict of the kinds of holders in HOLDERS, each a list of documents.
+        """
+        return {kind: self.find_by(table, field, itemid) for kind, (table, field) in HOLDERS.items()}
+
+    def orphaned_items(self):
+        """Find the items that nothing is holding.
+
+        :return: Sorted list of item IDs.
+        """
+        held = set()
+        for table, field in HOLDERS.values():
+            held.update(self._keys(self._secondary[table][field]))
+        return sorted(set(self.keys("items")) - held)
+
+    def online(self, username):
+        """Check if a user was online.
+
+        :return: True if online, False if offline.
+        """
+        answer = username.lower() in self._online
+        self.presence.append(("online", (username,), answer))
+        return answer
+
+    def online_users(self):
+        """List the users who were online.
+
+        :return: List of lowercase usernames.
+        """
+        self.presence.append(("online_users", (), list(self._online)))
+        return list(self._online)
+
+    def users_in_room(self, roomid):
+        """List the online users in a room.
+
+        :return: List of lowercase usernames, in the order they arrived.
+        """
+        self.presence.append(("users_in_room", (roomid,), list(self._occupants.get(roomid, ()))))
+        return list(self._occupants.get(roomid, ()))
+
+    def upsert_room(self, document):
+        """Record a room update.
+
+        :return: True
+        """
+        return self._record("upsert_room", "rooms", document["id"], document)
+
+    def upsert_item(self, document):
+        """Record an item update.
+
+        :return: True
+        """
+        return self._record("upsert_item", "items", document["id"], document)
+
+    def upsert_user(self, document):
+        """Record a user update.
+
+        :return: True
+        """
+        return self._record("upsert_user", "users", document["name"].lower(), document)
+
+    def delete_room(self, document):
+        """Record a room deletion.
+
+        :return: True if succeeded, False if the document didn't exist.
+        """
+        return self._record("delete_room", "rooms", document["id"], None)
+
+    def delete_item(self, document):
+        """Record an item deletion.
+
+        :return: True if succeeded, False if the document didn't exist.
+        """
+        return self._record("delete_item", "items", document["id"], None)
+
+    def delete_user(self, document):
+        """Record a user deletion.
+
+        :return: True if succeeded, False if the document didn't exist.
+        """
+        return self._record("delete_user", "users", document["name"].lower(), None)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Group changes together. Every change is committed in one transaction anyway, so this does nothing.
+
+        :return: Context manager yielding this DatabaseSnapshot.
+        """
+        yield self
+
+    def _get(self, live, key, default=None):
+        """Look up an entry of a live index, as it was when the snapshot was taken.
+
+        The live value is read before the saved one, since the reactor thread saves the old value before it changes
+        the entry, so whichever way the two threads interleave, the answer is the old value.
+
+        :return: The value, or default if the key wasn't there.
+        """
+        self._reads.append((live, key))
+        value = live.get(key, _ABSENT)
+        saved = self._saved.get(id(live), {})
+        value = saved.get(key, value)
+        return default if value is _ABSENT else value
+
+    def _keys(self, live):
+        """List the keys a live index had when the snapshot was taken.
+
+        :return: Set of keys.
+        """
+        self._scans.append(live)
+        keys = set(list(live))
+        for key, value in list(self._saved.get(id(live), {}).items()):
+            if value is _ABSENT:
+                keys.discard(key)
+            else:
+                keys.add(key)
+        return keys
+
+    def _canonical(self, tablename, key):
+        """Get the snapshot's private copy of a document, which is the same object every time it is looked up.
+
+        :return: Document or None.
+        """
+        if key in self._deleted[tablename]:
+            return None
+        thisdoc = self._identity[tablename].get(key)
+        if thisdoc is None:
+            indexed = self._get(self._indexes[tablename], key)
+            if not indexed:
+                return None
+            thisdoc = Document(copy.deepcopy(dict(indexed)), indexed.doc_id)
+            self._identity[tablename][key] = thisdoc
+        return thisdoc
+
+    def _record(self, method, tablename, key, document):
+        """Record a change, keeping only the fields that differ from the snapshot.
+
+        :param method: The name of the DatabaseManager method that will save the change.
+        :param tablename: The name of the table the document belongs to.
+        :param key: The index key of the document, its ID or lowercase username.
+        :param document: The upserted document, or None if it was deleted.
+
+        :return: True if succeeded, False if a deleted document didn't exist.
+        """
+        keyfield = "name" if tablename == "users" else "id"
+
+        # Deleted documents are only remembered by their key.
+        if document is None:
+            if self._canonical(tablename, key) is None:
+                return False
+            self._deleted[tablename].add(key)
+            self.writes.append((method, {keyfield: key}))
+            return True
+
+        # Bring the private copy up to date, in case a different dict was upserted.
+        self._deleted[tablename].discard(key)
+        thisdoc = self._canonical(tablename, key)
+        if thisdoc is None:
+            thisdoc = self._identity[tablename][key] = Document({}, 0)
+        if thisdoc is not document:
+            thisdoc.update(copy.deepcopy(dict(document)))
+
+        # Record the fields that changed since the snapshot was taken.
+        original = self._get(self._indexes[tablename], key) or {}
+        changes = {field: copy.deepcopy(value) for field, value in thisdoc.items()
+                   if field not in original or original[field] != value}
+        changes[keyfield] = thisdoc[keyfield]
+        self.writes.append((method, changes))
+        return True
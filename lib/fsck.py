@@ -0,0 +1,326 @@
+#######################
+# Dennis MUD          #
+# fsck.py             #
+# Copyright 2021      #
+# Michael D. Reiley   #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+from concurrent.futures import ProcessPoolExecutor
+
+# The kinds of problem the checker looks for, and how each is described.
+CHECKS = {
+    "exit_dest": "Exit leads to a room that does not exist",
+    "entrance_missing": "Room has no entrance record for an exit leading into it",
+    "entrance_stale": "Room has an entrance record for a room with no exit leading into it",
+    "room_item": "Room contains an item that does not exist",
+    "container_item": "Container holds an item that does not exist",
+    "user_item": "User holds an item that does not exist",
+    "user_room": "User is in a room that does not exist",
+    "telekey": "Telekey is paired to a room that does not exist",
+    "orphan": "Item exists but has no location",
+    "container_cycle": "Container holds itself through other containers",
+    "occupant": "Room lists a user who is not there"
+}
+
+# Worlds with fewer documents than this are always checked in a single process.
+PARALLEL_THRESHOLD = 20000
+
+
+def check(tables, online=None, workers=1):
+    """Check a world database for broken references.
+
+    Each problem found is returned as an issue tuple (kind, table, key, detail, repairs), where key is the room or
+    item ID or the lowercase username of the document with the problem, and repairs is a list of operations for
+    repair() that fix it.
+
+    :param tables: The raw world database, as read from its storage.
+    :param online: Set of lowercase usernames of online users, or None if the server is not running.
+    :param workers: Number of worker processes to split large worlds across.
+
+    :return: List of issues, sorted.
+    """
+    context = _context(tables, online)
+
+    # Split the documents into one chunk per worker, and check each chunk.
+    documents = [(tablename, doc) for tablename in ("rooms", "items", "users")
+                 for doc in tables.get(tablename, {}).values()]
+    if workers > 1 and len(documents) >= PARALLEL_THRESHOLD:
+        chunks = [documents[n::workers] for n in range(workers)]
+        with ProcessPoolExecutor(workers) as pool:
+            results = pool.map(_check_documents, chunks, [context] * workers)
+            issues = [issue for result in results for issue in result]
+    else:
+        issues = _check_documents(documents, context)
+
+    # Container cycles span many documents, so look for them with the whole world at hand.
+    issues += _check_cycles(tables, context)
+    return sorted(issues, key=lambda issue: (issue[0], issue[1], str(issue[2])))
+
+
+def repair(issues, lookup):
+    """Apply the repairs for a list of issues.
+
+    :param issues: The issues returned by check().
+    :param lookup: Function taking a table name and key, returning the document to change or None.
+
+    :return: List of (table, key, document) for every document changed, in the order first changed.
+    """
+    changed = {}
+    for issue in issues:
+        for tablename, key, op, path, value in issue[4]:
+            document = changed[(tablename, key)] if (tablename, key) in changed else lookup(tablename, key)
+            if document is None:
+                continue
+            field = document
+            for part in path[:-1]:
+                field = field[part]
+            if op == "set":
+                field[path[-1]] = value
+            elif op == "append" and value not in field[path[-1]]:
+                field[path[-1]].append(value)
+            elif op == "remove":
+                field[path[-1]] = [x for x in field[path[-1]] if x != value]
+            elif op == "remove_exit":
+                field[path[-1]] = [x for x in field[path[-1]] if x["dest"] != value]
+            changed[(tablename, key)] = document
+    return [(tablename, key, document) for (tablename, key), document in changed.items()]
+
+
+def verify(issue, lookup, held, online=None):
+    """Check whether an issue found earlier is still there, before repairing it.
+
+    The world may have changed since it was checked, and a repair applied to a problem that was fixed in the meantime
+    could break something else, such as giving an item that was picked up a second location.
+
+    :param issue: An issue returned by check().
+    :param lookup: Function taking a table name and key, returning the current document or None.
+    :param held: Function taking an item ID, returning whether anything currently holds the item.
+    :param online: Set of lowercase usernames of online users, or None if the server is not running.
+
+    :return: True if the issue is still there, False if not.
+    """
+    kind, tablename, key, detail, repairs = issue
+    doc = lookup(tablename, key)
+    if doc is None:
+        return False
+    if kind == "exit_dest":
+        return detail in [ex["dest"] for ex in doc["exits"]] and lookup("rooms", detail) is None
+    if kind in ("entrance_missing", "entrance_stale"):
+        source = lookup("rooms", detail)
+        leads = source is not None and key in [ex["dest"] for ex in source["exits"]]
+        if kind == "entrance_missing":
+            return leads and detail not in doc["entrances"]
+        return not leads and detail in doc["entrances"]
+    if kind == "room_item":
+        return detail in doc["items"] and lookup("items", detail) is None
+    if kind == "container_item":
+        return detail in doc["container"]["inventory"] and lookup("items", detail) is None
+    if kind == "user_item":
+        return detail in doc["inventory"] + doc.get("equipment", []) and lookup("items", detail) is None
+    if kind == "user_room":
+        return doc["room"] == detail and lookup("rooms", detail) is None
+    if kind == "telekey":
+        return doc["telekey"] == detail and lookup("rooms", detail) is None
+    if kind == "orphan":
+        return not held(key)
+    if kind == "container_cycle":
+        # The cycle is still there if the parent still holds the child, and the child still leads back to the parent.
+        if detail not in doc["container"]["inventory"]:
+            return False
+        seen, stack = set(), [detail]
+        while stack:
+            itemid = stack.pop()
+            if itemid == key:
+                return True
+            container = lookup("items", itemid) if itemid not in seen else None
+            seen.add(itemid)
+            if container:
+                stack.extend(container["container"]["inventory"])
+        return False
+    if kind == "occupant":
+        user = lookup("users", detail.lower())
+        return detail in doc.get("users", []) and (user is None or user["room"] != key or
+                                                   (online is not None and detail.lower() not in online))
+    return False
+
+
+def keyed(tables):
+    """Index the raw world database by room and item ID and lowercase username, for use with repair().
+
+    :param tables: The raw world database, as read from its storage.
+
+    :return: Dictionary of dictionaries of documents by key, by table name.
+    """
+    return {
+        "rooms": {room["id"]: room for room in tables.get("rooms", {}).values()},
+        "items": {item["id"]: item for item in tables.get("items", {}).values()},
+        "users": {user["name"].lower(): user for user in tables.get("users", {}).values()}
+    }
+
+
+def _context(tables, online):
+    """Gather the world-wide facts that each document is checked against.
+
+    :param tables: The raw world database.
+    :param online: Set of lowercase usernames of online users, or None.
+
+    :return: Dictionary of the facts, small enough to send to worker processes.
+    """
+    rooms = tables.get("rooms", {}).values()
+    items = tables.get("items", {}).values()
+    users = tables.get("users", {}).values()
+
+    # Everything that can hold an item.
+    held = set()
+    for room in rooms:
+        held.update(room["items"])
+    for item in items:
+        held.update(item["container"]["inventory"])
+    for user in users:
+        held.update(user["inventory"])
+        held.update(user.get("equipment", []))
+
+    # Which rooms have exits leading into each room.
+    sources = {}
+    for room in rooms:
+        for ex in room["exits"]:
+            sources.setdefault(ex["dest"], set()).add(room["id"])
+
+    return {
+        "rooms": {room["id"] for room in rooms},
+        "items": {item["id"] for item in items},
+        "users": {user["name"].lower(): user["room"] for user in users},
+        "sources": sources,
+        "held": held,
+        "online": online
+    }
+
+
+def _rehome(item, context):
+    """Find a new place for an item that has lost its location: its first owner's inventory, or else the first room.
+
+    :param item: The item document.
+    :param context: The world-wide facts.
+
+    :return: Repair operation.
+    """
+    for owner in item["owners"]:
+        if owner.lower() in context["users"]:
+            return "users", owner.lower(), "append", ["inventory"], item["id"]
+    return "rooms", 0, "append", ["items"], item["id"]
+
+
+def _check_documents(documents, context):
+    """Check a chunk of documents.
+
+    :param documents: List of (table name, document).
+    :param context: The world-wide facts.
+
+    :return: List of issues.
+    """
+    issues = []
+    for tablename, doc in documents:
+        if tablename == "rooms":
+            roomid = doc["id"]
+            for dest in sorted({ex["dest"] for ex in doc["exits"]}):
+                if dest not in context["rooms"]:
+                    issues.append(("exit_dest", "rooms", roomid, dest,
+                                   [("rooms", roomid, "remove_exit", ["exits"], dest)]))
+            for source in sorted(context["sources"].get(roomid, ())):
+                if source not in doc["entrances"]:
+                    issues.append(("entrance_missing", "rooms", roomid, source,
+                                   [("rooms", roomid, "append", ["entrances"], source)]))
+            for source in doc["entrances"]:
+                if source not in context["sources"].get(roomid, ()):
+                    issues.append(("entrance_stale", "rooms", roomid, source,
+                                   [("rooms", roomid, "remove", ["entrances"], source)]))
+            for itemid in doc["items"]:
+                if itemid not in context["items"]:
+                    issues.append(("room_item", "rooms", roomid, itemid,
+                                   [("rooms", roomid, "remove", ["items"], itemid)]))
+            for username in doc.get("users", []):
+                if context["users"].get(username.lower()) != roomid or \
+                        (context["online"] is not None and username.lower() not in context["online"]):
+                    issues.append(("occupant", "rooms", roomid, username,
+                                   [("rooms", roomid, "remove", ["users"], username)]))
+
+        elif tablename == "items":
+            itemid = doc["id"]
+            for contained in doc["container"]["inventory"]:
+                if contained not in context["items"]:
+                    issues.append(("container_item", "items", itemid, contained,
+                                   [("items", itemid, "remove", ["container", "inventory"], contained)]))
+            if doc["telekey"] is not None and doc["telekey"] not in context["rooms"]:
+                issues.append(("telekey", "items", itemid, doc["telekey"],
+                               [("items", itemid, "set", ["telekey"], None)]))
+            if itemid not in context["held"]:
+                issues.append(("orphan", "items", itemid, None, [_rehome(doc, context)]))
+
+        elif tablename == "users":
+            username = doc["name"].lower()
+            for field in ("inventory", "equipment"):
+                for itemid in doc.get(field, []):
+                    if itemid not in context["items"]:
+                        issues.append(("user_item", "users", username, itemid,
+                                       [("users", username, "remove", [field], itemid)]))
+            if doc["room"] not in context["rooms"]:
+                issues.append(("user_room", "users", username, doc["room"],
+                               [("users", username, "set", ["room"], 0)]))
+    return issues
+
+
+def _check_cycles(tables, context):
+    """Find containers that hold themselves through other containers.
+
+    Each cycle is broken by taking the item that closes it out of its container and giving it a new home.
+
+    :param tables: The raw world database.
+    :param context: The world-wide facts.
+
+    :return: List of issues.
+    """
+    items = {item["id"]: item for item in tables.get("items", {}).values()}
+    issues = []
+    state = {}
+    for start in sorted(items):
+        if start in state:
+            continue
+        # Walk the containers depth first, without recursion since chains may be long.
+        stack = [(start, iter(items[start]["container"]["inventory"]))]
+        state[start] = "open"
+        while stack:
+            parent, children = stack[-1]
+            child = next(children, None)
+            if child is None:
+                state[parent] = "done"
+                stack.pop()
+            elif child not in items:
+                continue
+            elif state.get(child) == "open":
+                issues.append(("container_cycle", "items", parent, child,
+                               [("items", parent, "remove", ["container", "inventory"], child),
+                                _rehome(items[child], context)]))
+            elif child not in state:
+                state[child] = "open"
+                stack.append((child, iter(items[child]["container"]["inventory"])))
+    return issues
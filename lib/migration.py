@@ -0,0 +1,210 @@
+#######################
+# Dennis MUD          #
+# migration.py        #
+# Copyright 2021      #
+# Michael D. Reiley   #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+import os
+import time
+
+from lib.database import BACKENDS, DB_VERSION
+from lib.storage import rehydrate_tables
+
+# Documents may be stored sparse from this version on, and are filled back in before being migrated.
+SPARSE_SINCE = 5
+
+# Registered migration steps. Maps the version a step upgrades to onto a list of (table, function) pairs.
+STEPS = {}
+
+# Registered finishers. Maps a version onto a list of functions to run once every document has been through its steps.
+FINISHERS = {}
+
+
+def step(version, table):
+    """Register a migration step.
+
+    The decorated function is called once for every document in the table, as step(document, state), and upgrades
+    the document in place from the previous version to this one. The state dictionary is shared by every step and
+    finisher of the same version, for migrations that need to gather information across documents.
+    The function may return False to report that it left the document unchanged.
+
+    :param version: The database version this step upgrades to.
+    :param table: The name of the table whose documents this step upgrades.
+    """
+    def register(func):
+        STEPS.setdefault(version, []).append((table, func))
+        return func
+    return register
+
+
+def finisher(version):
+    """Register a migration finisher.
+
+    The decorated function is called as finisher(tables, state) after every document has been through every step,
+    with the complete set of tables. Finishers should only fill in fields introduced by their own version.
+
+    :param version: The database version this finisher belongs to.
+    """
+    def register(func):
+        FINISHERS.setdefault(version, []).append(func)
+        return func
+    return register
+
+
+class MigrationRunner:
+    """Migration Runner
+
+    Upgrades a world database across any number of versions in a single pass. The database is read once,
+    each document is passed through every pending step in version order, and the result is written once.
+
+    :ivar counts: Number of documents changed by each step, by step name.
+    :ivar elapsed: Number of seconds the last migration took, not counting the final write.
+    """
+    def __init__(self, filename, backend="tinydb", dry_run=False):
+        """Migration Runner Initializer
+
+        :param filename: The filename of the world database.
+        :param backend: The storage backend of the world database.
+        :param dry_run: If True, perform the migration in memory but don't write it.
+        """
+        self.counts = {}
+        self.elapsed = 0
+
+        self._filename = filename
+        self._backend = backend
+        self._dry_run = dry_run
+
+    def run(self, target=DB_VERSION, source=None):
+        """Migrate the database to the target version.
+
+        :param target: The database version to migrate to.
+        :param source: If set, only migrate a database of exactly this version.
+
+        :return: (from version, to version) if succeeded, None if the database is empty, locked, or the wrong version.
+        """
+        # Make sure the database isn't in use.
+        if os.path.exists(self._filename + ".lock"):
+            print("Lockfile exists for database: {0}".format(self._filename))
+            return None
+
+        # Read the whole database in one go.
+        storage = BACKENDS[self._backend](self._filename)
+        tables = storage.read()
+        if not tables or not tables.get("_info"):
+            print("The database is empty or has no version record: {0}".format(self._filename))
+            storage.close()
+            return None
+        info_record = next(iter(tables["_info"].values()))
+        version = info_record["version"]
+        if version > target or (source is not None and version != source):
+            print("Database is v{0}, which can't be migrated to v{1} here.".format(version, target))
+            storage.close()
+            return None
+
+        # Pass every document through the pending steps, in version order.
+        start = time.time()
+        if version >= SPARSE_SINCE:
+            rehydrate_tables(tables, shared=False)
+        pending = range(version + 1, target + 1)
+        states = {v: {} for v in pending}
+        for tablename, documents in tables.items():
+            steps = [(v, func) for v in pending for table, func in STEPS.get(v, []) if table == tablename]
+            if not steps:
+                continue
+            for document in documents.values():
+                for v, func in steps:
+                    if func(document, states[v]) is not False:
+                        self.counts[func.__name__] = self.counts.get(func.__name__, 0) + 1
+
+        # Let each version finish up with the whole world available.
+        for v in pending:
+            for func in FINISHERS.get(v, []):
+                self.counts[func.__name__] = func(tables, states[v]) or 0
+        info_record["version"] = target
+        self.elapsed = time.time() - start
+
+        # Write the migrated database back in a single write.
+        if not self._dry_run and version != target:
+            storage.write(tables)
+        storage.close()
+        return version, target
+
+
+# Migration steps. Each one corresponds to a former dbupdater script.
+
+@step(2, "rooms")
+def add_room_entrances(room, state):
+    """v2: Add an entrances field to every room, and note every exit so the finisher can fill them in.
+
+    This is needed for the `list entrances` command to not take several seconds on larger worlds.
+    """
+    room["entrances"] = []
+    for ex in room["exits"]:
+        state.setdefault(ex["dest"], []).append(room["id"])
+
+
+@finisher(2)
+def fill_room_entrances(tables, state):
+    """v2: Record an entrance in the destination room of every exit.
+
+    :return: The number of entrance records added.
+    """
+    added = 0
+    rooms = {room["id"]: room for room in tables["rooms"].values()}
+    for dest, sources in state.items():
+        destroom = rooms.get(dest)
+        if not destroom:
+            print("Skipping exits to nonexistent room: {0}".format(dest))
+            continue
+        for source in sources:
+            if source not in destroom["entrances"]:
+                destroom["entrances"].append(source)
+                added += 1
+    return added
+
+
+@step(3, "items")
+def add_item_telekey(item, state):
+    """v3: Add an empty telekey field to every item.
+    """
+    item["telekey"] = None
+
+
+@step(4, "users")
+def add_user_pronouns(user, state):
+    """v4: Add a neutral pronouns field to every user.
+
+    This is needed for pronouns used in formatting posturing text.
+    """
+    user["pronouns"] = "neutral"
+
+
+@step(5, "rooms")
+def add_exit_entrance_action(room, state):
+    """v5: Add an entrance action field to every exit, for a custom action on entering the destination room.
+    """
+    if not room["exits"]:
+        return False
+    for ex in room["exits"]:
+        ex["action"]["entrance"] = ""
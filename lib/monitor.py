@@ -0,0 +1,217 @@
+#######################
+# Dennis MUD          #
+# monitor.py          #
+# Copyright 2021      #
+# Michael D. Reiley   #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+import collections
+import contextlib
+import sys
+import threading
+import time
+import traceback
+
+from lib.logger import Logger
+from lib.stats import Histogram
+
+# Commands whose arguments hold passwords or recovery phrases, which are masked in anything the watchdog records.
+SECRET_COMMANDS = ("register", "login", "password", "recover")
+
+
+def mask_line(line):
+    """Mask the arguments of a command line if the command takes a password.
+
+    :param line: The command line as it was typed.
+
+    :return: The command line, with each argument replaced by asterisks if the command takes a password.
+    """
+    words = line.split()
+    if not words or words[0].lower() not in SECRET_COMMANDS:
+        return ' '.join(words)
+    return ' '.join([words[0]] + ["***"] * (len(words) - 1))
+
+
+class LagMonitor:
+    """Lag Monitor
+
+    Measures how late the reactor gets around to running a task that is scheduled at a fixed, short interval.
+    Everything runs on the reactor thread, so anything that blocks it, such as a slow command, shows up as lag.
+    Call tick() from a LoopingCall running at the interval.
+
+    :ivar interval: The number of seconds between ticks.
+    :ivar threshold: Lag of at least this many seconds is logged as a spike.
+    :ivar spikes: The number of spikes seen.
+    :ivar lag: Histogram of the lag seen at each tick, in seconds.
+    """
+    def __init__(self, interval, threshold, log=None):
+        """Lag Monitor Initializer
+
+        :param interval: The number of seconds between ticks.
+        :param threshold: Lag of at least this many seconds is logged as a spike.
+        :param log: Alternative logging facility, if set.
+        """
+        self.interval = interval
+        self.threshold = threshold
+        self.spikes = 0
+        self.lag = Histogram()
+        self._last = None
+        self._log = log or Logger("monitor")
+
+    def tick(self):
+        """Measure the lag since the last tick.
+
+        :return: The lag in seconds.
+        """
+        now = time.monotonic()
+        lag = 0.0
+        if self._last is not None:
+            lag = max(0.0, now - self._last - self.interval)
+            self.lag.add(lag)
+            if lag >= self.threshold:
+                self.spikes += 1
+                self._log.warn("Reactor lag spike: {lag}ms", lag=round(lag * 1000, 1))
+        self._last = now
+        return lag
+
+    def report(self):
+        """Report the lag seen so far.
+
+        :return: Dictionary of the number of ticks and spikes, and the lag in milliseconds.
+        """
+        return {"ticks": self.lag.count, "spikes": self.spikes,
+                "lag_ms": {key: round(value * 1000, 3) for key, value in self.lag.summary().items()}}
+
+
+class CommandWatchdog:
+    """Command Watchdog
+
+    Flags command lines that take longer than a budget to run. A background thread checks on the command running on
+    the reactor thread, and takes a sample of its stack once it runs over budget, to show where it was spending the
+    time. When the command finishes, it is logged and remembered along with its user, how long it took, and how many
+    database operations it made, if the database is instrumented.
+
+    :ivar budget: Command lines taking at least this many seconds are flagged.
+    :ivar slow: The most recently flagged command lines, oldest first.
+    """
+    def __init__(self, budget, database=None, history=50, log=None):
+        """Command Watchdog Initializer
+
+        :param budget: Command lines taking at least this many seconds are flagged.
+        :param database: The DatabaseManager, to count its operations if instrumentation is enabled.
+        :param history: The number of flagged command lines to remember.
+        :param log: Alternative logging facility, if set.
+        """
+        self.budget = budget
+        self.slow = collections.deque(maxlen=history)
+        self._database = database
+        self._current = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._log = log or Logger("monitor")
+
+    def start(self):
+        """Start the background thread that takes stack samples.
+
+        :return: None
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, name="command-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread.
+
+        :return: None
+        """
+        self._stop.set()
+
+    @contextlib.contextmanager
+    def watch(self, console, line):
+        """Time a command line. Use as `with watchdog.watch(console, line):`.
+
+        Command lines run by other command lines are counted as part of them.
+
+        :param console: The console running the command line.
+        :param line: The command line.
+
+        :return: Context manager.
+        """
+        if self._current is not None:
+            yield
+            return
+        stats = getattr(self._database, "stats", None)
+        calls = stats.calls if stats else None
+        current = {"start": time.perf_counter(), "thread": threading.get_ident(), "stack": None}
+        self._current = current
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._current = None
+            elapsed = time.perf_counter() - current["start"]
+            if elapsed >= self.budget:
+                self._flag(console, line, elapsed, stats.calls - calls if stats else None, current["stack"])
+
+    def report(self):
+        """Report the most recently flagged command lines.
+
+        :return: List of dictionaries, oldest first.
+        """
+        return list(self.slow)
+
+    def _flag(self, console, line, elapsed, calls, stack):
+        """Log and remember a command line that ran over budget.
+
+        :param console: The console that ran the command line.
+        :param line: The command line.
+        :param elapsed: How long it took, in seconds.
+        :param calls: The number of database operations it made, or None if the database isn't instrumented.
+        :param stack: The stack sample taken while it ran, or None if it finished before one was taken.
+
+        :return: None
+        """
+        entry = {"time": int(time.time()), "line": mask_line(line),
+                 "user": console.user["name"] if console.user else None, "seconds": round(elapsed, 3),
+                 "database_calls": calls, "stack": stack}
+        self.slow.append(entry)
+        self._log.warn("Slow command ({seconds}s, {calls} database calls) from {user}: {line}", seconds=entry["seconds"],
+                       calls="unknown" if calls is None else calls, user=entry["user"] or console.rname,
+                       line=entry["line"])
+        if stack:
+            self._log.warn("Stack sample of slow command:\n{stack}", stack=''.join(stack).rstrip())
+
+    def _sample(self):
+        """Take a stack sample of each command line that runs over budget. This runs on the background thread.
+
+        :return: None
+        """
+        while not self._stop.wait(max(self.budget / 4, 0.01)):
+            with self._lock:
+                current = self._current
+                if not current or current["stack"] or time.perf_counter() - current["start"] < self.budget:
+                    continue
+                frame = sys._current_frames().get(current["thread"])
+                if frame:
+                    current["stack"] = traceback.format_stack(frame)
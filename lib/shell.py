@@ -25,12 +25,16 @@
 # IN THE SOFTWARE.
 # **********
 
+import contextlib
 import importlib.machinery
 import importlib.util
+import json
 import os
 import string
 import sys
 import random
+import time
+import traceback
 
 from lib.logger import Logger
 from lib.color import *
@@ -39,31 +43,132 @@ import unicodedata as ud
 
 import builtins
 from lib import common
+from lib.console import Console, SnapshotConsole
+from lib.stats import CommandStats
 builtins.COMMON = common
 
 # The directory where command modules are stored, relative to this directory.
 COMMAND_DIR = "commands/"
 
+# The command manifest records the constants of every command module along with the size and modification time of its
+# file, so that modules don't have to be imported at startup. It is kept with the cached bytecode of the modules.
+MANIFEST_FILE = os.path.join(COMMAND_DIR, "__pycache__", "manifest.json")
+MANIFEST_FORMAT = 1
+
+# The command module constants recorded in the command manifest.
+MANIFEST_FIELDS = ("NAME", "CATEGORIES", "ALIASES", "SPECIAL_ALIASES", "USAGE", "DESCRIPTION", "HEAVY")
+
+# How many times a heavy command is run again when the world changed under it, before it gives up.
+HEAVY_RETRIES = 2
+
 # A string list of all characters allowed in user commands.
 ALLOWED_CHARACTERS = string.ascii_letters + string.digits + string.punctuation + ' '
 # Whats the point of UTf-8 if we cant use it?
 DISALLOWED_CHARACTERS = "{}"
 
+class LazyCommand:
+    """Lazy Command
+
+    Stands in for a command module whose constants were read from the command manifest. The module itself is only
+    imported the first time something else is needed from it, which is usually when the command is first called.
+    """
+    def __init__(self, cname, path, constants):
+        """Lazy Command Initializer
+
+        :param cname: The name of the command.
+        :param path: The path of the command module.
+        :param constants: The constants of the module, from the command manifest.
+        """
+        self.__dict__.update(constants)
+        self._cname = cname
+        self._path = path
+        self._module = None
+
+    def __getattr__(self, name):
+        """Import the module if needed, and get an attribute from it.
+
+        Constants that were missing from the manifest are missing from the module too, so asking for those never
+        imports the module.
+
+        :param name: The name of the attribute.
+
+        :return: The attribute.
+        """
+        if name in MANIFEST_FIELDS or name.startswith('_'):
+            raise AttributeError(name)
+        if self._module is None:
+            self._module = import_command(self._cname, self._path)
+        return getattr(self._module, name)
+
+
+def import_command(cname, path):
+    """Import a command module.
+
+    :param cname: The name of the command.
+    :param path: The path of the command module.
+
+    :return: The module.
+    """
+    # Different import code recommended for different Python versions.
+    if sys.version_info[1] < 5:
+        return importlib.machinery.SourceFileLoader(cname, path).load_module()
+    spec = importlib.util.spec_from_file_location(cname, path)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    return mod
+
+
+def read_manifest():
+    """Read the command manifest.
+
+    :return: The manifest, or an empty one if it is missing, unreadable, or of another format.
+    """
+    try:
+        with open(MANIFEST_FILE) as manifestfile:
+            manifest = json.load(manifestfile)
+        if manifest.get("format") == MANIFEST_FORMAT:
+            return manifest
+    except (OSError, ValueError):
+        pass
+    return {"format": MANIFEST_FORMAT, "commands": {}, "overlaps": []}
+
+
+def write_manifest(manifest):
+    """Write the command manifest, replacing the old one in a single step.
+
+    :param manifest: The manifest.
+
+    :return: True if succeeded, False if failed.
+    """
+    try:
+        os.makedirs(os.path.dirname(MANIFEST_FILE), exist_ok=True)
+        with open(MANIFEST_FILE + ".tmp", "w") as manifestfile:
+            json.dump(manifest, manifestfile, indent=1, sort_keys=True)
+        os.replace(MANIFEST_FILE + ".tmp", MANIFEST_FILE)
+        return True
+    except OSError:
+        return False
+
+
 class Shell:
     """Shell
 
     The Shell loads command modules, enumerates help, and provides command access to the user consoles.
 
     :ivar router: The Router instance, which handles interfacing between the server backend and the user consoles.
+    :ivar stats: The CommandStats instance, which keeps call counters and latencies for each command.
+    :ivar watchdog: The CommandWatchdog instance, which flags slow command lines, if any.
     """
     def __init__(self, database, router, log=None):
         """Console Initializer
 
-        :param database: The DatabaseManager instance to use.
+        :param database: The DatabaseManager instance to use, or None to only load the command modules.
         :param router: The Router instance, which handles interfacing between the server backend and the user consoles.
         :param log: Alternative logging facility, if not set.
         """
         self.router = router
+        self.stats = CommandStats()
+        self.watchdog = None
         self._log = log or Logger("shell")
 
         self._database = database
@@ -72,6 +177,15 @@ class Shell:
         self._special_aliases = {}
         self._disabled_commands = []
 
+        # A trie of the words of every command name and alias, for resolving command lines in one pass. Each node maps
+        # the next word to a child node, and holds the name of the command ending there under the key None.
+        self._command_trie = {}
+
+        # The lowercase exit names of each room looked at, dropped whenever the room's exits change.
+        self._exit_index = {}
+        if self._database:
+            self._database.subscribe("rooms", self._drop_exits)
+
         self._load_modules()
         self._build_help()
 
@@ -79,11 +193,15 @@ class Shell:
         """Enumerate and load available command modules.
 
         Command modules are stored in COMMAND_DIR, and their filename defines their command name.
+        Modules that haven't changed since the command manifest was written are not imported until they are first
+        used. The manifest is brought up to date if anything changed.
 
         :return: True
         """
         self._log.info("Loading command modules...")
-        command_modules = os.listdir(COMMAND_DIR)
+        command_modules = sorted(os.listdir(COMMAND_DIR))
+        manifest = read_manifest()
+        entries = {}
 
         # Run through the list of all files in the command directory.
         for command in command_modules:
@@ -91,19 +209,24 @@ class Shell:
             if command.endswith(".py") and not command.startswith('_'):
                 command_path = os.path.join(os.getcwd(), COMMAND_DIR, command)
                 cname = command[:-3].replace('_', ' ')
+                stat = os.stat(command_path)
 
                 # Give an error if another command with the same name is already loaded.
                 if cname in self._commands:
                     self._log.error("A command by this name was loaded twice: {cname}", cname=cname)
 
-                # Different import code recommended for different Python versions.
-                if sys.version_info[1] < 5:
-                    self._commands[cname] = importlib.machinery.SourceFileLoader(cname, command_path).load_module()
+                # Take the constants from the manifest if the file hasn't changed since. Otherwise import the module now
+                # and record its constants.
+                entry = manifest["commands"].get(command)
+                if entry and entry["stamp"] == [stat.st_size, stat.st_mtime_ns]:
+                    self._commands[cname] = LazyCommand(cname, command_path, entry["constants"])
                 else:
-                    spec = importlib.util.spec_from_file_location(cname, command_path)
-                    mod = importlib.util.module_from_spec(spec)
-                    spec.loader.exec_module(mod)
-                    self._commands[cname] = mod
+                    self._commands[cname] = import_command(cname, command_path)
+                    constants = {field: getattr(self._commands[cname], field) for field in MANIFEST_FIELDS
+                                 if hasattr(self._commands[cname], field)}
+                    entry = {"stamp": [stat.st_size, stat.st_mtime_ns],
+                             "constants": json.loads(json.dumps(constants))}
+                entries[command] = entry
 
                 # Set up Aliases for this command.
                 # Aliases are alternative names for a command.
@@ -117,6 +240,12 @@ class Shell:
                     for special_alias in self._commands[cname].SPECIAL_ALIASES:
                         self._special_aliases[special_alias] = cname
 
+        # If no command changed, the overlaps were already found when the manifest was written.
+        if entries == manifest["commands"]:
+            for cname, cname2 in manifest["overlaps"]:
+                self._log.warn("Overlapping command names: {cname}, {cname2}", cname=cname, cname2=cname2)
+            return self._finish_loading()
+
         # Check for partially overlapping command names.
         found_overlaps = []
         for cname in self._commands:
@@ -138,9 +267,70 @@ class Shell:
                         self._log.warn("Overlapping command names: {cname}, {cname2}", cname=cname,
                                        cname2=cname2)
 
+        # Save the manifest for next time.
+        if not write_manifest({"format": MANIFEST_FORMAT, "commands": entries, "overlaps": found_overlaps}):
+            self._log.warn("Could not write command manifest: {filename}", filename=MANIFEST_FILE)
+        return self._finish_loading()
+
+    def _finish_loading(self):
+        """Finish loading the command modules by building the command trie.
+
+        :return: True
+        """
+        # Build the command trie.
+        self._command_trie = {}
+        for cname in self._commands:
+            node = self._command_trie
+            for word in cname.split(' '):
+                node = node.setdefault(word, {})
+            node[None] = cname
+
         self._log.info("Finished loading command modules.")
         return True
 
+    def _resolve(self, words):
+        """Find the longest run of words at the start of a command line that names a command.
+
+        :param words: The command line, split into words.
+
+        :return: The command name and how many words it has, or (None, 0) if the line doesn't start with a command.
+        """
+        node = self._command_trie
+        found = (None, 0)
+        for pos, word in enumerate(words):
+            node = node.get(word.lower())
+            if node is None:
+                break
+            if None in node:
+                found = (node[None], pos + 1)
+        return found
+
+    def _exit_names(self, roomid):
+        """Get the lowercase names of the exits in a room from the exit index, adding them if needed.
+
+        :param roomid: The ID of the room.
+
+        :return: List of exit names, or None if the room doesn't exist.
+        """
+        names = self._exit_index.get(roomid)
+        if names is None:
+            thisroom = self._database.room_by_id(roomid)
+            if not thisroom:
+                return None
+            names = self._exit_index[roomid] = list(dict.fromkeys(ex["name"].lower() for ex in thisroom["exits"]))
+        return names
+
+    def _drop_exits(self, roomid, changed):
+        """Drop a room from the exit index when its exits change. This is a database change subscriber.
+
+        :param roomid: The ID of the changed room.
+        :param changed: The set of changed fields, or None if the room was deleted.
+
+        :return: None
+        """
+        if changed is None or "exits" in changed:
+            self._exit_index.pop(roomid, None)
+
     def _build_help(self):
         """Enumerate available help categories and commands.
 
@@ -171,6 +361,21 @@ class Shell:
         :param line: The command line to parse.
         :param show_command: Whether or not to echo the command being executed in the console.
 
+        :return: Command result or None.
+        """
+        # Let the watchdog time the whole command line, if there is one.
+        if self.watchdog and line:
+            with self.watchdog.watch(console, line):
+                return self._command(console, line, show_command)
+        return self._command(console, line, show_command)
+
+    def _command(self, console, line, show_command):
+        """Parse and execute a command line, for command().
+
+        :param console: The console calling the command.
+        :param line: The command line to parse.
+        :param show_command: Whether or not to echo the command being executed in the console.
+
         :return: Command result or None.
         """
         # Return if we got an empty line.
@@ -201,39 +406,31 @@ class Shell:
         line = [elem for elem in line if elem != '']
 
         # Find out which part of the line is the command, and which part is its arguments.
-        for splitpos in range(len(line)):
-            # Check if the whole line is a command with no arguments.
-            if splitpos == 0:
-                # Call with no arguments.
-                if ' '.join(line).lower() in self._commands.keys():
-                    if not console.user:
-                        console.msg("> " + ' '.join(line))
-                        console.msg('='*20)
-                    elif show_command and console.user["cecho"]["enabled"]:
-                        console.msg("> " + ' '.join(line))
-                        console.msg('='*20)
-                    return self.call(console, ' '.join(line).lower(), [])
-
-                # Keep searching.
-                continue
-
-            # Only part of the line is a command. Call that segment and pass the rest as arguments.
-            if ' '.join(line[:-splitpos]).lower() in self._commands.keys():
-                # Log and echo commands to the console that don't involve passwords.
-                if line[0] not in ["register", "login", "password"]:
-                    if not console.user:
-                        console.msg("> " + ' '.join(line))
-                        console.msg('='*20)
-                    elif show_command and console.user["cecho"]["enabled"]:
-                        console.msg("> " + ' '.join(line))
-                        console.msg('=' * 20)
-                return self.call(console, ' '.join(line[:-splitpos]), line[-splitpos:])
+        cname, length = self._resolve(line)
+        if cname:
+            # Log and echo commands to the console that don't involve passwords.
+            if length == len(line) or line[0] not in ["register", "login", "password"]:
+                if not console.user:
+                    console.msg("> " + ' '.join(line))
+                    console.msg('='*20)
+                elif show_command and console.user["cecho"]["enabled"]:
+                    console.msg("> " + ' '.join(line))
+                    console.msg('='*20)
+            return self.call(console, cname, line[length:])
 
         # We haven't found a command. Maybe it's an exit name, but only if we're logged in.
+        # The exit index answers without looking up the room. Only several matches need the usual partial matching,
+        # which tells the user what they might have meant.
         if console.user:
-            partial = COMMON.match_partial("console", console, ' '.join(line).lower(), "exit", message=False)
-            if partial:
-                return self.call(console, "go", partial)
+            target = ' '.join(line).lower()
+            exits = self._exit_names(console.user["room"])
+            matches = [name for name in exits or () if COMMON.partial_match(target, name)]
+            if len(matches) == 1:
+                return self.call(console, "go", matches[0].split(' '))
+            if matches or exits is None:
+                partial = COMMON.match_partial("console", console, target, "exit", message=False)
+                if partial:
+                    return self.call(console, "go", partial)
 
         # We're still here and haven't found a command or exit in this line. Must be gibberish.
         if line:
@@ -373,11 +570,10 @@ class Shell:
 
         :return: True if succeeded, False if failed.
         """
-        for u in self.router.users:
-            if self.router.users[u]["console"].user and \
-                    self.router.users[u]["console"].user["name"] == username.lower():
-                self.router.users[u]["console"].msg(message)
-                return True
+        thisconsole = self._database.console_by_username(username)
+        if thisconsole and thisconsole.user:
+            thisconsole.msg(message)
+            return True
         return False
 
     def radiocast(self, message, radiofreq, exclude=None, excludelist=None, mtype=None, enmsg=None, tlang=None):
@@ -395,17 +591,26 @@ class Shell:
                         fenmsg="{0} broadcasts: \"{1}\"".format(potradio["name"],enmsg)
                         self.broadcast_room(self.router.users[u]["console"], fmessage, exclude, excludelist, mtype, fenmsg, tlang)
         # Iterate through rooms if they have an item dropped with same freq.
-        for room in self._database.rooms.all():
+        # A radio in an empty room has nobody to broadcast to, so only the rooms with users in them are looked at.
+        roomids = []
+        for username in self._database.online_users():
+            thisuser = self._database.user_by_name(username)
+            if thisuser and thisuser["room"] not in roomids:
+                roomids.append(thisuser["room"])
+        for roomid in roomids:
+            room = self._database.room_by_id(roomid)
+            occupants = self._database.users_in_room(roomid)
+            if not room or not occupants:
+                continue
+            talkto=self.console_by_username(occupants[0])
             for itemid in room["items"]:
-                iitem=COMMON.check_item("radiocast", self.router.users[u]["console"], itemid)
+                iitem=COMMON.check_item("radiocast", talkto, itemid)
                 if iitem:
                     if iitem["radio"]["enabled"] and iitem["radio"]["frequency"]==int(radiofreq):
                         # print("Found a radio in a room to broadcast to: "+message)
                         fmessage="{0} broadcasts: \"{1}\"".format(iitem["name"],message)
                         fenmsg="{0} broadcasts: \"{1}\"".format(iitem["name"],enmsg)
-                        if len(room["users"])>0:
-                            talkto=self.console_by_username(room["users"][0])
-                            self.broadcast_room(talkto, fmessage, exclude, excludelist, mtype, fenmsg, tlang)
+                        self.broadcast_room(talkto, fmessage, exclude, excludelist, mtype, fenmsg, tlang)
                 else:
                     pass
         return True
@@ -542,33 +747,21 @@ class Shell:
     def user_by_name(self, username):
         """Get a user by their name.
 
-        It is necessary to modify user records through the console before updating the database, if they are logged in.
-        Otherwise their database record will be overwritten next time something is changed in their console record.
-        If the user is logged in, return their console record.
-        Otherwise, return their record directly from the database.
+        The database hands out the same user document that a logged in user's console holds, so changes made through
+        it are never overwritten by the console.
 
-        :return: Console or Database User Document, or None
+        :return: User Document, or None
         """
-        for u in self.router.users:
-            if self.router.users[u]["console"].user and \
-                    self.router.users[u]["console"].user["name"].lower() == username.lower():
-                return self.router.users[u]["console"].user
         return self._database.user_by_name(username.lower())
 
     def user_by_nick(self, nickname):
         """Get a user by their nickname.
 
-        It is necessary to modify user records through the console before updating the database, if they are logged in.
-        Otherwise their database record will be overwritten next time something is changed in their console record.
-        If the user is logged in, return their console record.
-        Otherwise, return their record directly from the database.
+        The database hands out the same user document that a logged in user's console holds, so changes made through
+        it are never overwritten by the console.
 
-        :return: Console or Database User Document, or None
+        :return: User Document, or None
         """
-        for u in self.router.users:
-            if self.router.users[u]["console"].user and \
-                    self.router.users[u]["console"].user["nick"].lower() == nickname.lower():
-                return self.router.users[u]["console"].user
         return self._database.user_by_nick(nickname.lower())
 
     def console_by_username(self, username):
@@ -576,10 +769,7 @@ class Shell:
 
         :return: Console if succeeded, None if failed.
         """
-        for u in self.router.users:
-            if self.router.users[u]["console"].user and \
-                    self.router.users[u]["console"].user["name"].lower() == username.lower():
-                return self.router.users[u]["console"]
+        return self._database.console_by_username(username)
 
     def call(self, console, command, args):
         """Call a command, making sure it isn't disabled. (Unless we're a wizard, then it doesn't matter.)
@@ -588,10 +778,129 @@ class Shell:
         :param command: The name of the command to call.
         :param args: Arguments to the command.
 
-        :return: True if succeeded, False if failed
+        :return: True if succeeded, False if failed. A heavy command run on a worker thread returns True as soon as it
+            was started, and tells the user how it went by message.
         """
         command = command.lower()
         if command in self._disabled_commands and not console.user["wizard"]:
             console.msg("{0}: Command disabled.".format(command))
             return False
-        return self._commands[command].COMMAND(console, args)
+
+        # Commands marked HEAVY go through whole tables. If the reactor is running, run them on a worker thread against
+        # a snapshot of the database instead, so that everyone else doesn't have to wait for them.
+        module = self._commands[command]
+        start = time.perf_counter()
+        reactor = getattr(self.router, "_reactor", None)
+        if getattr(module, "HEAVY", False) and console.user and reactor:
+            snapshot = self._database.snapshot()
+            if snapshot:
+                reactor.callInThread(self._call_heavy, reactor, console, command, args, snapshot, start, 0)
+                return True
+
+        # Count the lines sent by any console during the call, and record the call in the command stats.
+        lines, nbytes = Console.lines_sent, Console.bytes_sent
+        try:
+            with self._attributed(module.NAME):
+                result = module.COMMAND(console, args)
+        except:
+            self.stats.record(module.NAME, time.perf_counter() - start, Console.lines_sent - lines,
+                              Console.bytes_sent - nbytes, error=True)
+            raise
+        self.stats.record(module.NAME, time.perf_counter() - start, Console.lines_sent - lines,
+                          Console.bytes_sent - nbytes, failed=result is False)
+        return result
+
+    @contextlib.contextmanager
+    def _attributed(self, name):
+        """Attribute the database operations made inside the block to a command, if database instrumentation is on.
+
+        Use as `with self._attributed(name):`. Commands called by other commands are attributed to the inner command
+        until they return.
+
+        :param name: The NAME of the command.
+
+        :return: Context manager.
+        """
+        stats = getattr(self._database, "stats", None)
+        if not stats:
+            yield
+            return
+        outer, stats.command = stats.command, name
+        try:
+            yield
+        finally:
+            stats.command = outer
+
+    def _call_heavy(self, reactor, console, command, args, snapshot, start, attempt):
+        """Run a heavy command against a database snapshot. This runs on a worker thread.
+
+        The command's messages are sent and its changes are saved in one transaction, back on the reactor thread.
+        If the command raises an exception, none of its changes are saved, and only its messages to the caller are sent.
+
+        :param reactor: The Twisted reactor.
+        :param console: The console calling the command.
+        :param command: The name of the command to call.
+        :param args: Arguments to the command.
+        :param snapshot: The DatabaseSnapshot to run the command against.
+        :param start: The time.perf_counter() time the command was called at.
+        :param attempt: How many times the command already ran and was thrown away because the world changed.
+
+        :return: None
+        """
+        standin = SnapshotConsole(console, snapshot)
+        result, error = None, False
+        try:
+            result = self._commands[command].COMMAND(standin, args)
+        except:
+            error = True
+            self._log.error("Error from heavy command: {command}", command=command)
+            self._log.error(traceback.format_exc(1))
+            snapshot.writes = []
+            standin.calls[:] = [call for call in standin.calls if call[0] == "console"]
+            standin.msg("{0}: ERROR: Internal command error.".format(command))
+        reactor.callFromThread(self._finish_heavy, reactor, console, command, args, standin, snapshot, start, attempt,
+                               result, error)
+
+    def _finish_heavy(self, reactor, console, command, args, standin, snapshot, start, attempt, result, error):
+        """Save the changes of a heavy command and send its messages, back on the reactor thread.
+
+        The messages and other calls the command made through its stand-in console, shell, and router are passed on
+        to the real ones, in order. If anything the command looked at changed while it ran, its changes and messages
+        are thrown away and it runs again against a new snapshot, up to HEAVY_RETRIES times.
+
+        The call is recorded in the command stats here, so its latency includes the time spent waiting for a worker
+        thread and for the reactor.
+
+        :param reactor: The Twisted reactor.
+        :param console: The console that called the command.
+        :param command: The name of the command that was called.
+        :param args: Arguments to the command.
+        :param standin: The SnapshotConsole the command ran with.
+        :param snapshot: The DatabaseSnapshot the command ran against.
+        :param start: The time.perf_counter() time the command was called at.
+        :param attempt: How many times the command already ran and was thrown away because the world changed.
+        :param result: What the command returned.
+        :param error: Whether the command raised an exception.
+
+        :return: True
+        """
+        lines, nbytes = Console.lines_sent, Console.bytes_sent
+        with self._attributed(self._commands[command].NAME):
+            saved = self._database.commit(snapshot)
+        if not saved:
+            if attempt < HEAVY_RETRIES:
+                retry = self._database.snapshot()
+                reactor.callInThread(self._call_heavy, reactor, console, command, args, retry, start, attempt + 1)
+                return True
+            self._log.warn("Gave up on heavy command after the world changed {count} times: {command}",
+                           count=attempt + 1, command=command)
+            standin.calls[:] = [("console", "msg", (
+                "{0}: ERROR: The world changed while the command ran. Please try again.".format(command), False), {})]
+            result = False
+        targets = {"console": console, "shell": self, "router": self.router}
+        for target, method, callargs, kwargs in standin.calls:
+            callargs = [console if arg is standin else arg for arg in callargs]
+            getattr(targets[target], method)(*callargs, **kwargs)
+        self.stats.record(self._commands[command].NAME, time.perf_counter() - start, Console.lines_sent - lines,
+                          Console.bytes_sent - nbytes, error=error, failed=result is False)
+        return True
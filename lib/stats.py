@@ -0,0 +1,289 @@
+#######################
+# Dennis MUD          #
+# stats.py            #
+# Copyright 2021      #
+# Michael D. Reiley   #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+import bisect
+import json
+import math
+import os
+import time
+
+# Upper bounds of the latency histogram buckets in seconds, ten to a decade from 10 microseconds to 100 seconds.
+# Anything slower falls into one last open-ended bucket. Percentiles are read off the buckets, so they are accurate to
+# within about a quarter of their value, which is plenty to tell a slow command from a fast one.
+BUCKETS = [10 ** (exponent / 10) for exponent in range(-50, 21)]
+
+# The percentiles reported for each histogram.
+PERCENTILES = (50, 90, 99)
+
+
+class Histogram:
+    """Histogram
+
+    Counts values into the fixed logarithmic BUCKETS, so that percentiles can be estimated in constant space.
+
+    :ivar counts: The number of values in each bucket, plus the open-ended bucket at the end.
+    :ivar count: The number of values added.
+    :ivar total: The sum of the values added.
+    :ivar max: The largest value added.
+    """
+    def __init__(self):
+        """Histogram Initializer
+        """
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        """Add a value to the histogram.
+
+        :param value: The value to add.
+
+        :return: None
+        """
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percent):
+        """Estimate a percentile of the values added.
+
+        :param percent: The percentile to estimate, from 0 to 100.
+
+        :return: The upper bound of the bucket holding the percentile, but never more than the largest value.
+        """
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * percent / 100))
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                break
+        if bucket == len(BUCKETS):
+            return self.max
+        return min(BUCKETS[bucket], self.max)
+
+    def summary(self):
+        """Summarize the histogram.
+
+        :return: Dictionary of the mean, each of PERCENTILES as "p50" and so on, and the max.
+        """
+        summary = {"mean": self.total / self.count if self.count else 0.0}
+        for percent in PERCENTILES:
+            summary["p{0}".format(percent)] = self.percentile(percent)
+        summary["max"] = self.max
+        return summary
+
+
+class CommandStats:
+    """Command Stats
+
+    Keeps call counters and a latency histogram for each command, by the command's NAME, so aliases are counted
+    together with the command they stand for.
+
+    :ivar since: The time the stats were started or last reset, in seconds since the epoch.
+    """
+    def __init__(self):
+        """Command Stats Initializer
+        """
+        self.since = time.time()
+        self._commands = {}
+
+    def record(self, name, elapsed, lines, nbytes, error=False, failed=False):
+        """Record a call of a command.
+
+        :param name: The NAME of the command.
+        :param elapsed: How long the call took, in seconds.
+        :param lines: The number of lines the call sent through console.msg().
+        :param nbytes: The number of bytes in those lines.
+        :param error: Whether the command raised an exception.
+        :param failed: Whether the command returned False.
+
+        :return: None
+        """
+        if name not in self._commands:
+            self._commands[name] = {"calls": 0, "errors": 0, "failures": 0, "lines": 0, "bytes": 0, "max_bytes": 0,
+                                    "latency": Histogram()}
+        entry = self._commands[name]
+        entry["calls"] += 1
+        entry["errors"] += error
+        entry["failures"] += failed
+        entry["lines"] += lines
+        entry["bytes"] += nbytes
+        if nbytes > entry["max_bytes"]:
+            entry["max_bytes"] = nbytes
+        entry["latency"].add(elapsed)
+
+    def reset(self):
+        """Forget everything recorded so far.
+
+        :return: None
+        """
+        self.since = time.time()
+        self._commands = {}
+
+    def report(self):
+        """Report the stats of every command that was called.
+
+        Latencies are reported in milliseconds.
+
+        :return: Dictionary of command names to dictionaries of their stats.
+        """
+        report = {}
+        for name, entry in self._commands.items():
+            report[name] = {key: value for key, value in entry.items() if key != "latency"}
+            report[name]["latency_ms"] = _milliseconds(entry["latency"])
+        return report
+
+
+class DatabaseStats:
+    """Database Stats
+
+    Counts and times the operations of a DatabaseManager by table, and counts them again by the command that made
+    them, along with the storage flushes. The shell sets the command while it runs one. Operations made outside of any
+    command, such as at startup or by periodic tasks, are counted under SERVER.
+
+    :ivar since: The time the stats were started or last reset, in seconds since the epoch.
+    :ivar command: The NAME of the command currently running, or None.
+    :ivar calls: The number of operations counted so far, for telling how many operations something made.
+    """
+    # The name that operations made outside of any command are counted under.
+    SERVER = "(server)"
+
+    def __init__(self):
+        """Database Stats Initializer
+        """
+        self.since = time.time()
+        self.command = None
+        self.calls = 0
+        self._operations = {}
+        self._commands = {}
+        self._flushes = {"count": 0, "documents": 0, "bytes": 0, "max_bytes": 0, "latency": Histogram()}
+
+    def record(self, table, operation, elapsed):
+        """Record an operation.
+
+        :param table: The name of the table operated on.
+        :param operation: The kind of operation, such as "get" or "upsert".
+        :param elapsed: How long the operation took, in seconds.
+
+        :return: None
+        """
+        self.calls += 1
+        self._operations.setdefault(table, {}).setdefault(operation, Histogram()).add(elapsed)
+        operations = self._command()["operations"].setdefault(table, {})
+        operations[operation] = operations.get(operation, 0) + 1
+
+    def record_flush(self, documents, nbytes, elapsed):
+        """Record a flush of changed documents to the storage.
+
+        :param documents: The number of changed documents written.
+        :param nbytes: The number of bytes written to the storage.
+        :param elapsed: How long serializing and writing took, in seconds.
+
+        :return: None
+        """
+        self._flushes["count"] += 1
+        self._flushes["documents"] += documents
+        self._flushes["bytes"] += nbytes
+        if nbytes > self._flushes["max_bytes"]:
+            self._flushes["max_bytes"] = nbytes
+        self._flushes["latency"].add(elapsed)
+        entry = self._command()
+        entry["flushes"] += 1
+        entry["bytes_written"] += nbytes
+
+    def reset(self):
+        """Forget everything recorded so far.
+
+        :return: None
+        """
+        self.since = time.time()
+        self._operations = {}
+        self._commands = {}
+        self._flushes = {"count": 0, "documents": 0, "bytes": 0, "max_bytes": 0, "latency": Histogram()}
+
+    def report(self):
+        """Report the stats of every table and command.
+
+        Latencies are reported in milliseconds.
+
+        :return: Dictionary with the "operations" of each table, each with its count and latency, the "commands" with
+            the number of each operation they made and the flushes and bytes written while they ran, and the "flushes".
+        """
+        report = {"operations": {}, "commands": {}}
+        for table, operations in self._operations.items():
+            report["operations"][table] = {operation: {"count": histogram.count, "latency_ms": _milliseconds(histogram)}
+                                           for operation, histogram in operations.items()}
+        for name, entry in self._commands.items():
+            report["commands"][name] = {"operations": {table: dict(operations)
+                                                       for table, operations in entry["operations"].items()},
+                                        "flushes": entry["flushes"], "bytes_written": entry["bytes_written"]}
+        report["flushes"] = {key: value for key, value in self._flushes.items() if key != "latency"}
+        report["flushes"]["latency_ms"] = _milliseconds(self._flushes["latency"])
+        return report
+
+    def _command(self):
+        """Get the entry of the command currently running, making it if needed.
+
+        :return: Dictionary of the command's stats.
+        """
+        name = self.command or self.SERVER
+        if name not in self._commands:
+            self._commands[name] = {"operations": {}, "flushes": 0, "bytes_written": 0}
+        return self._commands[name]
+
+
+def _milliseconds(histogram):
+    """Summarize a histogram of seconds in milliseconds.
+
+    :param histogram: The Histogram to summarize.
+
+    :return: Dictionary of the summary, as from Histogram.summary().
+    """
+    return {key: round(value * 1000, 3) for key, value in histogram.summary().items()}
+
+def write_report(filename, report):
+    """Write a stats report to a JSON file.
+
+    The report is written to a temporary file first, so that anything reading the file never sees it half written.
+
+    :param filename: The filename to write to.
+    :param report: The report to write, which must be serializable to JSON.
+
+    :return: True if succeeded, False if failed.
+    """
+    try:
+        with open(filename + ".tmp", "w") as reportfile:
+            json.dump(report, reportfile, indent=1, sort_keys=True)
+        os.replace(filename + ".tmp", filename)
+        return True
+    except OSError:
+        return False
@@ -0,0 +1,913 @@
+#######################
+# Dennis MUD          #
+# storage.py          #
+# Copyright 2018-2021 #
+# Michael D. Reiley   #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+# This module contains the TinyDB storage layers used by the DatabaseManager.
+
+import copy
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import time
+
+from tinydb.middlewares import Middleware
+from tinydb.storages import Storage
+
+# Fields copied out of each document into indexed columns by the SQLite storage, per table, with their column types.
+# Text columns are indexed case-insensitively.
+SQLITE_COLUMNS = {
+    "rooms": [("id", "INTEGER"), ("name", "TEXT")],
+    "items": [("id", "INTEGER"), ("name", "TEXT")],
+    "users": [("name", "TEXT"), ("nick", "TEXT"), ("room", "INTEGER")]
+}
+
+# The usual value of each field of each kind of document. With sparse storage, fields holding their usual value are
+# left out when writing, and every document read is filled back in from here, so the stored meaning of a missing field
+# is fixed by this table. Only ever add to it; changing a value would change every document stored without it.
+SPARSE_DEFAULTS = {
+    "rooms": {
+        "desc": "",
+        "users": [],
+        "exits": [],
+        "entrances": [],
+        "items": [],
+        "sealed": {"inbound": False, "outbound": False}
+    },
+    "items": {
+        "desc": "",
+        "action": "",
+        "message": "",
+        "mlang": None,
+        "lang": None,
+        "glued": False,
+        "hidden": False,
+        "truehide": False,
+        "chance": 1,
+        "duplified": False,
+        "container": {"enabled": False, "inventory": []},
+        "radio": {"enabled": False, "frequency": 0},
+        "cursed": {"enabled": False, "cursetype": ""},
+        "telekey": None
+    },
+    "users": {
+        "desc": "",
+        "spirit": 0,
+        "ghost": False,
+        "equipment": [],
+        "inventory": [],
+        "pronouns": "neutral",
+        "pronouno": "neutral",
+        "lang": "common",
+        "wizard": False,
+        "autolook": {"enabled": True},
+        "builder": {"enabled": False},
+        "cecho": {"enabled": False},
+        "keepalive": {"enabled": False},
+        "colors": {"enabled": False},
+        "chat": {"enabled": True, "ignored": []}
+    }
+}
+
+# The usual values of the fields of documents kept in lists inside other documents, per table and field.
+SPARSE_ELEMENTS = {
+    "rooms": {
+        "exits": {
+            "desc": "",
+            "key": None,
+            "key_hidden": False,
+            "locked": False,
+            "hidden": False,
+            "chance": 1,
+            "action": {"go": "", "locked": "", "entrance": ""}
+        }
+    }
+}
+
+# Stands in for a field with no default.
+_MISSING = object()
+
+# Fields whose strings repeat across many documents, and are interned when read so each is only kept once.
+INTERNED_FIELDS = ("owners", "users", "lang", "mlang", "pronouns", "pronouno")
+
+
+def sparsify(table, document):
+    """Leave out the fields of a document that hold their usual values.
+
+    The document is not changed. The returned document shares its remaining values with it.
+
+    :param table: The name of the table the document belongs to.
+    :param document: The document to make sparse.
+
+    :return: The sparse document.
+    """
+    if table not in SPARSE_DEFAULTS:
+        return document
+    sparse = _strip(document, SPARSE_DEFAULTS[table])
+    for field, defaults in SPARSE_ELEMENTS.get(table, {}).items():
+        if field in sparse:
+            sparse[field] = [_strip(element, defaults) if isinstance(element, dict) else element
+                             for element in sparse[field]]
+    return sparse
+
+
+def rehydrate(table, document, shared=True):
+    """Fill in the fields missing from a sparse document with their usual values, in place.
+
+    Documents that were stored in full are left as they are, apart from interning their repeated strings.
+
+    :param table: The name of the table the document belongs to.
+    :param document: The document to fill in.
+    :param shared: If True, missing fields refer to the shared defaults instead of copies of them. The document must
+        then never be changed in place, which holds for the documents cached by the WriteBehindMiddleware.
+
+    :return: The document.
+    """
+    if table not in SPARSE_DEFAULTS:
+        return document
+    _fill(document, SPARSE_DEFAULTS[table], shared)
+    for field, defaults in SPARSE_ELEMENTS.get(table, {}).items():
+        for element in document[field]:
+            if isinstance(element, dict):
+                _fill(element, defaults, shared)
+                _intern(element)
+    _intern(document)
+    return document
+
+
+def rehydrate_tables(tables, shared=True):
+    """Fill in every document of a world read from storage, in place.
+
+    :param tables: Dictionary of tables, or None.
+    :param shared: Whether missing fields refer to the shared defaults. See rehydrate().
+
+    :return: The tables.
+    """
+    for table, docs in (tables or {}).items():
+        if table in SPARSE_DEFAULTS:
+            for document in docs.values():
+                rehydrate(table, document, shared)
+    return tables
+
+
+def _strip(document, defaults):
+    """Copy a document, leaving out the fields that match the defaults. Nested dicts are stripped recursively.
+
+    Values must also match the type of their default, so that False is never taken for 0.
+
+    :param document: The document dict.
+    :param defaults: The defaults dict.
+
+    :return: The stripped copy.
+    """
+    stripped = {}
+    for key, value in document.items():
+        default = defaults.get(key, _MISSING)
+        if isinstance(value, dict) and isinstance(default, dict):
+            value = _strip(value, default)
+            if not value:
+                continue
+        elif type(value) is type(default) and value == default:
+            continue
+        stripped[key] = value
+    return stripped
+
+
+def _fill(document, defaults, shared):
+    """Add the missing fields of a document from the defaults, in place. Nested dicts are filled recursively.
+
+    :param document: The document dict.
+    :param defaults: The defaults dict.
+    :param shared: Whether to refer to the defaults instead of copying them.
+
+    :return: None
+    """
+    for key, default in defaults.items():
+        value = document.get(key)
+        if key not in document:
+            document[key] = default if shared else copy.deepcopy(default)
+        elif isinstance(value, dict) and isinstance(default, dict):
+            _fill(value, default, shared)
+
+
+def _intern(document):
+    """Intern the strings of the fields in INTERNED_FIELDS, in place.
+
+    :param document: The document dict.
+
+    :return: None
+    """
+    for field in INTERNED_FIELDS:
+        value = document.get(field)
+        if type(value) is str:
+            document[field] = sys.intern(value)
+        elif type(value) is list and value and all(type(x) is str for x in value):
+            document[field] = [sys.intern(x) for x in value]
+
+
+class WriteBehindMiddleware(Middleware):
+    """Write-Behind Middleware
+
+    This TinyDB middleware keeps the whole world in memory, so that reading a table never has to parse the storage.
+    The DatabaseManager stages changed documents here by their TinyDB document ID. Several changes to the same document
+    are coalesced, and all staged changes are written to the underlying storage at once when the middleware is flushed.
+    If the underlying storage can write individual documents, only the changed documents are written.
+
+    With sparse storage enabled, documents are written with sparsify(), and every document read is filled in with
+    rehydrate(), so documents written sparse and in full can be mixed freely. In memory, fields holding their usual
+    values refer to shared defaults instead of each document keeping its own copy. With sparse storage disabled,
+    documents are read and written as they are, without any of this work.
+
+    When write-through is enabled, every change is flushed immediately, which is how TinyDB normally behaves.
+    While the middleware is held, nothing is flushed automatically, so that the changes of a transaction are written
+    together when it is released.
+
+    :ivar write_through: Whether to flush after every change.
+    :ivar max_staleness: If set, the maximum number of seconds a change may wait before a flush is forced.
+    :ivar sparse: Whether to leave out fields holding their usual values when writing, and fill them in when reading.
+    :ivar paged: Names of tables that are only partly kept in memory, loaded with fetch() and dropped with evict().
+    :ivar flushed: If set, called as flushed(documents, nbytes, elapsed) after every flush, with the number of changed
+        documents written, the number of bytes the storage wrote, and how many seconds serializing and writing took.
+    """
+    def __init__(self, storage_cls, write_through=True, max_staleness=0, sparse=False, paged=()):
+        """Write-Behind Middleware Initializer
+
+        :param storage_cls: The TinyDB storage class to write to.
+        :param write_through: Whether to flush after every change.
+        :param max_staleness: If set, the maximum number of seconds a change may wait before a flush is forced.
+        :param sparse: Whether to leave out fields holding their usual values when writing, and fill them in when
+            reading.
+        :param paged: Names of tables to load in parts instead of all at once. The storage must support read_range().
+        """
+        super().__init__(storage_cls)
+        self.write_through = write_through
+        self.max_staleness = max_staleness
+        self.sparse = sparse
+        self.paged = tuple(paged)
+        self.flushed = None
+
+        self._cache = None
+        self._pending = {}
+        self._dirty = set()
+        self._dirty_since = None
+        self._held = 0
+
+    @property
+    def dirty(self):
+        """The number of changed documents waiting to be flushed.
+        """
+        return len(self._dirty)
+
+    def read(self):
+        """Read the world from the cache, loading it from the storage the first time.
+
+        Any staged documents are applied to the cache first, so TinyDB tables always see the latest state.
+
+        :return: Dictionary of tables.
+        """
+        if self._cache is None:
+            data = self.storage.read(skip=self.paged) if self.paged else self.storage.read()
+            self._cache = rehydrate_tables(data or {}) if self.sparse else data or {}
+        self._apply()
+        return self._cache
+
+    def fetch(self, table, low, high):
+        """Load the documents of a paged table with IDs in a range into the cache.
+
+        :param table: The name of the table.
+        :param low: The lowest ID to load.
+        :param high: One more than the highest ID to load.
+
+        :return: Dictionary of document IDs to the cached documents that were loaded.
+        """
+        cached = self.read().setdefault(table, {})
+        documents = {}
+        for doc_id, document in self.storage.read_range(table, low, high).items():
+            # Never replace a document that was changed since it was written.
+            if (table, doc_id) not in self._dirty:
+                documents[doc_id] = cached.setdefault(doc_id, rehydrate(table, document) if self.sparse else document)
+        return documents
+
+    def evict(self, table, doc_ids):
+        """Drop documents of a paged table from the cache. They must not have any unwritten changes.
+
+        :param table: The name of the table.
+        :param doc_ids: The TinyDB document IDs of the documents to drop.
+
+        :return: None
+        """
+        cached = self.read().get(table, {})
+        for doc_id in doc_ids:
+            cached.pop(str(doc_id), None)
+
+    def is_dirty(self, table, doc_id):
+        """Check whether a document has changes that haven't been written yet.
+
+        :param table: The name of the table.
+        :param doc_id: The TinyDB document ID of the document.
+
+        :return: True if the document has unwritten changes, False otherwise.
+        """
+        return (table, str(doc_id)) in self._dirty or (None, None) in self._dirty
+
+    def use_sparse(self):
+        """Turn on sparse storage, for a world that was already written sparse.
+
+        Whatever was read so far is filled in right away.
+
+        :return: None
+        """
+        self.sparse = True
+        if self._cache is not None:
+            rehydrate_tables(self._cache)
+
+    def stored(self):
+        """Get the world as it is written to the storage.
+
+        :return: Dictionary of tables.
+        """
+        data = self.read()
+        if not self.sparse:
+            return data
+        return {table: {doc_id: sparsify(table, document) for doc_id, document in docs.items()}
+                for table, docs in data.items()}
+
+    def preload(self, data):
+        """Use an already loaded copy of the world, instead of reading it from the storage.
+
+        This must be called before anything reads from the database.
+
+        :param data: Dictionary of tables.
+
+        :return: None
+        """
+        self._cache = data
+
+    def write(self, data):
+        """Replace the cached world. This is called by TinyDB when a table is written to directly.
+
+        :param data: Dictionary of tables.
+
+        :return: None
+        """
+        self._cache = rehydrate_tables(data) if self.sparse else data
+        self._dirty.add((None, None))
+        self._changed()
+
+    def stage(self, table, doc_id, document, defer=False):
+        """Stage a changed document to be written at the next flush.
+
+        :param table: The name of the table the document belongs to.
+        :param doc_id: The TinyDB document ID of the document.
+        :param document: The new contents of the document, or None if it was deleted.
+        :param defer: If True, never flush because of this change. It will be written along with the next one.
+
+        :return: None
+        """
+        self._pending.setdefault(table, {})[str(doc_id)] = document
+        self._dirty.add((table, str(doc_id)))
+        if not defer:
+            self._changed()
+
+    def hold(self):
+        """Stop flushing automatically until release() is called. Holds can be nested.
+
+        :return: None
+        """
+        self._held += 1
+
+    def release(self):
+        """Release a hold, and flush if needed once the last hold is released.
+
+        :return: None
+        """
+        self._held -= 1
+        if not self._held and self._dirty:
+            self._changed()
+
+    def flush(self):
+        """Write all pending changes to the underlying storage in a single write.
+
+        :return: The number of changes that were written.
+        """
+        count = self.dirty
+        if not count:
+            return 0
+        self.read()
+        start = time.perf_counter()
+        written = getattr(self.storage, "bytes_written", 0)
+
+        # Write only the changed documents if we can, unless a table was written to directly.
+        if (None, None) not in self._dirty and hasattr(self.storage, "write_documents"):
+            changes = {}
+            for table, doc_id in self._dirty:
+                document = self._cache.get(table, {}).get(doc_id)
+                if document is not None and self.sparse:
+                    document = sparsify(table, document)
+                changes.setdefault(table, {})[doc_id] = document
+            self.storage.write_documents(changes)
+
+        # If only part of the world is in memory, replacing the whole storage would lose the rest.
+        # Write every document in memory instead.
+        elif self.paged:
+            self.storage.write_documents(self.stored())
+        else:
+            self.storage.write(self.stored())
+        self._dirty = set()
+        self._dirty_since = None
+        if self.flushed:
+            self.flushed(count, self._bytes_written() - written, time.perf_counter() - start)
+        return count
+
+    def close(self):
+        """Flush any unwritten changes and close the underlying storage.
+
+        :return: None
+        """
+        self.flush()
+        self.storage.close()
+
+    def flush_stale(self):
+        """Flush if the oldest unwritten change has waited longer than max_staleness.
+
+        Changes only check this when they are staged, so this is also called periodically, for when no more come.
+
+        :return: The number of changes that were written.
+        """
+        if self._held or not self.max_staleness or self._dirty_since is None:
+            return 0
+        if time.monotonic() - self._dirty_since < self.max_staleness:
+            return 0
+        return self.flush()
+
+    def _bytes_written(self):
+        """Count the bytes the underlying storage has written so far.
+
+        Storages that don't keep count, like TinyDB's JSONStorage, rewrite their whole file on every write, so the size
+        of the file is what they wrote last.
+
+        :return: The number of bytes.
+        """
+        if hasattr(self.storage, "bytes_written"):
+            return self.storage.bytes_written
+        handle = getattr(self.storage, "_handle", None)
+        return handle.tell() if handle else 0
+
+    def _changed(self):
+        """Decide whether a change needs to be flushed right away.
+
+        :return: None
+        """
+        if self._dirty_since is None:
+            self._dirty_since = time.monotonic()
+        if self._held:
+            return
+        if self.write_through:
+            self.flush()
+        else:
+            self.flush_stale()
+
+    def _apply(self):
+        """Apply the staged documents to the cache.
+
+        Documents are copied into the cache, so that documents later handed out by TinyDB can't alter them.
+        With sparse storage, only the fields that differ from their usual values are copied, and the rest refer to the
+        shared defaults.
+
+        :return: None
+        """
+        if not self._pending:
+            return
+        for table, docs in self._pending.items():
+            cached = self._cache.setdefault(table, {})
+            for doc_id, document in docs.items():
+                if document is None:
+                    cached.pop(doc_id, None)
+                elif self.sparse:
+                    cached[doc_id] = rehydrate(table, copy.deepcopy(dict(sparsify(table, document))))
+                else:
+                    cached[doc_id] = copy.deepcopy(dict(document))
+        self._pending = {}
+
+
+class SQLiteStorage(Storage):
+    """SQLite Storage
+
+    This TinyDB storage keeps each document in its own row of an SQLite database, with one SQL table per TinyDB table.
+    Rows are keyed by TinyDB document ID, and the fields listed in SQLITE_COLUMNS are copied into indexed columns.
+    Paired with the WriteBehindMiddleware, only the rows of changed documents are ever rewritten.
+
+    :ivar bytes_written: The number of bytes of serialized documents written so far.
+    """
+    def __init__(self, path):
+        """SQLite Storage Initializer
+
+        :param path: The relative or absolute filename of the SQLite database file.
+        """
+        super().__init__()
+        self.bytes_written = 0
+        self._connection = sqlite3.connect(path)
+        self._tables = set(row[0] for row in self._connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table'"))
+
+    @staticmethod
+    def copy(path, target):
+        """Copy an SQLite database file, even while another connection is writing to it.
+
+        This uses SQLite's online backup, which only locks the source a few pages at a time, and starts over if the
+        source is written to meanwhile, so the copy always holds one consistent state.
+
+        :param path: The filename of the SQLite database file to copy.
+        :param target: The filename to copy it to.
+
+        :return: None
+        """
+        source = sqlite3.connect(path)
+        destination = sqlite3.connect(target)
+        try:
+            source.backup(destination, pages=256)
+        finally:
+            destination.close()
+            source.close()
+
+    def read(self, skip=()):
+        """Read every document from every table.
+
+        :param skip: Names of tables to leave out, to be read in parts with read_range() instead.
+
+        :return: Dictionary of tables, or None if the database is empty.
+        """
+        if not self._tables:
+            return None
+        tables = {}
+        for table in self._tables - set(skip):
+            rows = self._connection.execute('SELECT doc_id, data FROM "{0}"'.format(table))
+            tables[table] = {str(doc_id): json.loads(data) for doc_id, data in rows}
+        return tables
+
+    def read_range(self, table, low, high):
+        """Read the documents of a table with an id field in a range. The table must have an id column.
+
+        :param table: The name of the table.
+        :param low: The lowest ID to read.
+        :param high: One more than the highest ID to read.
+
+        :return: Dictionary of document IDs to documents.
+        """
+        if table not in self._tables:
+            return {}
+        rows = self._connection.execute('SELECT doc_id, data FROM "{0}" WHERE id >= ? AND id < ?'.format(table),
+                                        (low, high))
+        return {str(doc_id): json.loads(data) for doc_id, data in rows}
+
+    def scan(self, table):
+        """Go through every document of a table one at a time, without reading them all into memory at once.
+
+        :param table: The name of the table.
+
+        :return: Iterator of (document ID, document).
+        """
+        if table not in self._tables:
+            return
+        for doc_id, data in self._connection.execute('SELECT doc_id, data FROM "{0}"'.format(table)):
+            yield str(doc_id), json.loads(data)
+
+    def ids(self, table):
+        """List the id field of every document of a table, without reading the documents. The table must have an id
+        column.
+
+        :param table: The name of the table.
+
+        :return: List of IDs.
+        """
+        if table not in self._tables:
+            return []
+        return [row[0] for row in self._connection.execute('SELECT id FROM "{0}"'.format(table))]
+
+    def last_doc_id(self, table):
+        """Get the highest TinyDB document ID in use in a table, without reading the documents.
+
+        :param table: The name of the table.
+
+        :return: The document ID, or 0 if the table is empty.
+        """
+        if table not in self._tables:
+            return 0
+        return self._connection.execute('SELECT MAX(doc_id) FROM "{0}"'.format(table)).fetchone()[0] or 0
+
+    def write(self, data):
+        """Replace the contents of the database with the given tables.
+
+        :param data: Dictionary of tables.
+
+        :return: None
+        """
+        with self._connection:
+            for table in self._tables - set(data):
+                self._connection.execute('DROP TABLE "{0}"'.format(table))
+                self._tables.discard(table)
+            for table, docs in data.items():
+                self._create(table)
+                self._connection.execute('DELETE FROM "{0}"'.format(table))
+                self._insert(table, docs)
+
+    def write_documents(self, changes):
+        """Write only the given documents, in a single SQL transaction.
+
+        :param changes: Dictionary of tables, each a dictionary of document IDs to documents, or None to delete them.
+
+        :return: None
+        """
+        with self._connection:
+            for table, docs in changes.items():
+                self._create(table)
+                self._connection.executemany('DELETE FROM "{0}" WHERE doc_id = ?'.format(table),
+                                             [(int(doc_id),) for doc_id, doc in docs.items() if doc is None])
+                self._insert(table, {doc_id: doc for doc_id, doc in docs.items() if doc is not None})
+
+    def close(self):
+        """Close the database connection.
+
+        :return: None
+        """
+        self._connection.close()
+
+    def _create(self, table):
+        """Create an SQL table and its column indexes if they don't exist yet.
+
+        :param table: The name of the table.
+
+        :return: None
+        """
+        if table in self._tables:
+            return
+        columns = SQLITE_COLUMNS.get(table, [])
+        self._connection.execute('CREATE TABLE IF NOT EXISTS "{0}" (doc_id INTEGER PRIMARY KEY, {1}data TEXT)'.format(
+            table, ''.join('"{0}" {1}, '.format(column, coltype) for column, coltype in columns)))
+        for column, coltype in columns:
+            self._connection.execute('CREATE INDEX IF NOT EXISTS "{0}_{1}" ON "{0}" ("{1}"{2})'.format(
+                table, column, " COLLATE NOCASE" if coltype == "TEXT" else ""))
+        self._tables.add(table)
+
+    def _insert(self, table, docs):
+        """Insert or replace rows for the given documents.
+
+        :param table: The name of the table.
+        :param docs: Dictionary of document IDs to documents.
+
+        :return: None
+        """
+        columns = [column for column, coltype in SQLITE_COLUMNS.get(table, [])]
+        rows = [[int(doc_id)] + [doc.get(column) for column in columns] + [json.dumps(doc, separators=(',', ':'))]
+                for doc_id, doc in docs.items()]
+        self._connection.executemany('INSERT OR REPLACE INTO "{0}" (doc_id, {1}data) VALUES ({2})'.format(
+            table, ''.join('"{0}", '.format(column) for column in columns), ', '.join('?' * (len(columns) + 2))), rows)
+        self.bytes_written += sum(len(row[-1]) for row in rows)
+
+
+class JournalStorage(Storage):
+    """Journal Storage
+
+    This TinyDB storage keeps the world as a JSON snapshot file in the usual TinyDB format, plus a journal file next to
+    it. Paired with the WriteBehindMiddleware, each changed document is appended to the journal as one compact line,
+    instead of rewriting the snapshot. The last line of each write is marked as its commit. Reading replays the journal
+    on top of the snapshot, one whole write at a time. A write torn by a crash in the middle of an append is dropped,
+    so at most the last unwritten changes are lost, and never only part of a transaction.
+
+    Compaction folds the journal into a new snapshot. It is split into two steps, so that the slow part can run on
+    another thread: begin_compaction() serializes the world and starts a fresh journal, and the function it returns
+    writes the new snapshot and removes the old journal.
+
+    :ivar bytes_written: The number of bytes appended to the journal so far.
+    """
+    def __init__(self, path):
+        """Journal Storage Initializer
+
+        :param path: The relative or absolute filename of the JSON snapshot file.
+        """
+        super().__init__()
+        self.bytes_written = 0
+        self._path = path
+        self._journal_path = os.path.splitext(path)[0] + ".journal"
+        self._compacting = False
+
+        # Cut off any torn lines before we start appending after them.
+        for journal in (self._journal_path + ".old", self._journal_path):
+            self._repair(journal)
+        self._journal = open(self._journal_path, "a", encoding="utf-8")
+
+    @property
+    def paths(self):
+        """The files this storage keeps the world in.
+        """
+        return [self._path, self._journal_path + ".old", self._journal_path]
+
+    @property
+    def journal_size(self):
+        """The size of the current journal in bytes.
+        """
+        return os.fstat(self._journal.fileno()).st_size
+
+    def read(self):
+        """Read the snapshot and replay the journal on top of it.
+
+        :return: Dictionary of tables, or None if the database is empty.
+        """
+        tables = None
+        if os.path.exists(self._path) and os.path.getsize(self._path):
+            with open(self._path, encoding="utf-8") as f:
+                tables = json.load(f)
+
+        # A journal left over from an interrupted compaction comes before the current one.
+        for journal in (self._journal_path + ".old", self._journal_path):
+            if os.path.exists(journal):
+                tables = self._replay(journal, tables)
+        return tables
+
+    def write(self, data):
+        """Record a replacement of the whole world in the journal.
+
+        This only happens when a table is written to directly, which is rare, so it is just journaled like any
+        other change and folded into the snapshot at the next compaction.
+
+        :param data: Dictionary of tables.
+
+        :return: None
+        """
+        self._append([json.dumps({"w": data}, separators=(',', ':'))])
+
+    def write_documents(self, changes):
+        """Append one journal line for each of the given documents.
+
+        :param changes: Dictionary of tables, each a dictionary of document IDs to documents, or None to delete them.
+
+        :return: None
+        """
+        entries = []
+        for table, docs in changes.items():
+            for doc_id, doc in docs.items():
+                entries.append({"t": table, "i": doc_id, "d": doc})
+        if entries:
+            entries[-1]["c"] = 1
+        self._append([json.dumps(entry, separators=(',', ':')) for entry in entries])
+
+    def begin_compaction(self, data):
+        """Start folding the journal into a new snapshot.
+
+        The world is serialized right away, so it must be up to date. The current journal is set aside and a fresh
+        one is started, so that changes can keep being appended while the snapshot is written.
+
+        :param data: Dictionary of tables holding the current state of the world.
+
+        :return: A function that finishes the compaction, or None if a compaction is already running.
+        """
+        if self._compacting:
+            return None
+        self._compacting = True
+        serialized = json.dumps(data)
+
+        # Set the current journal aside. If an earlier compaction never finished, add onto its journal instead.
+        old = self._journal_path + ".old"
+        self._journal.close()
+        if os.path.exists(old):
+            with open(old, "a", encoding="utf-8") as oldjournal, \
+                    open(self._journal_path, encoding="utf-8") as journal:
+                shutil.copyfileobj(journal, oldjournal)
+            os.remove(self._journal_path)
+        else:
+            os.replace(self._journal_path, old)
+        self._journal = open(self._journal_path, "a", encoding="utf-8")
+
+        return lambda: self._finish_compaction(serialized)
+
+    def close(self):
+        """Close the journal.
+
+        :return: None
+        """
+        self._journal.close()
+
+    def _finish_compaction(self, serialized):
+        """Write a new snapshot and remove the journal it replaces. This is safe to run on another thread.
+
+        The snapshot is written to a temporary file first and then moved into place, so it is never half-written.
+
+        :param serialized: The serialized world from begin_compaction().
+
+        :return: None
+        """
+        try:
+            with open(self._path + ".tmp", "w", encoding="utf-8") as f:
+                f.write(serialized)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(self._path + ".tmp", self._path)
+            os.remove(self._journal_path + ".old")
+        finally:
+            self._compacting = False
+
+    def _append(self, lines):
+        """Append lines to the journal and make sure they reach the disk.
+
+        :param lines: List of serialized journal entries.
+
+        :return: None
+        """
+        if not lines:
+            return
+        data = '\n'.join(lines) + '\n'
+        self._journal.write(data)
+        self.bytes_written += len(data)
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    @staticmethod
+    def _replay(filename, tables):
+        """Apply the entries of a journal file to a dictionary of tables.
+
+        :param filename: The journal file to replay.
+        :param tables: Dictionary of tables to apply the entries to, or None.
+
+        :return: Dictionary of tables.
+        """
+        uncommitted = []
+        with open(filename, encoding="utf-8") as f:
+            for line in f:
+                # A line without a newline was torn by a crash while it was being appended.
+                if not line.endswith('\n'):
+                    break
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if "w" in entry:
+                    tables = entry["w"]
+                    continue
+
+                # Entries are only applied once the line that commits their write is reached.
+                uncommitted.append(entry)
+                if "c" not in entry:
+                    continue
+                if tables is None:
+                    tables = {}
+                for entry in uncommitted:
+                    table = tables.setdefault(entry["t"], {})
+                    if entry["d"] is None:
+                        table.pop(entry["i"], None)
+                    else:
+                        table[entry["i"]] = entry["d"]
+                uncommitted = []
+        return tables
+
+    @staticmethod
+    def _repair(filename):
+        """Cut a torn write off the end of a journal file, so that later writes don't commit what is left of it.
+
+        :param filename: The journal file to repair.
+
+        :return: None
+        """
+        if not os.path.exists(filename):
+            return
+        with open(filename, "rb+") as f:
+            data = f.read()
+
+            # Walk back from the end to the last line that committed a write. A corrupted line can still end in a
+            # newline, so lines that don't parse are treated as uncommitted too.
+            end = len(data)
+            while end:
+                start = data.rfind(b'\n', 0, end - 1) + 1
+                line = data[start:end]
+                if line.endswith(b'\n') and line.strip():
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        entry = None
+                    if isinstance(entry, dict) and ("c" in entry or "w" in entry):
+                        break
+                end = start
+            if end < len(data):
+                f.truncate(end)
@@ -0,0 +1,281 @@
+#######################
+# Dennis MUD          #
+# transfer.py         #
+# Copyright 2021      #
+# Michael D. Reiley   #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+import json
+import time
+
+from lib.database import DB_VERSION
+from lib.storage import rehydrate
+
+# The version of the export file format, written in its header line.
+EXPORT_FORMAT = 1
+
+# The tables that are exported, in the order they are written.
+TABLES = ("rooms", "items", "users")
+
+
+def export_world(storage, outfile, tables=TABLES, owner=None, zone=None, batch=1000):
+    """Write the documents of a world database to a file as JSON Lines.
+
+    The first line is a header recording the formats, and each following line holds one document as {"t": table,
+    "d": document}. Documents are read and written one at a time, so with the SQLite backend the world never has to
+    be in memory all at once. The other backends can only read the whole database file in one go.
+
+    :param storage: The opened storage of the world database.
+    :param outfile: The text file to write to.
+    :param tables: The names of the tables to export.
+    :param owner: If set, only export the rooms and items owned by this user, and the user themself.
+    :param zone: If set, a (lowest, highest) pair of IDs. Only export the rooms and items with IDs in this range,
+        and the users standing in those rooms.
+    :param batch: The number of lines to collect before writing them out.
+
+    :return: Dictionary of the number of documents exported from each table.
+    """
+    whole = {}
+    info = next(_scan(storage, "_info", whole), {})
+    outfile.write(json.dumps({"format": EXPORT_FORMAT, "version": info.get("version", DB_VERSION),
+                              "exported": time.time(), "owner": owner, "zone": zone}) + "\n")
+
+    # Go through the documents of each table, writing out the selected ones a batch at a time.
+    counts = {}
+    lines = []
+    for tablename in tables:
+        counts[tablename] = 0
+        for document in _scan(storage, tablename, whole):
+            document = rehydrate(tablename, document, shared=False)
+            if not _select(tablename, document, owner, zone):
+                continue
+            lines.append(json.dumps({"t": tablename, "d": document}, separators=(',', ':')) + "\n")
+            counts[tablename] += 1
+            if len(lines) >= batch:
+                outfile.writelines(lines)
+                lines = []
+    outfile.writelines(lines)
+    return counts
+
+
+def import_world(database, infile, remap=False, batch=1000):
+    """Merge the documents of an export file into a world database.
+
+    Documents are read one line at a time and upserted in transactions of a batch of documents each, so that each
+    batch is written in a single storage write. Rooms and items replace any existing ones with the same ID, unless
+    remapping. Users who already exist are left alone. Room user lists are emptied, since nobody is online.
+
+    A first pass through the file finds the users who will be skipped. The items that only they hold, directly or
+    inside containers only they hold, are skipped too, since nothing imported would refer to them.
+
+    With remapping, the imported rooms and items are given new IDs after those already in use, and every reference
+    between them is rewritten. The IDs are also collected in the first pass. References to rooms and items that
+    weren't exported are left as they are, and should be checked afterward.
+
+    :param database: The started DatabaseManager of the world to import into.
+    :param infile: The seekable text file to read from.
+    :param remap: Whether to give the imported rooms and items new IDs.
+    :param batch: The number of documents to write in each transaction.
+
+    :return: Dictionary of the number of documents imported from each table, of users skipped as "skipped", and of
+        items skipped with them as "orphans", or None if the file is not a compatible export.
+    """
+    header = json.loads(infile.readline() or "{}")
+    if header.get("format") != EXPORT_FORMAT:
+        print("Not a world export file, or an unsupported export format.")
+        return None
+    if header["version"] != DB_VERSION:
+        print("Export is of a v{0} database, but v{1} is needed. Migrate the exported world first.".format(
+            header["version"], DB_VERSION))
+        return None
+
+    # Find the items to skip, and allocate new IDs for the other imported rooms and items, in the order they were
+    # exported.
+    orphans, exported = _orphans(database, infile)
+    ids = {"rooms": {}, "items": {}}
+    if remap:
+        for tablename, key in exported:
+            if tablename != "items" or key not in orphans:
+                ids[tablename][key] = database.next_id(tablename)
+    infile.seek(0)
+    infile.readline()
+
+    # Upsert the documents a batch at a time.
+    counts = {tablename: 0 for tablename in TABLES}
+    counts["skipped"] = 0
+    counts["orphans"] = 0
+    pending = []
+    for line in infile:
+        entry = json.loads(line)
+        if entry["t"] == "items" and entry["d"]["id"] in orphans:
+            counts["orphans"] += 1
+            continue
+        tablename, document = entry["t"], _remap(entry["t"], entry["d"], ids)
+        if tablename == "users" and database.user_by_name(document["name"]):
+            counts["skipped"] += 1
+            continue
+        if tablename == "rooms":
+            document["users"] = []
+        pending.append((tablename, document))
+        counts[tablename] += 1
+        if len(pending) >= batch:
+            _write(database, pending)
+            pending = []
+    _write(database, pending)
+    return counts
+
+
+def _orphans(database, infile):
+    """Read through an export file to find the items that only users who already exist hold.
+
+    Such users are skipped when importing, so their items would be left without a holder. An item inside a container
+    is held by the container, so the contents of a skipped container are skipped too, unless something else holds
+    them. Items that nothing in the export holds are left alone.
+
+    :param database: The DatabaseManager of the world to import into.
+    :param infile: The text file to read from, just after its header line.
+
+    :return: A pair of the set of item IDs to skip, and the list of (table name, ID) of the exported rooms and items.
+    """
+    holders = {}
+    skipped = set()
+    exported = []
+    for line in infile:
+        entry = json.loads(line)
+        tablename, document = entry["t"], entry["d"]
+        if tablename == "users":
+            holder = ("users", document["name"].lower())
+            if database.user_by_name(document["name"]):
+                skipped.add(holder)
+            held = document.get("inventory", []) + document.get("equipment", [])
+        else:
+            holder = (tablename, document["id"])
+            exported.append(holder)
+            held = document["items"] if tablename == "rooms" else document["container"]["inventory"]
+        for itemid in held:
+            holders.setdefault(itemid, set()).add(holder)
+
+    # Skipping an item can leave its contents held only by skipped holders, so repeat until nothing more is skipped.
+    orphans = set()
+    while True:
+        found = {itemid for itemid, held in holders.items()
+                 if itemid not in orphans and held <= skipped}
+        if not found:
+            return orphans, exported
+        orphans |= found
+        skipped |= {("items", itemid) for itemid in found}
+
+
+def _scan(storage, tablename, whole):
+    """Go through the documents of a table, one at a time if the storage can do so.
+
+    :param storage: The opened storage of the world database.
+    :param tablename: The name of the table.
+    :param whole: A dictionary to keep the whole database in, if it has to be read in one go.
+
+    :return: Iterator of documents.
+    """
+    if hasattr(storage, "scan"):
+        for doc_id, document in storage.scan(tablename):
+            yield document
+        return
+    if not whole:
+        whole.update(storage.read() or {})
+    yield from whole.get(tablename, {}).values()
+
+
+def _select(tablename, document, owner, zone):
+    """Decide whether a document is part of the export.
+
+    :param tablename: The name of the table the document belongs to.
+    :param document: The document.
+    :param owner: The owner to select by, or None.
+    :param zone: The (lowest, highest) pair of IDs to select by, or None.
+
+    :return: True if the document is selected, False otherwise.
+    """
+    if owner is not None:
+        if tablename == "users":
+            if document["name"].lower() != owner.lower():
+                return False
+        elif owner.lower() not in [name.lower() for name in document["owners"]]:
+            return False
+    if zone is not None:
+        key = document["room"] if tablename == "users" else document["id"]
+        if not zone[0] <= key <= zone[1]:
+            return False
+    return True
+
+
+def _remap(tablename, document, ids):
+    """Rewrite the room and item IDs in a document, in place.
+
+    :param tablename: The name of the table the document belongs to.
+    :param document: The document.
+    :param ids: Dictionary of "rooms" and "items", each mapping old IDs to new ones. IDs not in it are kept.
+
+    :return: The document.
+    """
+    rooms, items = ids["rooms"], ids["items"]
+    if not rooms and not items:
+        return document
+    if tablename == "rooms":
+        document["id"] = rooms.get(document["id"], document["id"])
+        for ex in document["exits"]:
+            ex["dest"] = rooms.get(ex["dest"], ex["dest"])
+        document["entrances"] = [rooms.get(roomid, roomid) for roomid in document["entrances"]]
+        document["items"] = [items.get(itemid, itemid) for itemid in document["items"]]
+    elif tablename == "items":
+        document["id"] = items.get(document["id"], document["id"])
+        document["container"]["inventory"] = [items.get(itemid, itemid) for itemid in
+                                              document["container"]["inventory"]]
+        if document["telekey"] is not None:
+            document["telekey"] = rooms.get(document["telekey"], document["telekey"])
+    elif tablename == "users":
+        document["room"] = rooms.get(document["room"], document["room"])
+        for field in ("inventory", "equipment"):
+            if field in document:
+                document[field] = [items.get(itemid, itemid) for itemid in document[field]]
+    return document
+
+
+def _write(database, pending):
+    """Upsert a batch of imported documents in a single transaction.
+
+    :param database: The DatabaseManager of the world to import into.
+    :param pending: List of (table name, document).
+
+    :return: None
+    """
+    if not pending:
+        return
+    with database.transaction():
+        for tablename, document in pending:
+            if tablename == "rooms":
+                database.reserve_id("rooms", document["id"])
+                database.upsert_room(document)
+            elif tablename == "items":
+                database.reserve_id("items", document["id"])
+                database.upsert_item(document)
+            elif tablename == "users":
+                database.upsert_user(document)
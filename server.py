@@ -37,20 +37,19 @@ if sys.version_info[0] != 3:
 
 from lib import config as _config
 from lib import console
+from lib import backup
 from lib import database
 from lib import logger
+from lib import monitor
 from lib import shell
-from lib import telnet
-from lib import websocket
+from lib import stats
 from lib.markov import *
 from lib.config import VERSION
 from lib.color import *
-from lib.ircgateway import *
 
 import builtins
 import html
 import os
-import shutil
 import signal
 import traceback
 import time
@@ -58,8 +57,7 @@ import time
 
 from datetime import datetime
 #from twisted.words.protocols import irc
-from twisted.internet import reactor, ssl, task, protocol
-from OpenSSL import crypto as openssl
+from twisted.internet import reactor, task, protocol
 
 
 
@@ -74,6 +72,7 @@ class Router:
     :ivar telnet_factory: The active Autobahn telnet server factory.
     :ivar websocket_factory: The active Autobahn websocket server factory.
     :ivar shutting_down: Whether the server is currently counting down to shutdown.
+    :ivar backups: The BackupManager instance, which takes database backups.
     """
     def __init__(self, config, database):
         """Router Initializer
@@ -87,6 +86,7 @@ class Router:
         self.telnet_factory = None
         self.websocket_factory = None
         self.shutting_down = False
+        self.backups = None
 
         self._config = config
         self._database = database
@@ -221,8 +221,10 @@ class Router:
         #Default color for any message.
         acolo="default"
         #print(excludelist)
-        for u in self.users:
-            if not self.users[u]["console"].user:
+        # Only visit the users who are online in this room, according to the database's presence registry.
+        for username in self._database.users_in_room(room):
+            u = self._database.console_by_username(username).rname
+            if u not in self.users or not self.users[u]["console"].user:
                 continue
             if self.users[u]["console"].user["name"] == exclude:
                 continue
@@ -236,32 +238,36 @@ class Router:
             # Exclude sleepers from room broadcasts.
             if self.users[u]["console"]["posture"] == "sleeping":
                 continue
-            if self.users[u]["console"].user["room"] == room:
-                mylang=self.users[u]["console"].database.user_by_name(self.users[u]["console"].user["name"])["lang"]
-                if mtype=="say" and mylang != tlang: amsg=enmsg
-                else: amsg=msg
-                if self.users[u]["service"] == "telnet":
-                    if mtype=="say": acolo = CBCYAN
-                    self.telnet_factory.communicate(self.users[u]["console"].rname, mcolor(acolo,amsg,ucolo=self.users[u]["console"].user["colors"]).encode())
-                if self.users[u]["service"] == "websocket":
-                    if mtype=="say": acolo = CBCYAN
-                    try:
-                        self.websocket_factory.communicate(self.users[u]["console"].rname, html.escape(mcolor(acolo,amsg,ucolo=self.users[u]["console"].user["colors"])).encode("utf-8"))
-                    except:
-                        print("Tried to send message to a closed websocket client.")
+            mylang=self.users[u]["console"].database.user_by_name(self.users[u]["console"].user["name"])["lang"]
+            if mtype=="say" and mylang != tlang: amsg=enmsg
+            else: amsg=msg
+            if self.users[u]["service"] == "telnet":
+                if mtype=="say": acolo = CBCYAN
+                self.telnet_factory.communicate(self.users[u]["console"].rname, mcolor(acolo,amsg,ucolo=self.users[u]["console"].user["colors"]).encode())
+            if self.users[u]["service"] == "websocket":
+                if mtype=="say": acolo = CBCYAN
+                try:
+                    self.websocket_factory.communicate(self.users[u]["console"].rname, html.escape(mcolor(acolo,amsg,ucolo=self.users[u]["console"].user["colors"])).encode("utf-8"))
+                except:
+                    print("Tried to send message to a closed websocket client.")
 
 def init_services(config, router, log):
     """Initialize the Telnet and/or WebSocket Services
+
+    Each service's modules and libraries are only imported if the service is enabled, so a server doesn't need
+    Autobahn, OpenSSL, or the IRC stack installed unless it uses them, and doesn't spend time loading them at startup.
     """
     # We will exit if no services are enabled.
     any_enabled = False
 
     # IRC gateway
     if config["ircgateway"]["enabled"]:
+        from lib.ircgateway import LogBotFactory
         router.f = LogBotFactory(config["ircgateway"]["channel"])
         reactor.connectTCP(config["ircgateway"]["server"], config["ircgateway"]["port"], router.f)
     # If telnet is enabled, initialize its service.
     if config["telnet"]["enabled"]:
+        from lib import telnet
         telnet_factory = telnet.ServerFactory(router)
         telnet_factory.protocol = telnet.ServerProtocol
         telnet_factory.protocol._config=config
@@ -270,7 +276,11 @@ def init_services(config, router, log):
 
     # If websocket is enabled, initialize its service.
     if config["websocket"]["enabled"]:
+        from lib import websocket
         if config["websocket"]["secure"]:
+            from OpenSSL import crypto as openssl
+            from twisted.internet import ssl
+
             # Use secure websockets. Requires the key and certificate.
             # First we test the expiration date of the cert.
             # Thanks to https://kyle.io/2016/01/checking-a-ssl-certificates-expiry-date-with-python
@@ -330,24 +340,18 @@ def main():
     logger.init(config)
     log = logger.Logger("server")
 
-    # Rotate database backups, if enabled.
-    # Unfortunately this has to be done before loading the database, because Windows.
-    if os.path.exists(config["database"]["filename"]):
-        try:
-            if config["database"]["backups"]:
-                backupnumbers = sorted(range(1, config["database"]["backups"]), reverse=True)
-                for bn in backupnumbers:
-                    if os.path.exists("{0}.bk{1}".format(config["database"]["filename"], bn)):
-                        shutil.copyfile("{0}.bk{1}".format(config["database"]["filename"], bn),
-                                        "{0}.bk{1}".format(config["database"]["filename"], bn + 1))
-                shutil.copyfile(config["database"]["filename"], "{0}.bk1".format(config["database"]["filename"]))
-        except:
-            log.error("Could not finish rotating backups for database: {file}", file=config["database"]["filename"])
-            log.error(traceback.format_exc(1))
-
     # Initialize the Database Manager and load the world database.
     log.info("Initializing database manager...")
-    dbman = database.DatabaseManager(config["database"]["filename"], config.defaults)
+    dbman = database.DatabaseManager(config["database"]["filename"], config.defaults,
+                                     write_behind=config["database"].get("flush_interval", 0) > 0,
+                                     max_staleness=config["database"].get("max_staleness", 0),
+                                     backend=config["database"].get("backend", "tinydb"),
+                                     snapshot=config["database"].get("snapshot", False),
+                                     sparse=config["database"].get("sparse", False),
+                                     paged=config["database"].get("paged", False),
+                                     zone_size=config["database"].get("zone_size", 1000),
+                                     zone_budget=config["database"].get("zone_budget", 64),
+                                     instrument=config["database"].get("instrument", False))
     _dbres = dbman._startup()
     if not _dbres:
         # On failure, only remove the lockfile if its existence wasn't the cause.
@@ -356,8 +360,15 @@ def main():
         return 3
     log.info("Finished initializing database manager.")
 
+    # Initialize the backup manager. Backups are taken in the background once the reactor is running.
+    backups = backup.BackupManager(dbman, config["database"]["filename"], config["database"]["backups"],
+                                   max_age=config["database"].get("backup_max_age", 0),
+                                   compression=config["database"].get("backup_compression", "lzma"),
+                                   prune_legacy=config["database"].get("backup_prune_legacy", False))
+
     # Initialize the router.
     router = Router(config, dbman)
+    router.backups = backups
 
     # initialize the command shell.
     command_shell = shell.Shell(dbman, router)
@@ -395,11 +406,67 @@ def main():
 
     l = task.LoopingCall(timeflow)
     l.start(config["timegap"]) # call when specified in seconds
+
+    # In write-behind mode, periodically write held database changes to disk.
+    if config["database"].get("flush_interval", 0) > 0:
+        flusher = task.LoopingCall(dbman.flush)
+        flusher.start(config["database"]["flush_interval"], now=False)
+
+        # Changes are only checked for staleness when the next one is made, so also check every second.
+        if config["database"].get("max_staleness", 0) > 0:
+            staler = task.LoopingCall(dbman.flush_stale)
+            staler.start(1, now=False)
+
+    # With the journal backend, check every minute whether the journal should be folded into a new snapshot.
+    # The snapshot is written on a worker thread.
+    if config["database"].get("backend", "tinydb") == "journal":
+        compactor = task.LoopingCall(dbman.compact, config["database"].get("journal_threshold", 1048576),
+                                     reactor.callInThread)
+        compactor.start(60, now=False)
     
+    # Take a backup at startup, and then periodically if enabled. Backups are serialized, compressed, and written on a
+    # worker thread.
+    if backups.enabled:
+        if config["database"].get("backup_interval", 0) > 0:
+            backupper = task.LoopingCall(backups.backup, reactor.callInThread, reactor.callFromThread)
+            backupper.start(config["database"]["backup_interval"])
+        else:
+            reactor.callWhenRunning(backups.backup, reactor.callInThread, reactor.callFromThread)
+
+    # Measure how late the reactor runs a task scheduled at a short interval, and log lag spikes, if enabled.
+    lagmonitor = None
+    if "monitor" in config and config["monitor"].get("lag_interval", 0) > 0:
+        lagmonitor = monitor.LagMonitor(config["monitor"]["lag_interval"],
+                                        config["monitor"].get("lag_threshold", 0.25))
+        lagger = task.LoopingCall(lagmonitor.tick)
+        lagger.start(config["monitor"]["lag_interval"])
+
+    # Flag command lines that run over budget, with a stack sample taken on a background thread, if enabled.
+    if "monitor" in config and config["monitor"].get("command_budget", 0) > 0:
+        command_shell.watchdog = monitor.CommandWatchdog(config["monitor"]["command_budget"], dbman)
+        command_shell.watchdog.start()
+
+    # Periodically write the command stats, the database stats if instrumentation is on, and what the monitors saw,
+    # to a JSON file.
+    if "stats" in config and config["stats"].get("interval", 0) > 0:
+        def write_stats():
+            report = {"time": int(time.time()), "since": int(command_shell.stats.since),
+                      "commands": command_shell.stats.report()}
+            if dbman.stats:
+                report["database"] = dbman.stats.report()
+            if lagmonitor:
+                report["reactor"] = lagmonitor.report()
+            if command_shell.watchdog:
+                report["slow_commands"] = command_shell.watchdog.report()
+            if not stats.write_report(config["stats"]["file"], report):
+                log.error("Could not write stats file: {filename}", filename=config["stats"]["file"])
+        statswriter = task.LoopingCall(write_stats)
+        statswriter.start(config["stats"]["interval"], now=False)
+
     # Set up some initial mssp configs so we can report them correctly.
     config["mssp_info"]["CODEBASE"]=VERSION
-    config["mssp_info"]["PLAYERS"]=len(command_shell._database.users.all())
-    config["mssp_info"]["AREAS"]=len(command_shell._database.rooms.all())
+    config["mssp_info"]["PLAYERS"]=dbman.count("users")
+    config["mssp_info"]["AREAS"]=dbman.count("rooms")
     config["mssp_info"]["UPTIME"]=int(time.time())
     # End of mssp info fill.
     
@@ -412,8 +479,15 @@ def main():
     router._reactor = reactor
     if config["ircgateway"]["enabled"]: router.f.cmdshell=router.shell
     reactor.run()
-
-    # Shutting down.
+    if command_shell.watchdog:
+        command_shell.watchdog.stop()
+
+    # Shutting down. With the journal backend, leave a complete snapshot behind for faster startup and backups.
+    # Then write the binary snapshot, which lets the next startup skip parsing the database, and close the database.
+    dbman.flush()
+    dbman.compact()
+    dbman.write_snapshot()
+    dbman.close()
     dbman._unlock()
     print("End Program.")
     return 0
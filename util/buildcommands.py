@@ -0,0 +1,86 @@
+#######################
+# Dennis MUD          #
+# buildcommands.py    #
+# Copyright 2021      #
+# Michael D. Reiley   #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+# This is the Dennis 2D Command Builder, which compiles every command module to cached bytecode and writes
+# the command manifest, so the server can start without importing any command modules. To use it, copy it
+# into your main Dennis directory and run it after installing or changing commands. The server also brings
+# the manifest up to date by itself whenever a command changes, but then has to import that command at startup.
+
+import compileall
+import os
+import sys
+import time
+
+try:
+    from lib import shell
+except:
+    print("Can't find the shell module. You should move this script to the Dennis root directory.")
+    sys.exit(1)
+
+
+def main():
+    """Main Program
+    """
+    print("Dennis 2D Command Builder")
+
+    # Check command line arguments, and give help if needed.
+    if len(sys.argv) > 1:
+        print("This builder compiles the command modules and writes the command manifest.")
+        print("Usage: {0}".format(sys.argv[0]))
+        return 0
+
+    # Make sure we are in the Dennis root directory.
+    if not os.path.isdir(shell.COMMAND_DIR):
+        print("Can't find the command directory: {0}".format(shell.COMMAND_DIR))
+        return 2
+
+    # Compile the command modules.
+    start = time.time()
+    if not compileall.compile_dir(shell.COMMAND_DIR, maxlevels=0, quiet=1):
+        print("Some command modules could not be compiled.")
+        return 3
+
+    # Throw away the old manifest, and load every command module to write a new one.
+    if os.path.exists(shell.MANIFEST_FILE):
+        os.remove(shell.MANIFEST_FILE)
+    shell.Shell(None, None)
+    manifest = shell.read_manifest()
+    if not manifest["commands"]:
+        print("Could not write the command manifest: {0}".format(shell.MANIFEST_FILE))
+        return 4
+
+    # Report what happened.
+    for cname, cname2 in manifest["overlaps"]:
+        print("Overlapping command names: {0}, {1}".format(cname, cname2))
+    print("Successfully built {0} commands in {1:.2f} seconds: {2}".format(len(manifest["commands"]),
+                                                                             time.time() - start,
+                                                                             shell.MANIFEST_FILE))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+############################
+# Dennis MUD               #
+# dbconvert_json-sqlite.py #
+# Copyright 2021           #
+# Michael D. Reiley        #
+############################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+# This is the Dennis 2D Database Converter for moving a TinyDB JSON world into the SQLite backend.
+# To use it, copy it into your main Dennis directory and run it with the JSON database filename
+# and the new SQLite database filename as its arguments. Afterward, set the database backend
+# option in server.config.json to "sqlite" and point the database filename at the new file.
+
+from os import path
+import sys
+import time
+
+from tinydb.storages import JSONStorage
+
+try:
+    from lib.storage import SQLiteStorage
+except:
+    print("Can't find the storage module. You should move this script to the Dennis root directory.")
+    sys.exit(1)
+
+
+def convert(source, dest):
+    """Copy every table of a TinyDB JSON database into an SQLite database.
+
+    Document IDs are kept, so the converted world is identical to the original.
+
+    :param source: The filename of the TinyDB JSON database to read.
+    :param dest: The filename of the SQLite database to write.
+
+    :return: True if succeeded, False if the JSON database was empty.
+    """
+    # Read the whole JSON database in one go.
+    jsonstore = JSONStorage(source, access_mode='r')
+    tables = jsonstore.read()
+    jsonstore.close()
+    if not tables:
+        print("The JSON database is empty.")
+        return False
+
+    # Write all of the tables to the SQLite database in a single transaction.
+    sqlstore = SQLiteStorage(dest)
+    sqlstore.write(tables)
+    sqlstore.close()
+
+    for table in sorted(tables.keys()):
+        print("Converted {0} documents in table: {1}".format(len(tables[table]), table))
+    return True
+
+
+def main():
+    """Main Program
+    """
+    print("Dennis 2D Database Converter JSON -> SQLite")
+
+    # Check command line arguments, and give help if needed.
+    if len(sys.argv) != 3 or sys.argv[1] in ["help", "-h", "--help", "-help", "?", "-?"]:
+        print("This converter copies a TinyDB JSON world database into a new SQLite world database.")
+        print("Usage: {0} <json database> <sqlite database>".format(sys.argv[0]))
+        return 0
+
+    # Make sure the source database file exists.
+    if not path.exists(sys.argv[1]):
+        print("Database file does not exist: {0}".format(sys.argv[1]))
+        return 2
+
+    # Don't overwrite an existing world.
+    if path.exists(sys.argv[2]):
+        print("Destination file already exists: {0}".format(sys.argv[2]))
+        return 2
+
+    # Make sure neither database is in use.
+    for filename in sys.argv[1:]:
+        if path.exists(filename + ".lock"):
+            print("Lockfile exists for database: {0}".format(filename))
+            return 3
+
+    # Run the conversion.
+    print("Converting database...")
+    start = time.time()
+    if not convert(sys.argv[1], sys.argv[2]):
+        return 3
+
+    # Finished.
+    print("Successfully converted database in {0:.2f} seconds: {1} -> {2}".format(time.time() - start, sys.argv[1],
+                                                                                 sys.argv[2]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+#######################
+# Dennis MUD          #
+# dbexport.py         #
+# Copyright 2021      #
+# Michael D. Reiley   #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+# This is the Dennis 2D World Exporter, which writes the rooms, items, and users of a world database to a
+# JSON Lines file that can be merged into another world with dbimport.py. To use it, copy it into your main
+# Dennis directory and run it with the database filename and the export filename as its arguments.
+# Use --owner=NAME to export only what a user owns, and --zone=LOW-HIGH to export only a range of IDs.
+# The database must not be in use by a running server.
+
+from os import path
+import sys
+import time
+
+try:
+    from lib import transfer
+    from lib.database import BACKENDS
+except:
+    print("Can't find the transfer module. You should move this script to the Dennis root directory.")
+    sys.exit(1)
+
+
+def main():
+    """Main Program
+    """
+    print("Dennis 2D World Exporter")
+
+    # Separate the options from the other arguments.
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].partition("=")[::2] for arg in sys.argv[1:] if arg.startswith("--"))
+    backend = options.get("backend", "tinydb")
+    tables = options.get("tables", ",".join(transfer.TABLES)).split(",")
+    zone = options.get("zone", "0-0").split("-")
+
+    # Check command line arguments, and give help if needed.
+    if len(args) != 2 or args[0] in ["help", "-h", "-help", "?", "-?"] or "help" in options \
+            or backend not in BACKENDS or not set(tables) <= set(transfer.TABLES) \
+            or len(zone) != 2 or not all(bound.isdigit() for bound in zone) \
+            or not options.get("batch", "1").isdigit():
+        print("This exporter writes the rooms, items, and users of a world database to a JSON Lines file.")
+        print("Usage: {0} [--owner=NAME] [--zone=LOW-HIGH] [--tables=rooms,items,users] [--batch=N] "
+              "[--backend=tinydb|sqlite|journal] <database> <export>".format(sys.argv[0]))
+        return 0
+
+    # Make sure the database file exists and isn't in use, and the export file doesn't exist.
+    # Opening a journal repairs it, which would cut off a write by a running server.
+    if not path.exists(args[0]):
+        print("Database file does not exist: {0}".format(args[0]))
+        return 2
+    if path.exists(args[0] + ".lock"):
+        print("Lockfile exists for database: {0}".format(args[0]))
+        return 4
+    if path.exists(args[1]):
+        print("Export file already exists: {0}".format(args[1]))
+        return 3
+
+    # Write the export.
+    start = time.time()
+    storage = BACKENDS[backend](args[0])
+    with open(args[1], "w") as outfile:
+        counts = transfer.export_world(storage, outfile, tables=tables, owner=options.get("owner"),
+                                       zone=tuple(int(bound) for bound in zone) if "zone" in options else None,
+                                       batch=max(int(options.get("batch", 1000)), 1))
+    storage.close()
+
+    # Report what happened.
+    for tablename in tables:
+        print("{0}: {1} exported".format(tablename, counts[tablename]))
+    print("Successfully exported world in {0:.2f} seconds: {1}".format(time.time() - start, args[1]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
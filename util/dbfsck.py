@@ -0,0 +1,92 @@
+#######################
+# Dennis MUD          #
+# dbfsck.py           #
+# Copyright 2021      #
+# Michael D. Reiley   #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+# This is the Dennis 2D Database Checker, which looks for broken references between the rooms, exits,
+# items, and users of a world database. To use it, copy it into your main Dennis directory and run it
+# with the database filename as its argument. Use --repair to fix every problem found in a single write.
+# Large worlds are checked across several processes; use --workers=N to choose how many.
+
+from os import path
+import os
+import sys
+import time
+
+try:
+    from lib import fsck
+    from lib.database import BACKENDS
+    from lib.storage import rehydrate_tables
+except:
+    print("Can't find the checker module. You should move this script to the Dennis root directory.")
+    sys.exit(1)
+
+
+def main():
+    """Main Program
+    """
+    print("Dennis 2D Database Checker")
+
+    # Separate the options from the other arguments.
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].partition("=")[::2] for arg in sys.argv[1:] if arg.startswith("--"))
+    backend = options.get("backend", "tinydb")
+
+    # Check command line arguments, and give help if needed.
+    if len(args) != 1 or args[0] in ["help", "-h", "-help", "?", "-?"] or "help" in options \
+            or backend not in BACKENDS or not options.get("workers", "1").isdigit():
+        print("This checker finds and optionally repairs broken references in a world database.")
+        print("Usage: {0} [--repair] [--workers=N] [--backend=tinydb|sqlite|journal] <database>".format(sys.argv[0]))
+        return 0
+
+    # Make sure the database file exists and isn't in use.
+    if not path.exists(args[0]):
+        print("Database file does not exist: {0}".format(args[0]))
+        return 2
+    if path.exists(args[0] + ".lock"):
+        print("Lockfile exists for database: {0}".format(args[0]))
+        return 3
+
+    # Read the whole database and check it.
+    start = time.time()
+    storage = BACKENDS[backend](args[0])
+    tables = rehydrate_tables(storage.read() or {}, shared=False)
+    issues = fsck.check(tables, workers=int(options.get("workers", os.cpu_count() or 1)))
+    for kind, table, key, detail, repairs in issues:
+        print("{0}: {1} {2}: {3}".format(fsck.CHECKS[kind], table[:-1], key, detail))
+    print("Found {0} problems in {1:.2f} seconds.".format(len(issues), time.time() - start))
+
+    # Repair everything in memory, then write the database once.
+    if issues and "repair" in options:
+        documents = fsck.keyed(tables)
+        changed = fsck.repair(issues, lambda table, key: documents[table].get(key))
+        storage.write(tables)
+        print("Repaired {0} documents: {1}".format(len(changed), args[0]))
+    storage.close()
+    return 1 if issues and "repair" not in options else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+#######################
+# Dennis MUD          #
+# dbimport.py         #
+# Copyright 2021      #
+# Michael D. Reiley   #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+# This is the Dennis 2D World Importer, which merges a JSON Lines file written by dbexport.py into a world
+# database, in batches of documents that are each written in a single transaction. To use it, copy it into
+# your main Dennis directory and run it with the database filename and the export filename as its arguments.
+# Use --remap to give the imported rooms and items new IDs, so they can't replace anything in the world.
+
+from os import path
+import json
+import sys
+import time
+
+try:
+    from lib import transfer
+    from lib.database import BACKENDS, DatabaseManager
+except:
+    print("Can't find the transfer module. You should move this script to the Dennis root directory.")
+    sys.exit(1)
+
+
+def main():
+    """Main Program
+    """
+    print("Dennis 2D World Importer")
+
+    # Separate the options from the other arguments.
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].partition("=")[::2] for arg in sys.argv[1:] if arg.startswith("--"))
+    backend = options.get("backend", "tinydb")
+
+    # Check command line arguments, and give help if needed.
+    if len(args) != 2 or args[0] in ["help", "-h", "-help", "?", "-?"] or "help" in options \
+            or backend not in BACKENDS or not options.get("batch", "1").isdigit():
+        print("This importer merges a world export into a world database.")
+        print("Usage: {0} [--remap] [--batch=N] [--defaults=defaults.config.json] "
+              "[--backend=tinydb|sqlite|journal] <database> <export>".format(sys.argv[0]))
+        return 0
+
+    # Make sure the export file exists. The database manager makes sure the database isn't in use.
+    if not path.exists(args[1]):
+        print("Export file does not exist: {0}".format(args[1]))
+        return 2
+    try:
+        with open(options.get("defaults", "defaults.config.json")) as defaultsfile:
+            defaults = json.load(defaultsfile)
+    except:
+        print("Could not read defaults config file: {0}".format(options.get("defaults", "defaults.config.json")))
+        return 2
+
+    # Open the world database.
+    database = DatabaseManager(args[0], defaults, backend=backend)
+    if not database._startup():
+        print("Could not open database, or it is in use: {0}".format(args[0]))
+        return 3
+
+    # Merge in the export.
+    start = time.time()
+    try:
+        with open(args[1]) as infile:
+            counts = transfer.import_world(database, infile, remap="remap" in options,
+                                           batch=max(int(options.get("batch", 1000)), 1))
+        database.flush()
+    finally:
+        database._unlock()
+    if counts is None:
+        return 4
+
+    # Report what happened.
+    for tablename in transfer.TABLES:
+        print("{0}: {1} imported".format(tablename, counts[tablename]))
+    if counts["skipped"]:
+        print("users: {0} skipped, since they already exist".format(counts["skipped"]))
+    if counts["orphans"]:
+        print("items: {0} skipped, since only users who were skipped held them".format(counts["orphans"]))
+    print("Successfully imported world in {0:.2f} seconds: {1}".format(time.time() - start, args[0]))
+    if "remap" in options:
+        print("References to rooms and items outside the export were kept. Run dbfsck.py to check them.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
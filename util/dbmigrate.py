@@ -0,0 +1,86 @@
+#######################
+# Dennis MUD          #
+# dbmigrate.py        #
+# Copyright 2021      #
+# Michael D. Reiley   #
+#######################
+
+# **********
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to
+# deal in the Software without restriction, including without limitation the
+# rights to use, copy, modify, merge, publish, distribute, sublicense, and/or
+# sell copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING
+# FROM, OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+# **********
+
+# This is the Dennis 2D Database Migrator, which upgrades a world database of any older version to the
+# current version in a single pass. To use it, copy it into your main Dennis directory and run it with
+# the database filename as its argument. Use --dry-run to see what would change without writing anything.
+
+from os import path
+import sys
+
+try:
+    from lib import migration
+    from lib.database import BACKENDS, DB_VERSION
+except:
+    print("Can't find the migration module. You should move this script to the Dennis root directory.")
+    sys.exit(1)
+
+
+def main():
+    """Main Program
+    """
+    print("Dennis 2D Database Migrator -> v{0}".format(DB_VERSION))
+
+    # Separate the options from the other arguments.
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    options = dict(arg[2:].partition("=")[::2] for arg in sys.argv[1:] if arg.startswith("--"))
+    backend = options.get("backend", "tinydb")
+
+    # Check command line arguments, and give help if needed.
+    if len(args) != 1 or args[0] in ["help", "-h", "-help", "?", "-?"] or "help" in options \
+            or backend not in BACKENDS:
+        print("This migrator upgrades a world database from any older version to the current version.")
+        print("Usage: {0} [--dry-run] [--backend=tinydb|sqlite|journal] <database>".format(sys.argv[0]))
+        return 0
+
+    # Make sure the database file exists.
+    if not path.exists(args[0]):
+        print("Database file does not exist: {0}".format(args[0]))
+        return 2
+
+    # Run the migration.
+    runner = migration.MigrationRunner(args[0], backend=backend, dry_run="dry-run" in options)
+    result = runner.run()
+    if not result:
+        return 3
+
+    # Report what happened.
+    if result[0] == result[1]:
+        print("Database is already v{0}, nothing to do: {1}".format(result[1], args[0]))
+        return 0
+    for name in sorted(runner.counts):
+        print("{0}: {1} changed".format(name, runner.counts[name]))
+    if "dry-run" in options:
+        print("Dry run finished in {0:.2f} seconds, nothing was written: v{1} -> v{2}".format(runner.elapsed, *result))
+    else:
+        print("Successfully migrated database in {0:.2f} seconds from v{1} to v{2}: {3}".format(runner.elapsed, *result,
+                                                                                                 args[0]))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -29,87 +29,22 @@
 # To use it, copy it into your main Dennis directory and run it
 # with the database filename as its only argument. This updater
 # adds entrance records to rooms.
+# It runs the v2 step of the migration framework. To migrate across several
+# versions at once, use dbmigrate.py instead.
 
 from os import path
 import sys
 
-from tinydb import Query
-
 try:
-    from lib import database
+    from lib import migration
 except:
-    print("Can't find DatabaseManager. You should move this script to the Dennis root directory.")
+    print("Can't find the migration module. You should move this script to the Dennis root directory.")
     sys.exit(1)
 
 
 UPDATE_TO_VERSION = 2
 
 
-# DatabaseManager will expect a logger, so we'll give it this stump.
-class Log:
-    """Stand-in for Twisted's logger.
-    """
-    def debug(self, msg, **kwargs):
-        print("[cli#debug]", msg.format(**kwargs))
-
-    def info(self, msg, **kwargs):
-        print("[cli#info]", msg.format(**kwargs))
-
-    def warn(self, msg, **kwargs):
-        print("[cli#warn]", msg.format(**kwargs))
-
-    def error(self, msg, **kwargs):
-        print("[cli#error]", msg.format(**kwargs))
-
-    def critical(self, msg, **kwargs):
-        print("[cli#critical]", msg.format(**kwargs))
-
-
-def dbupdate_v1_to_v2(dbman):
-    """Database Updater for v1 to v2.
-
-    This update adds an empty "entrances" field to every room, and then combs through the exits
-    of every room in the world to populate the entrance records.
-
-    This is needed for the `list entrances` command to not take several seconds on larger worlds.
-    """
-    # Counters and variables.
-    ri = 0
-    exi = 0
-    eni = 0
-    rooms = dbman.rooms.all()
-    q = Query()
-
-    # Perform the updates.
-    if len(rooms):
-        # Add an empty entrance field to every room.
-        for thisroom in rooms:
-            thisroom["entrances"] = []
-            dbman.upsert_room(thisroom)
-        print("Added an empty entrance field to {0} rooms.".format(len(rooms)))
-
-        # Process the exits of every room to populate the corresponding entrance records.
-        for thisroom in rooms:
-            ri += 1
-            for ex in thisroom["exits"]:
-                exi += 1
-                destroom = dbman.room_by_id(ex["dest"])
-                if thisroom["id"] not in destroom["entrances"]:
-                    eni += 1
-                    destroom["entrances"].append(thisroom["id"])
-                    dbman.upsert_room(destroom)
-        print("Processed {0} exits in {1} rooms and added {2} entrance records.".format(exi, ri, eni))
-
-        # We are finished, so update the database version record.
-        info_record = dbman._info.all()[0]
-        info_record["version"] = UPDATE_TO_VERSION
-        dbman._info.upsert(info_record, q.version == dbman._UPDATE_FROM_VERSION)
-
-    # The database is actually empty somehow. Do nothing.
-    else:
-        print("No rooms.")
-
-
 def main():
     """Main Program
     """
@@ -124,21 +59,19 @@ def main():
     # Make sure the database file exists.
     if not path.exists(sys.argv[1]):
         print("Database file does not exist: {0}".format(sys.argv[1]))
-        return 1
-
-    # Start up DatabaseManager and tell it we're accepting a v1 database for migration.
-    dbman = database.DatabaseManager(sys.argv[1], Log())
-    dbman._UPDATE_FROM_VERSION = 1
-    sres = dbman._startup()
-    if not sres:
-        return 1
+        return 2
 
-    # Run the updates for this migration.
-    dbupdate_v1_to_v2(dbman)
+    # Run the updates for this migration, accepting only a v1 database.
+    print("Performing database updates...")
+    runner = migration.MigrationRunner(sys.argv[1])
+    if not runner.run(target=UPDATE_TO_VERSION, source=UPDATE_TO_VERSION - 1):
+        return 3
+    for name in sorted(runner.counts):
+        print("{0}: {1} changed".format(name, runner.counts[name]))
 
     # Finished.
     print("Successfully updated database from v1 to v2: {0}".format(sys.argv[1]))
-    dbman._unlock()
+    return 0
 
 
 if __name__ == "__main__":
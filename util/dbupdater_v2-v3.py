@@ -29,71 +29,22 @@
 # To use it, copy it into your main Dennis directory and run it
 # with the database filename as its only argument. This updater
 # adds a telekey field to all items.
+# It runs the v3 step of the migration framework. To migrate across several
+# versions at once, use dbmigrate.py instead.
 
 from os import path
 import sys
 
-from tinydb import Query
-
 try:
-    from lib import database
+    from lib import migration
 except:
-    print("Can't find DatabaseManager. You should move this script to the Dennis root directory.")
+    print("Can't find the migration module. You should move this script to the Dennis root directory.")
     sys.exit(1)
 
 
 UPDATE_TO_VERSION = 3
 
 
-# DatabaseManager will expect a logger, so we'll give it this stump.
-class Log:
-    """Stand-in for Twisted's logger.
-    """
-    def debug(self, msg, **kwargs):
-        print("[cli#debug]", msg.format(**kwargs))
-
-    def info(self, msg, **kwargs):
-        print("[cli#info]", msg.format(**kwargs))
-
-    def warn(self, msg, **kwargs):
-        print("[cli#warn]", msg.format(**kwargs))
-
-    def error(self, msg, **kwargs):
-        print("[cli#error]", msg.format(**kwargs))
-
-    def critical(self, msg, **kwargs):
-        print("[cli#critical]", msg.format(**kwargs))
-
-
-def dbupdate_v2_to_v3(dbman):
-    """Database Updater for v2 to v3.
-
-    This update adds an empty "telekey" field to all items.
-
-    This is needed for telekeys.
-    """
-    # Counters and variables.
-    items = dbman.items.all()
-    q = Query()
-
-    # Perform the updates.
-    if len(items):
-        # Add an empty telekey field to every item.
-        for thisitem in items:
-            thisitem["telekey"] = None
-            dbman.upsert_item(thisitem)
-        print("Added an empty telekey field to {0} items.".format(len(items)))
-
-        # We are finished, so update the database version record.
-        info_record = dbman._info.all()[0]
-        info_record["version"] = UPDATE_TO_VERSION
-        dbman._info.upsert(info_record, q.version == dbman._UPDATE_FROM_VERSION)
-
-    # The database is actually empty. Do nothing.
-    else:
-        print("No items.")
-
-
 def main():
     """Main Program
     """
@@ -110,19 +61,17 @@ def main():
         print("Database file does not exist: {0}".format(sys.argv[1]))
         return 2
 
-    # Start up DatabaseManager and tell it we're accepting a v2 database for migration.
-    dbman = database.DatabaseManager(sys.argv[1], Log())
-    dbman._UPDATE_FROM_VERSION = 2
-    sres = dbman._startup()
-    if not sres:
+    # Run the updates for this migration, accepting only a v2 database.
+    print("Performing database updates...")
+    runner = migration.MigrationRunner(sys.argv[1])
+    if not runner.run(target=UPDATE_TO_VERSION, source=UPDATE_TO_VERSION - 1):
         return 3
-
-    # Run the updates for this migration.
-    dbupdate_v2_to_v3(dbman)
+    for name in sorted(runner.counts):
+        print("{0}: {1} changed".format(name, runner.counts[name]))
 
     # Finished.
     print("Successfully updated database from v2 to v3: {0}".format(sys.argv[1]))
-    dbman._unlock()
+    return 0
 
 
 if __name__ == "__main__":
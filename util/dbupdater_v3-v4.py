@@ -29,71 +29,22 @@
 # To use it, copy it into your main Dennis directory and run it
 # with the database filename as its only argument. This updater
 # adds a neutral pronouns field to all users.
+# It runs the v4 step of the migration framework. To migrate across several
+# versions at once, use dbmigrate.py instead.
 
 from os import path
 import sys
 
-from tinydb import Query
-
 try:
-    from lib import database
+    from lib import migration
 except:
-    print("Can't find DatabaseManager. You should move this script to the Dennis root directory.")
+    print("Can't find the migration module. You should move this script to the Dennis root directory.")
     sys.exit(1)
 
 
 UPDATE_TO_VERSION = 4
 
 
-# DatabaseManager will expect a logger, so we'll give it this stump.
-class Log:
-    """Stand-in for Twisted's logger.
-    """
-    def debug(self, msg, **kwargs):
-        print("[dbupdater#debug]", msg.format(**kwargs))
-
-    def info(self, msg, **kwargs):
-        print("[dbupdater#info]", msg.format(**kwargs))
-
-    def warn(self, msg, **kwargs):
-        print("[dbupdater#warn]", msg.format(**kwargs))
-
-    def error(self, msg, **kwargs):
-        print("[dbupdater#error]", msg.format(**kwargs))
-
-    def critical(self, msg, **kwargs):
-        print("[dbupdater#critical]", msg.format(**kwargs))
-
-
-def dbupdate_v3_to_v4(dbman):
-    """Database Updater for v3 to v4.
-
-    This update adds an neutral "pronouns" field to all users.
-
-    This is needed for pronouns used in formatting posturing text.
-    """
-    # Counters and variables.
-    users = dbman.users.all()
-    q = Query()
-
-    # Perform the updates.
-    if len(users):
-        # Add a neutral pronouns field to every user.
-        for thisuser in users:
-            thisuser["pronouns"] = "neutral"
-            dbman.upsert_user(thisuser)
-        print("Added a neutral pronouns field to {0} users.".format(len(users)))
-
-        # We are finished, so update the database version record.
-        info_record = dbman._info.all()[0]
-        info_record["version"] = UPDATE_TO_VERSION
-        dbman._info.upsert(info_record, q.version == dbman._UPDATE_FROM_VERSION)
-
-    # The database is actually empty. Do nothing.
-    else:
-        print("No users.")
-
-
 def main():
     """Main Program
     """
@@ -110,20 +61,17 @@ def main():
         print("Database file does not exist: {0}".format(sys.argv[1]))
         return 2
 
-    # Start up DatabaseManager and tell it we're accepting a v3 database for migration to v4.
-    dbman = database.DatabaseManager(sys.argv[1], Log())
-    dbman._UPDATE_FROM_VERSION = 3
-    sres = dbman._startup()
-    if not sres:
-        return 3
-
-    # Run the updates for this migration.
+    # Run the updates for this migration, accepting only a v3 database.
     print("Performing database updates...")
-    dbupdate_v3_to_v4(dbman)
+    runner = migration.MigrationRunner(sys.argv[1])
+    if not runner.run(target=UPDATE_TO_VERSION, source=UPDATE_TO_VERSION - 1):
+        return 3
+    for name in sorted(runner.counts):
+        print("{0}: {1} changed".format(name, runner.counts[name]))
 
     # Finished.
     print("Successfully updated database from v3 to v4: {0}".format(sys.argv[1]))
-    dbman._unlock()
+    return 0
 
 
 if __name__ == "__main__":
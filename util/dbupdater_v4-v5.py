@@ -29,74 +29,22 @@
 # To use it, copy it into your main Dennis directory and run it
 # with the database filename as its only argument. This updater
 # adds an entrance action field to all exits.
+# It runs the v5 step of the migration framework. To migrate across several
+# versions at once, use dbmigrate.py instead.
 
 from os import path
 import sys
 
-from tinydb import Query
-
 try:
-    from lib import database
+    from lib import migration
 except:
-    print("Can't find DatabaseManager. You should move this script to the Dennis root directory.")
+    print("Can't find the migration module. You should move this script to the Dennis root directory.")
     sys.exit(1)
 
 
 UPDATE_TO_VERSION = 5
 
 
-# DatabaseManager will expect a logger, so we'll give it this stump.
-class Log:
-    """Stand-in for Twisted's logger.
-    """
-    def debug(self, msg, **kwargs):
-        print("[dbupdater#debug]", msg.format(**kwargs))
-
-    def info(self, msg, **kwargs):
-        print("[dbupdater#info]", msg.format(**kwargs))
-
-    def warn(self, msg, **kwargs):
-        print("[dbupdater#warn]", msg.format(**kwargs))
-
-    def error(self, msg, **kwargs):
-        print("[dbupdater#error]", msg.format(**kwargs))
-
-    def critical(self, msg, **kwargs):
-        print("[dbupdater#critical]", msg.format(**kwargs))
-
-
-def dbupdate_v4_to_v5(dbman):
-    """Database Updater for v4 to v5.
-
-    This update adds entrance action fields to all exits.
-
-    This is needed for a custom action on entering the destination room.
-    """
-    # Counters and variables.
-    rooms = dbman.rooms.all()
-    q = Query()
-    exc = 0
-
-    # Perform the updates.
-    if len(rooms):
-        # Add an entrance action field to every exit.
-        for thisroom in rooms:
-            for exitid in range(len(thisroom["exits"])):
-                thisroom["exits"][exitid]["action"]["entrance"] = ""
-                exc += 1
-            dbman.upsert_room(thisroom)
-        print("Added an entrance action field to {0} exits in {1} rooms.".format(exc, len(rooms)))
-
-        # We are finished, so update the database version record.
-        info_record = dbman._info.all()[0]
-        info_record["version"] = UPDATE_TO_VERSION
-        dbman._info.upsert(info_record, q.version == dbman._UPDATE_FROM_VERSION)
-
-    # The database is actually empty. Do nothing.
-    else:
-        print("No users.")
-
-
 def main():
     """Main Program
     """
@@ -113,20 +61,17 @@ def main():
         print("Database file does not exist: {0}".format(sys.argv[1]))
         return 2
 
-    # Start up DatabaseManager and tell it we're accepting a v4 database for migration to v5.
-    dbman = database.DatabaseManager(sys.argv[1], Log())
-    dbman._UPDATE_FROM_VERSION = 4
-    sres = dbman._startup()
-    if not sres:
-        return 3
-
-    # Run the updates for this migration.
+    # Run the updates for this migration, accepting only a v4 database.
     print("Performing database updates...")
-    dbupdate_v4_to_v5(dbman)
+    runner = migration.MigrationRunner(sys.argv[1])
+    if not runner.run(target=UPDATE_TO_VERSION, source=UPDATE_TO_VERSION - 1):
+        return 3
+    for name in sorted(runner.counts):
+        print("{0}: {1} changed".format(name, runner.counts[name]))
 
     # Finished.
     print("Successfully updated database from v4 to v5: {0}".format(sys.argv[1]))
-    dbman._unlock()
+    return 0
 
 
 if __name__ == "__main__":